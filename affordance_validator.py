@@ -1,72 +1,24 @@
 from __future__ import annotations
-import json, math, re
+import math, re
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, Iterable, Iterator, List, Tuple
 
 import parse_cam_formulary as cam
+import tracing
+from mechanics import limit_issues, machine_limits, material_constants, step_mechanics
+from plan_parser import PlanStreamParser, _strategy, parse_txt_plan, rewrite_fields   # re-exported
 
 
 TOL_PCT = 0.05     # Soft limits
-
-_STEP_HDR = re.compile(
-    r"""
-    ^\s*
-    (?:\#+\s*)?          # markdown header (optional)
-    (\d+)                # step number
-    [\.\)]\s*
-    (?:\*\*|__)?         # opening bold (optional)
-    ([^*\n]+?)           # TITLE (group-2 !)
-    (?:\*\*|__)?         # closing bold (optional)
-    \s*$
-    """,
-    re.MULTILINE | re.VERBOSE,
-)
+MIN_VF = 10        # mm/min; drilling feed is never corrected below this
 
 _NUM = re.compile(r"([\d\.]+)")
 
-def _strategy(text: str, op_line: str = "") -> str:
-    txt = f"{text} {op_line}".lower()
-    if any(k in txt for k in ("finish", "finishing", "swarf", "semi-finish", "contour", "contouring", "taper", "tapering", "profile", "profiling")):
-        return "finishing"
-    if any(k in txt for k in ("drill", "bore", "ream", "reamer", "tapping", "tap")):
-        return "drilling"
-    if any(k in txt for k in ("slot", "slotting", "slitting", "groove", "grooving", "keyway", "keywaying", "pocket", "pocketing")):
-        return "slotting"
-    return "roughing"
-
-def parse_txt_plan(text: str) -> List[Dict]:
-    steps: List[Dict] = []
-    headers = list(_STEP_HDR.finditer(text))
-    for i, h in enumerate(headers):
-        blk  = text[h.end(): headers[i + 1].start() if i + 1 < len(headers) else len(text)]
-        step_title = h.group(2).strip()
-        op_match  = re.search(r"Operation\s*:\s*([^\n]+)", blk, re.I)
-        op_line   = op_match.group(1) if op_match else ""
-        step = {
-            "step": step_title,
-            "strategy": _strategy(step_title, op_line)   # <── passa anche op_line
-        }
-        patt = {
-            "tool_id": r"Tool.*ID:\s*(\d+)",
-            "tool_dia": r"D\s*=\s*(\d+\.?\d*)\s*mm",
-            "n":        r"Spindle Speed.*?:\s*(\d+)\s*RPM",
-            "vf":       r"Feedrate.*?:\s*(\d+)\s*mm/min",
-            "ap":       r"Depth/Pass.*?:\s*(\d+\.?\d*)\s*mm",
-            "ae":       r"Side Engagement.*?:\s*(\d+\.?\d*)\s*mm",
-        }
-        for k, pat in patt.items():
-            m = re.search(pat, blk, re.I)
-            if m:
-                step[k] = float(m.group(1)) if "." in m.group(1) else int(m.group(1))
-        if "tool_id" in step:
-            steps.append(step)
-            
-        print(f"[DEBUG] Parsed {len(steps)} steps.") # debug - comment this line if not needed
-
-    return steps
-
 
 def _find_tool(tid: int, tools: List[Dict]) -> Dict:
+    by_id = getattr(tools, "by_id", None)        # machine_registry.ToolLibrary
+    if by_id is not None:
+        return by_id.get(tid, {})
     return next((t for t in tools if t.get("id") == tid), {})
 
 def _calc_values(step: Dict, tool: Dict) -> Dict[str, float]:
@@ -91,7 +43,9 @@ def _out_of_band(value, lo, hi):
     hi_soft = hi * (1 + TOL_PCT)
     return value < lo_soft or value > hi_soft
 
-def validate_step(step: Dict, machine: Dict, mat_tag: str, tools: List[Dict]) -> Tuple[bool, List[str]]:
+def validate_step(step: Dict, machine: Dict, mat_tag: str, tools: List[Dict],
+                  formulary: cam.Formulary | None = None,
+                  mech: Dict[str, float] | None = None) -> Tuple[bool, List[str]]:
     tool  = _find_tool(step.get("tool_id"), tools)
     skip_ae = step["strategy"] == "drilling" or tool.get("type") == "ballmill"
     calc  = _calc_values(step, tool)
@@ -106,7 +60,7 @@ def validate_step(step: Dict, machine: Dict, mat_tag: str, tools: List[Dict]) ->
         issues.append("ap exceeds tool LOC"); ok=False
     
     # material limits
-    lim   = cam.get_limits_for(mat_tag)
+    lim   = cam.get_limits_for(mat_tag, formulary)
     strat = step["strategy"]
     Vc_lo, Vc_hi = lim["Vc"]
     fz_lo, fz_hi = lim["fz_finish"] if strat == "finishing" else lim["fz_rough"]
@@ -124,7 +78,7 @@ def validate_step(step: Dict, machine: Dict, mat_tag: str, tools: List[Dict]) ->
             )
 
     # engagement ratios
-    eng = cam.get_engagement_limits(strat)
+    eng = cam.get_engagement_limits(strat, formulary)
     if calc["D"] and not skip_ae:
         apR = step.get("ap", 0) / calc["D"]
         aeR = step.get("ae", 0) / calc["D"]
@@ -134,8 +88,79 @@ def validate_step(step: Dict, machine: Dict, mat_tag: str, tools: List[Dict]) ->
             issues.append(f"ap/D {apR:.2f} outside [{ap_lo:.2f},{ap_hi:.2f}]")
         if _out_of_band(aeR, ae_lo, ae_hi):
             issues.append(f"ae/D {aeR:.2f} outside [{ae_lo:.2f},{ae_hi:.2f}]")
+
+    # spindle power / torque and drill thrust (mechanics.py)
+    load = limit_issues(mech or step_mechanics(step, tool, mat_tag, formulary), machine_limits(machine))
+    if load:
+        issues += load; ok = False
     return ok, issues
 
+def _clamp(value, lo, hi):
+    return min(max(value, lo), hi)
+
+def suggest_corrections(step: Dict, machine: Dict, mat_tag: str, tool: Dict,
+                        formulary: cam.Formulary | None = None) -> Dict[str, float]:
+    """
+    Nearest compliant n / vf / ap / ae of a step – only the fields that change.
+
+    n is moved into the Vc band and under the machine rpm limit; vf keeps the
+    chip load (or moves it into the f_z band) and stays under the feed limit;
+    ap / ae are clamped to the engagement band and ap to the tool LOC; then ap
+    (milling) or vf (drilling) is lowered until spindle power, torque and
+    thrust fit the machine; vf is not lowered below MIN_VF.  What parameters
+    cannot fix (e.g. a tool too small to reach the Vc band at max rpm, or a
+    drill the spindle cannot drive even at MIN_VF) is left as it is.
+    """
+    calc = _calc_values(step, tool)
+    D, z = calc["D"], calc["z"] or 1
+    if not D:
+        return {}
+    lim, strat = cam.get_limits_for(mat_tag, formulary), step["strategy"]
+    vc_lo, vc_hi = lim["Vc"]
+    fz_lo, fz_hi = lim["fz_finish"] if strat == "finishing" else lim["fz_rough"]
+    max_rpm = machine.get("max_spindle_rpm", 9e9)
+    max_feed = machine.get("max_feed_rate", 9e9)
+
+    n, vf, fz = step.get("n", 0), step.get("vf", 0), calc["fz"]
+    if _out_of_band(calc["Vc"], vc_lo, vc_hi):
+        n = round(_clamp(calc["Vc"], vc_lo, vc_hi) * 1000 / (math.pi * D), -1)
+    n = min(n, max_rpm)
+    if fz_lo and _out_of_band(fz, fz_lo, fz_hi):
+        fz = _clamp(fz, fz_lo, fz_hi)
+    if fz and (n != step.get("n", 0) or fz != calc["fz"]):
+        vf = round(fz * n * z, -1)
+    if vf > max_feed:
+        vf = max_feed
+        if fz_lo and _out_of_band(vf / (n * z), fz_lo, fz_hi):
+            # keep the chip load by slowing the spindle, as far as the Vc band allows
+            n = max(vf / (fz_lo * z), vc_lo * 1000 / (math.pi * D))
+            n = min(round(n, -1), max_rpm)
+
+    ap, ae = step.get("ap", 0), step.get("ae", 0)
+    if strat != "drilling" and tool.get("type") != "ballmill":
+        eng = cam.get_engagement_limits(strat, formulary)
+        if _out_of_band(ap / D, *eng["ap_d"]):
+            ap = round(_clamp(ap / D, *eng["ap_d"]) * D, 2)
+        if _out_of_band(ae / D, *eng["ae_d"]):
+            ae = round(_clamp(ae / D, *eng["ae_d"]) * D, 2)
+    loc_mm = _loc_to_mm(tool.get("loc", math.inf), D)
+    if ap > loc_mm:
+        ap = math.floor(loc_mm * 100) / 100
+
+    # spindle load: milling P_c / T_c scale with ap, drilling loads with f_n^(1-x)
+    lim = machine_limits(machine)
+    mech = step_mechanics({**step, "n": n, "vf": vf, "ap": ap, "ae": ae}, tool, mat_tag, formulary)
+    over = max(mech["Pc"] / lim["power"], mech["Tc"] / lim["torque"], mech["Ff"] / lim["thrust"])
+    if over > 1:
+        if strat == "drilling":
+            x = material_constants(mat_tag, formulary)[1]
+            vf = max(math.floor(vf * over ** (-1 / (1 - x)) / 10) * 10, min(vf, MIN_VF))
+        elif ap:
+            ap = math.floor(ap / over * 100) / 100
+
+    new = {"n": int(n), "vf": int(vf), "ap": ap, "ae": ae}
+    return {k: v for k, v in new.items() if k in step and v != step[k]}
+
 def _flagged(label: str, val, faulty_keys: set[str]) -> str:
     mark = "⚠️" if label.lower() in faulty_keys else "✅"
     return f"{label}: {val} {mark}"
@@ -156,30 +181,92 @@ def summarize_step(step: dict, ok: bool, issues: list[str]) -> str:
         f"ae={step.get('ae', '?')} mm | "
         f"strategy={step['strategy']}"
     )
+    mech  = step.get("_mech")
     out = [f"{status} {step['step']}"]
     out.append("   " + _flagged("tool", line1, faulty))
     out.append("   " + _flagged("cut",  line2, faulty))
+    if mech:
+        line3 = (
+            f"• P_c={mech['Pc']:.2f} kW | T_c={mech['Tc']:.1f} Nm | "
+            + (f"F_f={mech['Ff']:.0f} N | " if mech["Ff"] else "")
+            + f"MRR={mech['MRR'] / 1000:.1f} cm³/min"
+        )
+        out.append(f"   load: {line3} " + ("⚠️" if faulty & {"p_c", "t_c", "f_f"} else "✅"))
     for i in issues:
         out.append(f"   - ⚠️ {i}")
     return "\n".join(out)
 
-def summarize_validation(plan_txt: str, machine: dict, material: str) -> str:
-    tag   = cam.infer_material_tag(material)
+def _check_steps(steps: List[Dict], machine: dict, tag: str, formulary: cam.Formulary) -> List[Dict]:
     tools = machine.get("tool_library", [])
-    blocks = []
-    for st in parse_txt_plan(plan_txt):
-        ok, iss = validate_step(st, machine, tag, tools)[:2]
-        st["_calc"] = _calc_values(st, _find_tool(st.get("tool_id"), tools))
-        blocks.append(summarize_step(st, ok, iss))
+    for st in steps:
+        tool = _find_tool(st.get("tool_id"), tools)
+        st["_mech"] = step_mechanics(st, tool, tag, formulary)
+        st["ok"], st["issues"] = validate_step(st, machine, tag, tools, formulary, st["_mech"])[:2]
+        st["_calc"] = _calc_values(st, tool)
+    return steps
+
+@tracing.traced()
+def validate_plan(plan_txt: str, machine: dict, material: str,
+                  formulary: cam.Formulary | None = None) -> List[Dict]:
+    """Parse + validate a plan; each step dict gains `ok`, `issues` and `_calc`.
+    `formulary` defaults to `parse_cam_formulary.load_formulary()`."""
+    return _check_steps(parse_txt_plan(plan_txt), machine, cam.infer_material_tag(material),
+                        formulary or cam.load_formulary())
+
+def validate_stream(chunks: Iterable[str], machine: dict, material: str,
+                    formulary: cam.Formulary | None = None) -> Iterator[Tuple[str, List[Dict]]]:
+    """Validate a plan while it is being generated.
+
+    Yields `(chunk, steps)` for every text chunk, where `steps` are the steps
+    that chunk completed, already validated as in `validate_plan`.  The last
+    item is `("", steps)` for whatever the end of the text completed.
+    """
+    tag, formulary = cam.infer_material_tag(material), formulary or cam.load_formulary()
+    parser = PlanStreamParser()
+    for chunk in chunks:
+        yield chunk, _check_steps(parser.feed(chunk), machine, tag, formulary)
+    yield "", _check_steps(parser.close(), machine, tag, formulary)
+
+def correct_plan(plan_txt: str, machine: dict, material: str,
+                 formulary: cam.Formulary | None = None) -> Tuple[str, List[Dict]]:
+    """Patch n / Vf / ap / ae of every step with issues straight in the plan text
+    (no LLM call).  Returns the new text and, per patched step,
+    `{"step", "changes": {field: (old, new)}}`."""
+    formulary = formulary or cam.load_formulary()
+    tag, tools = cam.infer_material_tag(material), machine.get("tool_library", [])
+    edits, report = {}, []
+    for i, st in enumerate(validate_plan(plan_txt, machine, material, formulary)):
+        if not st["issues"]:
+            continue
+        fix = suggest_corrections(st, machine, tag, _find_tool(st.get("tool_id"), tools), formulary)
+        if fix:
+            edits[i] = fix
+            report.append({"step": st["step"], "changes": {k: (st.get(k), v) for k, v in fix.items()}})
+    return (rewrite_fields(plan_txt, edits) if edits else plan_txt), report
+
+@tracing.traced()
+def summarize_validation(plan_txt: str, machine: dict, material: str,
+                         formulary: cam.Formulary | None = None) -> str:
+    blocks = [summarize_step(st, st["ok"], st["issues"])
+              for st in validate_plan(plan_txt, machine, material, formulary)]
     return "\n\n".join(blocks)
 
 if __name__ == "__main__":
     import argparse, sys
+    from machine_registry import load_machine
     p = argparse.ArgumentParser()
     p.add_argument("plan")
     p.add_argument("machine")
     p.add_argument("material")
+    p.add_argument("--fix", action="store_true", help="print the plan with parameters corrected locally")
     a = p.parse_args()
     plan = Path(a.plan).read_text(encoding="utf-8")
-    mach = json.loads(Path(a.machine).read_text())
-    print(summarize_validation(plan, mach, a.material))
+    mach = load_machine(a.machine)
+    if a.fix:
+        plan, changes = correct_plan(plan, mach, a.material)
+        print(plan)
+        for ch in changes:
+            print(f"🔧 {ch['step']}: " + ", ".join(f"{k} {o} → {n}" for k, (o, n) in ch["changes"].items()),
+                  file=sys.stderr)
+    else:
+        print(summarize_validation(plan, mach, a.material))
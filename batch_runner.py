@@ -0,0 +1,182 @@
+# batch_runner.py
+"""Headless, concurrent batch pipeline: drawing → geometry → retrieval → plan → validation.
+
+Jobs come from a JSONL manifest (one object per line) with keys
+    drawing, material, machine, goal   [+ optional id]
+or from `--sweep`, which pairs every drawing in `dataset/` with every machine in
+`machines/`.  Jobs run with bounded asyncio parallelism; the blocking LLM /
+retrieval calls go to worker threads.  Geometry is extracted once per drawing
+and shared by all of its jobs.  One JSON line per finished job (status,
+per-stage timings, plan, validator issues) is streamed to `--out`; `--trace`
+records every job as a trace of its stages (`tracing.py`).
+
+Usage:
+    python batch_runner.py jobs.jsonl -o results.jsonl -j 8
+    python batch_runner.py --sweep --material "aluminium" \\
+        --goal "Complete CAM process for the pulley" -o results.jsonl
+
+    # offline, against the local stand-in server
+    python mock_openai_server.py --port 8765 &
+    python batch_runner.py --sweep --base-url http://127.0.0.1:8765/v1 -o mock.jsonl
+"""
+from __future__ import annotations
+import argparse, asyncio, json, os, re, sys, time
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Dict, List
+
+import tracing
+
+_IMAGE_EXTS = (".png", ".jpg", ".jpeg")
+
+
+@dataclass
+class Job:
+    id: str
+    drawing: str
+    material: str
+    machine: str
+    goal: str
+
+
+def load_manifest(path: str | Path) -> List[Job]:
+    jobs = []
+    for i, ln in enumerate(Path(path).read_text(encoding="utf-8").splitlines()):
+        if ln.strip():
+            d = json.loads(ln)
+            jobs.append(Job(id=str(d.get("id", i)), drawing=d["drawing"], material=d["material"],
+                            machine=d["machine"], goal=d.get("goal", "")))
+    return jobs
+
+
+def sweep(material: str, goal: str, dataset: str = "dataset", machines: str = "machines") -> List[Job]:
+    drawings = sorted(p for p in Path(dataset).iterdir() if p.suffix.lower() in _IMAGE_EXTS)
+    specs = sorted(Path(machines).glob("*.json"))
+    return [Job(id=f"{d.stem.split('_')[0]}@{m.stem}", drawing=d.as_posix(), material=material,
+                machine=m.as_posix(), goal=goal)
+            for d in drawings for m in specs]
+
+
+def _isolate_endpoint_caches(base_url: str) -> None:
+    """Keep caches / index built against a non-OpenAI endpoint away from the real ones."""
+    tag = re.sub(r"[^A-Za-z0-9]+", "_", base_url).strip("_")
+    cache = Path(".cache", "endpoints", tag)
+    os.environ.setdefault("LLM_CNC_CACHE_DIR", cache.as_posix())
+    os.environ.setdefault("RAG_INDEX_DIR", (cache / "vectorstore").as_posix())
+    Path(os.environ["RAG_INDEX_DIR"]).mkdir(parents=True, exist_ok=True)
+
+
+class BatchRunner:
+    def __init__(self, concurrency: int = 8):
+        # heavy modules are imported here, after any endpoint env vars are set
+        import affordance_validator as av
+        import pipeline
+        import retrieve_context
+        from dimension_extractor import extract_geometry, missing_fields, summary_text
+        from machine_registry import load_machine
+
+        self._av, self._pl, self._rag = av, pipeline, retrieve_context
+        self._extract, self._missing, self._summary = extract_geometry, missing_fields, summary_text
+        self._machine = load_machine              # validated, cached per file version
+        self.concurrency = concurrency
+        self._drawings: Dict[str, asyncio.Task] = {}
+
+    async def _drawing(self, path: str) -> tuple[str, Dict]:
+        """(data URL, geometry) for a drawing – extracted once, shared by all its jobs."""
+        if path not in self._drawings:
+            async def load():
+                image = self._pl.load_drawing(path)
+                geo = await asyncio.to_thread(self._extract, image, False, True, Path(path).name)
+                return image, geo
+            self._drawings[path] = asyncio.ensure_future(load())
+        return await self._drawings[path]
+
+    async def run_job(self, job: Job, sem: asyncio.Semaphore) -> Dict:
+        rec: Dict = {**asdict(job), "status": "ok", "error": None, "timings_s": {}}
+        timings = rec["timings_s"]
+        stage = "start"
+        t_job = time.perf_counter()
+        async with sem:
+            with tracing.span("job", id=job.id, drawing=job.drawing, machine=job.machine) as sp:
+                try:
+                    stage = "geometry"
+                    t0 = time.perf_counter()
+                    image, geo = await self._drawing(job.drawing)
+                    timings[stage] = time.perf_counter() - t0
+                    rec["geometry"], rec["missing_geometry"] = geo, self._missing(geo)
+                    rec["image_bytes"] = image.nbytes
+
+                    stage = "retrieval"
+                    t0 = time.perf_counter()
+                    machine = self._machine(job.machine)
+                    text_desc = self._pl.describe_job(job.goal, job.material, self._summary(geo))
+                    ctx = await asyncio.to_thread(self._pl.retrieve_job_context, text_desc, job.material)
+                    timings[stage] = time.perf_counter() - t0
+
+                    stage = "planning"
+                    t0 = time.perf_counter()
+                    prompt = self._pl.build_plan_prompt(text_desc, machine, ctx)
+                    plan = await asyncio.to_thread(self._pl.generate_plan, prompt, image)
+                    timings[stage] = time.perf_counter() - t0
+                    rec["plan"] = plan
+
+                    stage = "validation"
+                    t0 = time.perf_counter()
+                    steps = self._av.validate_plan(plan, machine, job.material)
+                    timings[stage] = time.perf_counter() - t0
+                    rec["validation"] = {
+                        "steps": len(steps),
+                        "failing_steps": sum(not st["ok"] for st in steps),
+                        "issues": [{"step": st["step"], "ok": st["ok"], "issues": st["issues"]}
+                                   for st in steps],
+                    }
+                except Exception as exc:
+                    rec["status"], rec["error"] = "error", f"{stage}: {type(exc).__name__}: {exc}"
+                sp.set(status=rec["status"])
+        timings["total"] = time.perf_counter() - t_job
+        return rec
+
+    async def run(self, jobs: List[Job], out_path: str | Path) -> Dict[str, int]:
+        # load formulary + index once, before worker threads race to do it
+        await asyncio.to_thread(self._rag.warm_up)
+        sem = asyncio.Semaphore(self.concurrency)
+        counts = {"ok": 0, "error": 0}
+        with open(out_path, "w", encoding="utf-8") as out:
+            for fut in asyncio.as_completed([self.run_job(j, sem) for j in jobs]):
+                rec = await fut
+                counts[rec["status"]] += 1
+                out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                out.flush()
+                print(f"[{sum(counts.values())}/{len(jobs)}] {rec['status']:5s} {rec['id']} "
+                      f"{rec['timings_s']['total']:.1f}s" + (f"  {rec['error']}" if rec["error"] else ""))
+        return counts
+
+
+if __name__ == "__main__":
+    cli = argparse.ArgumentParser(description="Headless batch CAM planning")
+    cli.add_argument("manifest", nargs="?", help="JSONL jobs file (drawing, material, machine, goal)")
+    cli.add_argument("--sweep", action="store_true", help="all dataset/ drawings × all machines/")
+    cli.add_argument("--material", default="Aluminium", help="material for --sweep")
+    cli.add_argument("--goal", default="Generate a complete CAM process for the part in the image.",
+                     help="user goal for --sweep")
+    cli.add_argument("-o", "--out", default="batch_results.jsonl")
+    cli.add_argument("-j", "--concurrency", type=int, default=8)
+    cli.add_argument("--base-url", help="OpenAI-compatible endpoint, e.g. a local mock server")
+    cli.add_argument("--trace", help="append stage traces to this JSONL file (see tracing.py)")
+    a = cli.parse_args()
+
+    if not a.sweep and not a.manifest:
+        cli.error("give a manifest file or --sweep")
+    if a.base_url:
+        os.environ["OPENAI_BASE_URL"] = a.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "mock")
+    if os.getenv("OPENAI_BASE_URL"):
+        _isolate_endpoint_caches(os.environ["OPENAI_BASE_URL"])
+
+    if a.trace:
+        tracing.enable(a.trace)
+    todo = sweep(a.material, a.goal) if a.sweep else load_manifest(a.manifest)
+    t0 = time.perf_counter()
+    res = asyncio.run(BatchRunner(a.concurrency).run(todo, a.out))
+    print(f"\n{res['ok']} ok, {res['error']} failed in {time.perf_counter() - t0:.1f}s → {a.out}")
+    sys.exit(1 if res["error"] else 0)
@@ -0,0 +1,667 @@
+# benchmark.py
+"""Small benchmarks for the llm_cnc pipeline.
+
+Usage:
+    python benchmark.py startup [--runs 3]    # cold vs warm retrieval-index start-up
+    python benchmark.py imports [--budget-ms 50]
+                                              # `-X importtime` regression guard
+    python benchmark.py formulary [--runs 200]  # CAM.txt parse vs snapshot load
+    python benchmark.py machines [--runs 2000]  # json.loads vs registry; tool lookups
+    python benchmark.py bulk [--plans 20000]  # scalar vs vectorised plan validation
+    python benchmark.py optimise [--objectives mrr time]
+                                              # local parameter optimiser: ms/plan, MRR gain
+    python benchmark.py parse [--steps 20000] # plan parser, whole text and streamed
+    python benchmark.py payload [--limit 5] [--presets original balanced compact low]
+                                              # image size vs geometry accuracy
+    python benchmark.py retrieval [--k 2 4 8] [--modes bm25 local vector hybrid]
+                                  [--chunkers sections recursive]
+                                              # recall@k, context size and latency per mode
+    python benchmark.py transport [--calls 64] [--rpm 120] [--error-rate 0.05]
+                                              # concurrent calls vs a rate-limited mock API
+    python benchmark.py pipeline --record [--base-url …]   # record the LLM calls once
+    python benchmark.py pipeline [--latency recorded] [--save-baseline]
+                                              # stage latency / memory, replayed, vs the baseline
+"""
+from __future__ import annotations
+import argparse, os, shutil, statistics, subprocess, sys, tempfile, time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent
+
+
+def _timed_python(code: str, cwd: Path) -> float:
+    """Run `python -c code` in a fresh interpreter and return its wall time [s]."""
+    env = {**os.environ, "PYTHONPATH": ROOT.as_posix()}
+    t0 = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], cwd=cwd, env=env, check=True)
+    return time.perf_counter() - t0
+
+
+def _fmt(times: list[float]) -> str:
+    return (f"median {statistics.median(times) * 1000:8.1f} ms | "
+            f"min {min(times) * 1000:8.1f} ms | runs {len(times)}")
+
+# ─────────────────────────────────────────────────────────────────────────────
+# startup: cold build vs warm load of the FAISS index
+# ─────────────────────────────────────────────────────────────────────────────
+def bench_startup(args: argparse.Namespace) -> int:
+    """Cold = empty vectorstore (full embed + build), warm = manifest hit (load only).
+
+    Runs in a scratch copy of CAM.txt so the project's own index is untouched.
+    """
+    from dotenv import load_dotenv
+    load_dotenv(ROOT / ".env")
+    code = "import retrieve_context"
+    cold, warm = [], []
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory(prefix="bench_rag_") as tmp:
+            shutil.copy(ROOT / "CAM.txt", tmp)
+            Path(tmp, "vectorstore").mkdir()
+            cold.append(_timed_python(code, Path(tmp)))
+            warm.append(_timed_python(code, Path(tmp)))
+    print(f"cold start: {_fmt(cold)}")
+    print(f"warm start: {_fmt(warm)}")
+    print(f"speed-up:   {statistics.median(cold) / statistics.median(warm):.1f}x")
+    return 0
+
+# ─────────────────────────────────────────────────────────────────────────────
+# imports: `-X importtime` guard for side-effect-free, lazy imports
+# ─────────────────────────────────────────────────────────────────────────────
+_ENTRY_MODULES = ("main", "cam_optimizer", "affordance_validator", "retrieve_context",
+                  "llm_client", "parse_cam_formulary", "dimension_extractor")
+# heavy dependencies that must only load on first use, never on import
+_LAZY_ONLY = ("openai", "langchain", "langchain_community", "langchain_openai", "faiss",
+              "tkinter", "inquirer", "rich", "numpy")
+
+
+def _importtime(module: str) -> tuple[float, dict[str, int]]:
+    """Import `module` in a fresh interpreter; return (cumulative ms, {top-level pkg: µs})."""
+    env = {**os.environ, "PYTHONPATH": ROOT.as_posix()}
+    res = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                         cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    total, pkgs = 0.0, {}
+    for ln in res.stderr.splitlines():
+        if not ln.startswith("import time:") or "cumulative" in ln:
+            continue
+        _, cum, name = (c.strip() for c in ln[len("import time:"):].split("|"))
+        top = name.split(".")[0]
+        pkgs[top] = max(pkgs.get(top, 0), int(cum))
+        if name == module:
+            total = int(cum) / 1000
+    return total, pkgs
+
+
+def bench_imports(args: argparse.Namespace) -> int:
+    failed = False
+    for mod in _ENTRY_MODULES:
+        ms, pkgs = _importtime(mod)
+        heavy = sorted(p for p in pkgs if p in _LAZY_ONLY)
+        status = "ok"
+        if ms > args.budget_ms or heavy:
+            status, failed = "FAIL", True
+        print(f"{mod:24s} {ms:8.1f} ms  {status}" + (f"  eager: {', '.join(heavy)}" if heavy else ""))
+    if failed:
+        print(f"\nImport budget is {args.budget_ms:.0f} ms with no eager heavy dependencies.")
+    return 1 if failed else 0
+
+# ─────────────────────────────────────────────────────────────────────────────
+# formulary: full CAM.txt parse vs snapshot load vs in-process memo
+# ─────────────────────────────────────────────────────────────────────────────
+def bench_formulary(args: argparse.Namespace) -> int:
+    import parse_cam_formulary as cam
+
+    path = cam._resolve(None)
+    text = path.read_text(encoding="utf-8")
+    with tempfile.TemporaryDirectory(prefix="bench_cam_") as tmp:
+        cam._SNAPSHOT_DIR = Path(tmp)
+        cam._load_or_parse(path)                          # write the snapshot
+        runs = {
+            "parse":    lambda: cam.parse_formulary(text, path.as_posix()),
+            "snapshot": lambda: cam._load_or_parse(path),
+            "memo":     lambda: cam.load_formulary(path),
+        }
+        for name, fn in runs.items():
+            times = []
+            for _ in range(args.runs):
+                t0 = time.perf_counter()
+                fn()
+                times.append(time.perf_counter() - t0)
+            print(f"{name:9s} {_fmt(times)}")
+    return 0
+
+# ─────────────────────────────────────────────────────────────────────────────
+# machines: json.loads per use vs the machine registry, linear vs indexed tools
+# ─────────────────────────────────────────────────────────────────────────────
+def bench_machines(args: argparse.Namespace) -> int:
+    import json
+    import affordance_validator as av
+    from machine_registry import MachineRegistry
+    from prompt_utils import build_machine_block
+
+    paths = sorted((ROOT / "machines").glob("*.json"))
+    reg = MachineRegistry(ROOT / "machines")
+    raw = [json.loads(p.read_text()) for p in paths]
+    specs = [reg.get(p) for p in paths]
+    ids = [t["id"] for t in raw[0]["tool_library"]] + [999]
+    runs = {
+        "load json":          lambda: [json.loads(p.read_text()) for p in paths],
+        "load registry":      lambda: [reg.get(p) for p in paths],
+        "find tool, list":    lambda: [av._find_tool(i, m["tool_library"]) for m in raw for i in ids],
+        "find tool, index":   lambda: [av._find_tool(i, m["tool_library"]) for m in specs for i in ids],
+        "machine block":      lambda: [build_machine_block(m) for m in raw],
+        "machine block memo": lambda: [build_machine_block(m) for m in specs],
+    }
+    for name, fn in runs.items():
+        times = []
+        for _ in range(args.runs):
+            t0 = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - t0)
+        print(f"{name:19s} median {statistics.median(times) * 1e6:8.1f} µs | min {min(times) * 1e6:8.1f} µs")
+    return 0
+
+# ─────────────────────────────────────────────────────────────────────────────
+# bulk: per-step validate_step vs bulk_validator on the sample plans
+# ─────────────────────────────────────────────────────────────────────────────
+def bench_bulk(args: argparse.Namespace) -> int:
+    """Re-validate `--plans` (sample plan × machine × material) triples both ways.
+
+    Plans are parsed once up front: the timing covers validation only."""
+    import itertools, json
+    import affordance_validator as av
+    import parse_cam_formulary as cam
+    from bulk_validator import pack, validate_bulk
+
+    parsed = [av.parse_txt_plan(p.read_text(encoding="utf-8"))
+              for p in sorted(ROOT.glob("test_pulley_*.txt"))]
+    machines = [json.loads(p.read_text()) for p in sorted((ROOT / "machines").glob("*.json"))]
+    materials = ("aluminium", "steel", "stainless steel", "titanium", "cast iron")
+    combos = itertools.cycle(itertools.product(parsed, machines, materials))
+    items = [next(combos) for _ in range(args.plans)]
+    f = cam.load_formulary()
+
+    t0 = time.perf_counter()
+    scalar = [[{"step": st["step"], "ok": ok, "issues": issues}
+               for st in steps
+               for ok, issues in [av.validate_step(st, m, cam.infer_material_tag(mat), m["tool_library"], f)]]
+              for steps, m, mat in items]
+    t_scalar = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    batch = pack(items)
+    t_pack = time.perf_counter() - t0
+    res = validate_bulk(batch, f)
+    t_check = time.perf_counter() - t0 - t_pack
+    bulk = res.step_results()
+
+    same = scalar == bulk
+    print(f"plans {len(items)} | steps {len(res)} | issues {len(res.issue_table())}")
+    print(f"scalar validate_step  {t_scalar * 1000:9.1f} ms")
+    print(f"bulk   pack           {t_pack * 1000:9.1f} ms")
+    print(f"bulk   checks         {t_check * 1000:9.1f} ms")
+    print(f"speed-up (pack+check) {t_scalar / (t_pack + t_check):9.1f}x | identical results: {same}")
+    return 0 if same else 1
+
+# ─────────────────────────────────────────────────────────────────────────────
+# optimise: local parameter optimiser on the sample plans
+# ─────────────────────────────────────────────────────────────────────────────
+def bench_optimise(args: argparse.Namespace) -> int:
+    """Optimise every sample plan × machine × material; time, MRR gain and issues left."""
+    import itertools, json
+    import affordance_validator as av
+    import parse_cam_formulary as cam
+    from param_optimizer import optimise_parameters
+
+    plans = [p.read_text(encoding="utf-8") for p in sorted(ROOT.glob("test_pulley_*.txt"))]
+    machines = [json.loads(p.read_text()) for p in sorted((ROOT / "machines").glob("*.json"))]
+    materials = ("aluminium", "steel", "stainless steel", "titanium", "cast iron")
+    f = cam.load_formulary()
+    issues = lambda text, m, mat: sum(len(st["issues"]) for st in av.validate_plan(text, m, mat, f))
+    print(f"{'objective':9s} {'plans':>5s} {'ms/plan':>8s} {'changed':>8s} {'MRR gain':>9s} "
+          f"{'issues before':>13s} {'after':>6s}")
+    for objective in args.objectives:
+        times, changed, before, after, mrr0, mrr1 = [], 0, 0, 0, 0.0, 0.0
+        for text, m, mat in itertools.product(plans, machines, materials):
+            t0 = time.perf_counter()
+            new, report = optimise_parameters(text, m, mat, objective, f)
+            times.append(time.perf_counter() - t0)
+            changed += len(report)
+            mrr0 += sum(r["mrr"][0] for r in report)
+            mrr1 += sum(r["mrr"][1] for r in report)
+            before, after = before + issues(text, m, mat), after + issues(new, m, mat)
+        print(f"{objective:9s} {len(times):5d} {statistics.mean(times) * 1000:8.2f} {changed:8d} "
+              f"{mrr1 / max(mrr0, 1e-9):8.1f}x {before:13d} {after:6d}")
+    return 0
+
+# ─────────────────────────────────────────────────────────────────────────────
+# parse: plan parser throughput on the sample plans and a synthetic large plan
+# ─────────────────────────────────────────────────────────────────────────────
+_STEP_TEMPLATE = """
+{i}. **{title}**
+   - **Tool**: Endmill D={d} mm (Tool ID: {tid})
+   - **Operation**: {op}
+   - **Spindle Speed (n)**: {n} RPM
+   - **Feedrate (Vf)**: {vf} mm/min
+   - **Depth/Pass (ap)**: {ap} mm
+   - **Side Engagement (ae)**: {ae} mm
+   - **Coolant**: On
+"""
+
+
+def _synthetic_plan(steps: int, seed: int = 0) -> str:
+    import random
+    rnd = random.Random(seed)
+    titles = ("Facing", "Rough Outer Diameter", "Profile Finish", "Cut Internal Bore", "Mill Teeth")
+    ops = ("Face Milling", "Adaptive Clearing", "Contour", "Drilling", "Slotting")
+    body = "".join(_STEP_TEMPLATE.format(
+        i=i + 1, title=rnd.choice(titles), op=rnd.choice(ops), d=rnd.choice((3, 6, 10, 16, 25)),
+        tid=rnd.randint(1, 30), n=rnd.randint(800, 15000), vf=rnd.randint(100, 5000),
+        ap=round(rnd.uniform(0.1, 10), 1), ae=round(rnd.uniform(0.1, 20), 1)) for i in range(steps))
+    return "## Process Plan\n\n### Operations\n" + body
+
+
+def bench_parse(args: argparse.Namespace) -> int:
+    from plan_parser import PlanStreamParser, parse_txt_plan
+
+    corpus = {p.name: p.read_text(encoding="utf-8") for p in sorted(ROOT.glob("test_pulley_*.txt"))}
+    corpus[f"synthetic ({args.steps} steps)"] = _synthetic_plan(args.steps)
+    print(f"{'plan':34s} {'KB':>7s} {'steps':>6s} {'whole ms':>9s} {'stream ms':>10s} {'MB/s':>6s}")
+    for name, text in corpus.items():
+        runs = max(1, 2_000_000 // max(len(text), 1))
+        t0 = time.perf_counter()
+        for _ in range(runs):
+            steps = parse_txt_plan(text)
+        whole = (time.perf_counter() - t0) / runs
+        t0 = time.perf_counter()
+        for _ in range(runs):
+            p = PlanStreamParser()
+            streamed = [st for i in range(0, len(text), args.chunk) for st in p.feed(text[i:i + args.chunk])]
+            streamed += p.close()
+        stream = (time.perf_counter() - t0) / runs
+        if streamed != steps:
+            print(f"{name}: streamed result differs")
+            return 1
+        print(f"{name:34s} {len(text) / 1024:7.1f} {len(steps):6d} {whole * 1000:9.2f} {stream * 1000:10.2f} "
+              f"{len(text) / whole / 1e6:6.1f}")
+    return 0
+
+# ─────────────────────────────────────────────────────────────────────────────
+# payload: vision image size vs geometry-extraction accuracy per preset
+# ─────────────────────────────────────────────────────────────────────────────
+def _same(a, b) -> bool:
+    try:
+        return abs(float(a) - float(b)) <= 0.01 * max(abs(float(b)), 1e-9)
+    except (TypeError, ValueError):
+        return str(a).strip().lower() == str(b).strip().lower()
+
+
+def bench_payload(args: argparse.Namespace) -> int:
+    """Per preset: encoded KB, prep time (cold), extraction latency and field
+    agreement with the first preset (the reference, normally `original`).
+    The response cache and geometry store are bypassed so every call reaches the model."""
+    import llm_client
+    from dimension_extractor import _REQUIRED, extract_geometry
+    from image_pipeline import PRESETS, prepare_image
+
+    llm_client.disable_cache()
+    drawings = sorted(p for p in (ROOT / "dataset").iterdir()
+                      if p.suffix.lower() in (".png", ".jpg", ".jpeg"))[:args.limit]
+    unknown = [p for p in args.presets if p not in PRESETS]
+    if unknown:
+        print(f"unknown preset(s): {', '.join(unknown)}")
+        return 2
+    with tempfile.TemporaryDirectory(prefix="bench_img_") as tmp:
+        import image_pipeline
+        image_pipeline._CACHE_DIR = Path(tmp)           # time preprocessing from cold
+        ref: dict[str, dict] = {}
+        print(f"{'preset':10s} {'KB':>8s} {'prep ms':>8s} {'call s':>8s} {'fields':>8s}")
+        for preset in args.presets:
+            kb, prep, call, agree, total = [], [], [], 0, 0
+            for d in drawings:
+                t0 = time.perf_counter()
+                img = prepare_image(d, preset)
+                prep.append(time.perf_counter() - t0)
+                kb.append(img.nbytes / 1024)
+                t0 = time.perf_counter()
+                geo = extract_geometry(img, interactive=False, use_store=False)
+                call.append(time.perf_counter() - t0)
+                if d.name not in ref:
+                    ref[d.name] = geo
+                for k in _REQUIRED:
+                    if k in ref[d.name]:
+                        total += 1
+                        agree += k in geo and _same(geo[k], ref[d.name][k])
+            print(f"{preset:10s} {statistics.mean(kb):8.0f} {statistics.median(prep) * 1000:8.0f} "
+                  f"{statistics.median(call):8.2f} {agree:>4d}/{total:<3d}")
+    return 0
+
+# ─────────────────────────────────────────────────────────────────────────────
+# retrieval: recall@k and latency of each retrieval mode on the labelled queries
+# ─────────────────────────────────────────────────────────────────────────────
+def _norm(text: str) -> str:
+    return " ".join(text.split())
+
+
+def _use_chunker(rc, chunker: str, index_dir: Path) -> None:
+    """Point `retrieve_context` at `chunker`, with its own index folder."""
+    rc._CHUNKER, rc._INDEX_DIR = chunker, index_dir
+    rc._MANIFEST, rc._CHUNKS_FILE = index_dir / "manifest.json", index_dir / "chunks.json"
+    rc._local = rc._vectorstore = None
+    rc._vector_down = 0.0
+
+
+def bench_retrieval(args: argparse.Namespace) -> int:
+    """recall@k = share of a query's `expect` passages found in the top-k chunks;
+    tok@k = tokens of the top-k chunks, i.e. the context a prompt would carry.
+    Queries with a `material` use it as filter, as `main.py` does."""
+    import json
+    import retrieve_context as rc
+    from prompt_assembly import count_tokens
+
+    queries = json.loads((ROOT / "retrieval_queries.json").read_text(encoding="utf-8"))
+    k_max = max(args.k)
+    tmp = Path(tempfile.mkdtemp(prefix="rag_bench_"))
+    print(f"{len(queries)} queries          " + " ".join(f"{'R@' + str(k):>6s}" for k in args.k)
+          + " " + " ".join(f"{'tok@' + str(k):>7s}" for k in args.k) + "   median     p95")
+    try:
+        for chunker in args.chunkers:
+            _use_chunker(rc, chunker, tmp / chunker)
+            for mode in args.modes:
+                label = f"{chunker:9s} {mode:7s}"
+                try:
+                    rc.warm_up(mode)
+                    rc.get_relevant_context(queries[0]["query"], k=k_max, mode=mode)
+                except Exception as exc:
+                    print(f"{label} unavailable ({type(exc).__name__}: {exc})")
+                    continue
+                recall = {k: [] for k in args.k}
+                tokens = {k: [] for k in args.k}
+                times = []
+                for q in queries:
+                    t0 = time.perf_counter()
+                    chunks = rc.get_relevant_context(q["query"], k=k_max, mode=mode,
+                                                     material=q.get("material"))
+                    times.append(time.perf_counter() - t0)
+                    flat = [_norm(c) for c in chunks]
+                    for k in args.k:
+                        found = sum(any(_norm(e) in c for c in flat[:k]) for e in q["expect"])
+                        recall[k].append(found / len(q["expect"]))
+                        tokens[k].append(count_tokens("\n\n".join(chunks[:k])))
+                times.sort()
+                note = " (vector search down → local)" if mode == "hybrid" and rc._vector_down else ""
+                print(f"{label} " + " ".join(f"{statistics.mean(recall[k]):6.2f}" for k in args.k)
+                      + " " + " ".join(f"{statistics.mean(tokens[k]):7.0f}" for k in args.k)
+                      + f" {statistics.median(times) * 1000:6.2f} ms"
+                      f" {times[int(0.95 * (len(times) - 1))] * 1000:6.2f} ms" + note)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return 0
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# transport: concurrent callers against a rate-limited mock API
+# ─────────────────────────────────────────────────────────────────────────────
+def bench_transport(args: argparse.Namespace) -> int:
+    """N concurrent chat calls through a bare client (one attempt) and through the
+    transport (threads and asyncio), against an in-process mock with an rpm limit."""
+    import asyncio, threading
+    from concurrent.futures import ThreadPoolExecutor
+    from mock_openai_server import serve
+    from llm_transport import Transport
+
+    msgs = [{"role": "user", "content": "How many steps does the plan have?"}]
+
+    def timed(fn):
+        t0 = time.perf_counter()
+        try:
+            fn()
+            return time.perf_counter() - t0, None
+        except Exception as exc:
+            return time.perf_counter() - t0, type(exc).__name__
+
+    def threaded(t: Transport) -> list:
+        with ThreadPoolExecutor(max_workers=args.calls) as pool:
+            return list(pool.map(lambda _: timed(lambda: t.chat(msgs, "gpt-4o", deadline=args.deadline)),
+                                 range(args.calls)))
+
+    async def gathered(t: Transport) -> list:
+        async def one():
+            t0 = time.perf_counter()
+            try:
+                await t.achat(msgs, "gpt-4o", deadline=args.deadline)
+                return time.perf_counter() - t0, None
+            except Exception as exc:
+                return time.perf_counter() - t0, type(exc).__name__
+        return await asyncio.gather(*(one() for _ in range(args.calls)))
+
+    print(f"{args.calls} concurrent calls, mock: {args.rpm or '∞'} rpm, {args.latency * 1000:.0f}"
+          f"+{args.jitter * 1000:.0f} ms, {args.error_rate:.0%} random 429s\n")
+    print(f"{'path':18s} {'ok':>5s} {'failed':>6s} {'429s':>5s} {'retries':>7s} {'p50':>9s} {'p95':>9s} {'wall':>7s}")
+    runs = [("bare client", dict(max_retries=0, max_in_flight=args.calls), threaded),
+            ("transport/threads", {}, threaded),
+            ("transport/async", {}, lambda t: asyncio.run(gathered(t)))]
+    for label, kwargs, drive in runs:
+        srv = serve(port=0, plan=ROOT / "test_pulley_3709N41.txt", latency=args.latency,   # fresh limits
+                    jitter=args.jitter, rpm=args.rpm, error_rate=args.error_rate)
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+        t = Transport(api_key="mock", base_url=f"http://127.0.0.1:{srv.server_address[1]}/v1", **kwargs)
+        t0 = time.perf_counter()
+        try:
+            res = drive(t)
+        finally:
+            srv.shutdown()
+        wall = time.perf_counter() - t0
+        ok = sorted(d for d, err in res if err is None)
+        pct = lambda q: f"{ok[int(q * (len(ok) - 1))] * 1000:6.0f} ms" if ok else "      – "
+        print(f"{label:18s} {len(ok):5d} {len(res) - len(ok):6d} {srv.state.rejected:5d} "
+              f"{t.stats['retries']:7d} {pct(0.5)} {pct(0.95)} {wall:6.2f}s")
+    return 0
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# pipeline: the whole flow per drawing, replayed from a cassette, vs a baseline
+# ─────────────────────────────────────────────────────────────────────────────
+_STAGES = ("geometry", "retrieval", "planning", "validation", "regenerate")
+
+
+def _pipeline_pass(drawings: list, args: argparse.Namespace, scratch: Path, memory: bool = False) -> dict:
+    """Run every drawing through all stages once; {stage: [ms per drawing]} (or peak KiB)."""
+    import contextlib, io, tracemalloc
+    import affordance_validator as av
+    import pipeline as pl
+    from cam_optimizer import optimise_plan
+    from dimension_extractor import extract_geometry, summary_text
+    from machine_registry import load_machine
+
+    machine = load_machine(args.machine)
+    out: dict = {st: [] for st in _STAGES + ("total",)}
+    for path in drawings:
+        state: dict = {}
+
+        def geometry():
+            state["image"] = pl.load_drawing(path)
+            state["geo"] = extract_geometry(state["image"], False, False, path.name)
+
+        def retrieval():
+            state["desc"] = pl.describe_job(args.goal, args.material, summary_text(state["geo"]))
+            state["ctx"] = pl.retrieve_job_context(state["desc"], args.material)
+
+        def planning():
+            prompt = pl.build_plan_prompt(state["desc"], machine, state["ctx"])
+            state["plan"] = pl.generate_plan(prompt, state["image"])
+
+        def validation():
+            av.validate_plan(state["plan"], machine, args.material)
+
+        def regenerate():
+            plan_file = scratch / f"{path.stem}.txt"
+            plan_file.write_text(state["plan"], encoding="utf-8")
+            with contextlib.redirect_stdout(io.StringIO()):
+                optimise_plan(state["desc"], plan_file.as_posix(), args.machine, args.material,
+                              state["image"], "\n\n".join(state["ctx"]), candidates=1, max_rounds=1,
+                              interactive=False)
+
+        total = 0.0
+        for name, stage in zip(_STAGES, (geometry, retrieval, planning, validation, regenerate)):
+            if memory:
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+            t0 = time.perf_counter()
+            stage()
+            dt = (time.perf_counter() - t0) * 1000
+            total += dt
+            out[name].append((tracemalloc.get_traced_memory()[1] - base) / 1024 if memory else dt)
+        out["total"].append(max(out[st][-1] for st in _STAGES) if memory else total)
+    return out
+
+
+def bench_pipeline(args: argparse.Namespace) -> int:
+    """Record once (live API or mock), then replay: per-stage latency and memory,
+    compared with the saved baseline; a regression fails the run."""
+    import json, resource, tracemalloc
+    scratch = Path(tempfile.mkdtemp(prefix="bench_pipeline_"))
+    # fresh caches and index, so a replay makes exactly the calls that were recorded
+    os.environ["LLM_CNC_CACHE_DIR"] = (scratch / "cache").as_posix()
+    os.environ["RAG_INDEX_DIR"] = (scratch / "index").as_posix()
+    if args.base_url:
+        os.environ["OPENAI_BASE_URL"] = args.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "mock")
+    import llm_client, llm_transport, retrieve_context
+    from llm_cassette import Cassette, RecordingTransport, ReplayTransport
+
+    cassette_path = Path(args.cassette)
+    if not args.record and not cassette_path.exists():
+        print(f"{cassette_path} does not exist – record it first with --record", file=sys.stderr)
+        return 2
+    if args.record:
+        cassette_path.unlink(missing_ok=True)
+    cassette = Cassette(cassette_path)
+    llm_transport.set_transport(RecordingTransport(cassette) if args.record
+                                else ReplayTransport(cassette, args.latency))
+    llm_client.disable_cache()
+    drawings = sorted(p for p in (ROOT / "dataset").iterdir()
+                      if p.suffix.lower() in (".png", ".jpg", ".jpeg"))[:args.limit]
+    try:
+        t0 = time.perf_counter()
+        retrieve_context.warm_up()
+        warm_ms = (time.perf_counter() - t0) * 1000
+        times: dict = {}
+        for _ in range(1 if args.record else args.runs):
+            cassette.rewind()
+            for st, v in _pipeline_pass(drawings, args, scratch).items():
+                times.setdefault(st, []).extend(v)
+        if args.record:
+            print(f"{len(cassette)} exchanges recorded → {cassette_path}")
+            return 0
+        cassette.rewind()
+        tracemalloc.start()
+        peaks = _pipeline_pass(drawings, args, scratch, memory=True)
+        tracemalloc.stop()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    pct = lambda v, q: sorted(v)[int(round(q * (len(v) - 1)))]
+    rows = {st: {"p50_ms": statistics.median(v), "p95_ms": pct(v, 0.95), "peak_kib": max(peaks[st])}
+            for st, v in times.items()}
+    rss_mib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{len(drawings)} drawings × {args.runs} runs, replay latency {args.latency}, "
+          f"index warm-up {warm_ms:.0f} ms, max RSS {rss_mib:.0f} MiB\n")
+
+    baseline_path = Path(args.baseline or cassette_path.with_suffix(".baseline.json"))
+    saved = json.loads(baseline_path.read_text()) if baseline_path.exists() and not args.save_baseline else {}
+    base = saved.get("stages", {}) if saved.get("latency") == args.latency else {}
+    regressions = []
+    print(f"{'stage':12s} {'p50':>10s} {'p95':>10s} {'peak KiB':>9s}   {'baseline p50':>12s} {'peak KiB':>9s}")
+    for st, r in rows.items():
+        b, flag = base.get(st), ""
+        if b:
+            slow = r["p50_ms"] > b["p50_ms"] * (1 + args.tolerance) + args.floor_ms
+            fat = r["peak_kib"] > b["peak_kib"] * (1 + args.tolerance) + args.floor_kib
+            if slow or fat:
+                regressions.append(st)
+                flag = "  ✗ " + " and ".join(w for w, bad in (("slower", slow), ("more memory", fat)) if bad)
+        ref = f"{b['p50_ms']:9.1f} ms {b['peak_kib']:9.0f}" if b else f"{'–':>12s} {'–':>9s}"
+        print(f"{st:12s} {r['p50_ms']:7.1f} ms {r['p95_ms']:7.1f} ms {r['peak_kib']:9.0f}   {ref}{flag}")
+
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps({"stages": rows, "drawings": len(drawings), "runs": args.runs,
+                                             "latency": args.latency}, indent=1) + "\n")
+        print(f"\nbaseline saved → {baseline_path}")
+    elif not base:
+        why = f"measured with latency {saved['latency']}" if saved else "missing"
+        print(f"\nbaseline {baseline_path} {why} – not compared (save one with --save-baseline)")
+    elif regressions:
+        print(f"\n✗ regression in {', '.join(regressions)} (tolerance {args.tolerance:.0%} "
+              f"+ {args.floor_ms:g} ms / {args.floor_kib:g} KiB)")
+        return 1
+    else:
+        print("\n✓ within the baseline")
+    return 0
+
+
+_COMMANDS = {
+    "startup": bench_startup,
+    "imports": bench_imports,
+    "formulary": bench_formulary,
+    "machines": bench_machines,
+    "bulk": bench_bulk,
+    "optimise": bench_optimise,
+    "parse": bench_parse,
+    "payload": bench_payload,
+    "retrieval": bench_retrieval,
+    "transport": bench_transport,
+    "pipeline": bench_pipeline,
+}
+
+if __name__ == "__main__":
+    cli = argparse.ArgumentParser(description="llm_cnc benchmarks")
+    sub = cli.add_subparsers(dest="cmd", required=True)
+    s = sub.add_parser("startup", help="cold vs warm retrieval-index start-up")
+    s.add_argument("--runs", type=int, default=3)
+    s = sub.add_parser("imports", help="import-time regression guard")
+    s.add_argument("--budget-ms", type=float, default=50.0)
+    s = sub.add_parser("formulary", help="CAM.txt parse vs snapshot load")
+    s.add_argument("--runs", type=int, default=200)
+    s = sub.add_parser("machines", help="machine registry vs json.loads, tool lookups")
+    s.add_argument("--runs", type=int, default=2000)
+    s = sub.add_parser("bulk", help="scalar vs vectorised plan validation")
+    s.add_argument("--plans", type=int, default=20000)
+    s = sub.add_parser("optimise", help="local parameter optimiser: time per plan, MRR gain")
+    s.add_argument("--objectives", nargs="+", default=["mrr", "time"], choices=["mrr", "time"])
+    s = sub.add_parser("parse", help="plan parser throughput")
+    s.add_argument("--steps", type=int, default=20000, help="steps in the synthetic plan")
+    s.add_argument("--chunk", type=int, default=64, help="characters per streamed chunk")
+    s = sub.add_parser("payload", help="image preset size vs extraction accuracy")
+    s.add_argument("--limit", type=int, default=5, help="number of dataset drawings")
+    s.add_argument("--presets", nargs="+", default=["original", "balanced", "compact", "low"],
+                   help="first preset is the accuracy reference")
+    s = sub.add_parser("retrieval", help="recall@k and latency per retrieval mode")
+    s.add_argument("--k", type=int, nargs="+", default=[2, 4, 8])
+    s.add_argument("--modes", nargs="+", default=["bm25", "local", "vector", "hybrid"],
+                   choices=["bm25", "local", "vector", "hybrid"])
+    s.add_argument("--chunkers", nargs="+", default=["sections", "recursive"],
+                   choices=["sections", "recursive"])
+    s = sub.add_parser("transport", help="pooled / rate-limited / retrying transport vs a bare client")
+    s.add_argument("--calls", type=int, default=64)
+    s.add_argument("--rpm", type=int, default=120, help="rate limit of the mock server")
+    s.add_argument("--latency", type=float, default=0.2)
+    s.add_argument("--jitter", type=float, default=0.2)
+    s.add_argument("--error-rate", type=float, default=0.05)
+    s.add_argument("--deadline", type=float, default=60.0, help="seconds per call")
+    s = sub.add_parser("pipeline", help="end-to-end stage latency / memory, replayed, vs a baseline")
+    s.add_argument("--cassette", default="cassettes/pipeline.jsonl")
+    s.add_argument("--record", action="store_true", help="(re)record the cassette from the API")
+    s.add_argument("--base-url", help="record against this endpoint, e.g. the mock server")
+    s.add_argument("--latency", default="0", help='replay latency: 0, "recorded" or seconds per call')
+    s.add_argument("--runs", type=int, default=3)
+    s.add_argument("--limit", type=int, default=5, help="number of dataset drawings")
+    s.add_argument("--machine", default="machines/haas_umc_1000.json")
+    s.add_argument("--material", default="Aluminium")
+    s.add_argument("--goal", default="Generate a complete CAM process for the part in the image.")
+    s.add_argument("--baseline", help="default: the cassette's .baseline.json")
+    s.add_argument("--save-baseline", action="store_true")
+    s.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slow-down / growth")
+    s.add_argument("--floor-ms", type=float, default=5.0, help="absolute slack per stage")
+    s.add_argument("--floor-kib", type=float, default=512.0, help="absolute memory slack per stage")
+    a = cli.parse_args()
+    sys.exit(_COMMANDS[a.cmd](a))
@@ -0,0 +1,247 @@
+# bulk_validator.py
+"""Vectorised validation of many plans at once (NumPy).
+
+Packs every step of every plan into flat arrays – n, vf, ap, ae, D, z, LOC,
+machine limits, strategy and ISO material codes – then computes Vc, f_z,
+ap/D, ae/D, the cutting mechanics (`mechanics.compute`) and all limit checks
+of `affordance_validator.validate_step` in one pass.  Formulary limits are looked up once per (material, strategy) code and
+tool libraries are indexed once per machine, instead of per step.
+
+The result is identical to the scalar path: same ok flags, same issues, same
+messages (see `BulkResult.messages`).
+
+Usage:
+    from bulk_validator import validate_bulk
+    res = validate_bulk([(plan_txt, machine, "aluminium"), ...])
+    res.ok                  # bool per step
+    res.issue_table()       # one row per (plan, step, check)
+    res.step_results()      # [[{"step", "ok", "issues"}, ...] per plan]
+"""
+from __future__ import annotations
+import math
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+import affordance_validator as av
+import parse_cam_formulary as cam
+from mechanics import compute, limit_issues, machine_limits, material_constants
+
+ISO = "PMKNSH"
+STRATEGIES = ("roughing", "finishing", "slotting", "drilling")
+
+# one bit per check, in the order validate_step reports them
+RPM, FEED, LOC, VC, FZ, AP, AE, POWER, TORQUE, THRUST = (1 << i for i in range(10))
+CHECKS = {RPM: "rpm", FEED: "feed", LOC: "loc", VC: "Vc", FZ: "fz", AP: "ap_d", AE: "ae_d",
+          POWER: "Pc", TORQUE: "Tc", THRUST: "Ff"}
+_FAILS_STEP = RPM | FEED | LOC | VC | POWER | TORQUE | THRUST     # checks that also clear `ok`
+
+ISSUE_DTYPE = np.dtype([("plan", "i4"), ("step", "i4"), ("check", "U4"),
+                        ("value", "f8"), ("lo", "f8"), ("hi", "f8")])
+
+PlanInput = Tuple["str | List[Dict]", Dict, str]     # (plan text or parsed steps, machine, material)
+
+
+@dataclass
+class StepBatch:
+    """Column arrays, one entry per step."""
+    plan: np.ndarray
+    step: np.ndarray
+    n: np.ndarray
+    vf: np.ndarray
+    ap: np.ndarray
+    ae: np.ndarray
+    D: np.ndarray
+    z: np.ndarray
+    loc: np.ndarray
+    max_rpm: np.ndarray
+    max_feed: np.ndarray
+    max_power: np.ndarray      # kW, inf if not given
+    max_torque: np.ndarray     # Nm
+    max_thrust: np.ndarray     # N
+    strategy: np.ndarray       # index into STRATEGIES
+    material: np.ndarray       # index into ISO
+    skip_ae: np.ndarray
+    steps: List[Dict]          # the original step dicts (titles, tool ids)
+    n_plans: int
+
+    def __len__(self) -> int:
+        return len(self.steps)
+
+
+def _tool_index(tools: List[Dict]) -> Dict:
+    idx: Dict = {}
+    for t in tools:
+        idx.setdefault(t.get("id"), t)          # first match, as `_find_tool`
+    return idx
+
+
+_COLUMNS = ("plan", "step", "n", "vf", "ap", "ae", "D", "z", "loc",
+            "max_rpm", "max_feed", "max_power", "max_torque", "max_thrust", "strategy", "material", "skip_ae")
+_INT_COLUMNS = {"plan", "step", "strategy", "material"}
+
+
+def pack(plans: Iterable[PlanInput]) -> StepBatch:
+    rows: List[tuple] = []
+    steps: List[Dict] = []
+    # id(machine) -> (machine, tool index); holding the machine keeps its id from being
+    # reused by a later one while the caches live (plans may come from a generator)
+    indexes: Dict[int, Tuple[Dict, Dict]] = {}
+    locs: Dict[tuple, float] = {}               # (id(machine), tool id, D) -> LOC [mm]
+    strat_code = {s: i for i, s in enumerate(STRATEGIES)}
+    p = -1
+    for p, (plan, machine, material) in enumerate(plans):
+        parsed = av.parse_txt_plan(plan) if isinstance(plan, str) else plan
+        if id(machine) in indexes:
+            tools = indexes[id(machine)][1]
+        else:
+            lib = machine.get("tool_library", [])
+            tools = getattr(lib, "by_id", None) or _tool_index(lib)
+            indexes[id(machine)] = (machine, tools)
+        mat = ISO.index(cam.infer_material_tag(material))
+        max_rpm = machine.get("max_spindle_rpm", 9e9)
+        max_feed = machine.get("max_feed_rate", 9e9)
+        load = machine_limits(machine)
+        for s, st in enumerate(parsed):
+            tid, strat = st.get("tool_id"), st["strategy"]
+            tool = tools.get(tid, {})
+            D = tool.get("dia", st.get("tool_dia", 0)) or 0
+            key = (id(machine), tid, D)
+            loc = locs.get(key)
+            if loc is None:
+                loc = locs[key] = av._loc_to_mm(tool.get("loc", math.inf), D)
+            rows.append((p, s, st.get("n", 0), st.get("vf", 0), st.get("ap", 0), st.get("ae", 0),
+                         D, tool.get("flutes", 1) or 0, loc, max_rpm, max_feed,
+                         load["power"], load["torque"], load["thrust"], strat_code[strat], mat,
+                         strat == "drilling" or tool.get("type") == "ballmill"))
+            steps.append(st)
+    table = np.array(rows, dtype=np.float64).reshape(len(rows), len(_COLUMNS))
+    arrays = {k: table[:, i].astype(bool if k == "skip_ae" else np.int32) if k in _INT_COLUMNS | {"skip_ae"}
+              else np.ascontiguousarray(table[:, i]) for i, k in enumerate(_COLUMNS)}
+    return StepBatch(**arrays, steps=steps, n_plans=p + 1)
+
+
+def _limit_tables(f: cam.Formulary) -> Dict[str, np.ndarray]:
+    """(material, strategy) -> (lo, hi) lookup arrays, built once per formulary."""
+    vc = np.array([f.vc.get(i, (0, 0)) for i in ISO], dtype=np.float64)
+    fz = np.array([[f.fz_finish.get(i, (0, 0)) if s == "finishing" else f.fz_rough.get(i, (0, 0))
+                    for s in STRATEGIES] for i in ISO], dtype=np.float64)
+    ap = np.array([f.engagement_limits(s)["ap_d"] for s in STRATEGIES], dtype=np.float64)
+    ae = np.array([f.engagement_limits(s)["ae_d"] for s in STRATEGIES], dtype=np.float64)
+    kc = np.array([material_constants(i, f) for i in ISO], dtype=np.float64)   # (k_c0,4, x)
+    return {"vc": vc, "fz": fz, "ap": ap, "ae": ae, "kc": kc}
+
+
+def _out_of_band(value: np.ndarray, lim: np.ndarray) -> np.ndarray:
+    tol = av.TOL_PCT
+    return (value < lim[:, 0] * (1 - tol)) | (value > lim[:, 1] * (1 + tol))
+
+
+class BulkResult:
+    """Per-step computed values, limits and a bitmask of failed checks."""
+
+    def __init__(self, batch: StepBatch, formulary: cam.Formulary):
+        b, tab = batch, _limit_tables(formulary)
+        self.batch = b
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.Vc = np.where(b.D != 0, math.pi * b.D * b.n / 1000, 0.0)
+            nz = (b.n != 0) & (b.z != 0)
+            self.fz = np.where(nz, b.vf / np.where(nz, b.n * b.z, 1), 0.0)
+            has_d = b.D != 0
+            self.ap_d = np.where(has_d, b.ap / np.where(has_d, b.D, 1), 0.0)
+            self.ae_d = np.where(has_d, b.ae / np.where(has_d, b.D, 1), 0.0)
+
+        self.vc_lim = tab["vc"][b.material]
+        self.fz_lim = tab["fz"][b.material, b.strategy]
+        self.ap_lim = tab["ap"][b.strategy]
+        self.ae_lim = tab["ae"][b.strategy]
+        kc = tab["kc"][b.material]
+        self.mech = compute(b.D, b.z, b.n, b.vf, b.ap, b.ae, b.strategy == STRATEGIES.index("drilling"),
+                            kc[:, 0], kc[:, 1])
+
+        eng = has_d & ~b.skip_ae
+        checks = ((b.n > b.max_rpm, RPM), (b.vf > b.max_feed, FEED), (b.ap > b.loc, LOC),
+                  (_out_of_band(self.Vc, self.vc_lim), VC),
+                  ((self.fz_lim[:, 0] != 0) & _out_of_band(self.fz, self.fz_lim), FZ),
+                  (eng & _out_of_band(self.ap_d, self.ap_lim), AP),
+                  (eng & _out_of_band(self.ae_d, self.ae_lim), AE),
+                  (self.mech.Pc > b.max_power, POWER), (self.mech.Tc > b.max_torque, TORQUE),
+                  (self.mech.Ff > b.max_thrust, THRUST))
+        flags = np.zeros(len(b), dtype=np.uint16)
+        for failed, bit in checks:
+            flags |= np.where(failed, bit, 0).astype(np.uint16)
+        self.flags = flags
+        self.ok = (flags & _FAILS_STEP) == 0
+
+    def __len__(self) -> int:
+        return len(self.flags)
+
+    def issue_table(self) -> np.ndarray:
+        """Structured array, one row per failed check: plan, step, check, value, lo, hi."""
+        b = self.batch
+        cols = {
+            RPM:  (b.n, np.zeros(len(b)), b.max_rpm),
+            FEED: (b.vf, np.zeros(len(b)), b.max_feed),
+            LOC:  (b.ap, np.zeros(len(b)), b.loc),
+            VC:   (self.Vc, self.vc_lim[:, 0], self.vc_lim[:, 1]),
+            FZ:   (self.fz, self.fz_lim[:, 0], self.fz_lim[:, 1]),
+            AP:   (self.ap_d, self.ap_lim[:, 0], self.ap_lim[:, 1]),
+            AE:   (self.ae_d, self.ae_lim[:, 0], self.ae_lim[:, 1]),
+            POWER:  (self.mech.Pc, np.zeros(len(b)), b.max_power),
+            TORQUE: (self.mech.Tc, np.zeros(len(b)), b.max_torque),
+            THRUST: (self.mech.Ff, np.zeros(len(b)), b.max_thrust),
+        }
+        parts = []
+        for bit, (val, lo, hi) in cols.items():
+            rows = np.nonzero(self.flags & bit)[0]
+            part = np.empty(len(rows), dtype=ISSUE_DTYPE)
+            part["plan"], part["step"], part["check"] = b.plan[rows], b.step[rows], CHECKS[bit]
+            part["value"], part["lo"], part["hi"] = val[rows], lo[rows], hi[rows]
+            parts.append(part)
+        table = np.concatenate(parts)
+        return table[np.lexsort((table["step"], table["plan"]))]
+
+    def messages(self, i: int) -> List[str]:
+        """Issue strings of step `i`, worded exactly as `validate_step`."""
+        f, tol = int(self.flags[i]), av.TOL_PCT * 100
+        out = []
+        if f & RPM:
+            out.append("rpm > machine limit")
+        if f & FEED:
+            out.append("feed > machine limit")
+        if f & LOC:
+            out.append("ap exceeds tool LOC")
+        if f & VC:
+            lo, hi = self.vc_lim[i]
+            out.append(f"Vc {self.Vc[i]:.0f} m/min outside [{lo:.0f},{hi:.0f}]±{tol:.0f}%")
+        if f & FZ:
+            lo, hi = self.fz_lim[i]
+            out.append(f"f_z {self.fz[i]:.3f} mm/tooth outside [{lo:.3f},{hi:.3f}]±{tol:.0f}%")
+        if f & AP:
+            lo, hi = self.ap_lim[i]
+            out.append(f"ap/D {self.ap_d[i]:.2f} outside [{lo:.2f},{hi:.2f}]")
+        if f & AE:
+            lo, hi = self.ae_lim[i]
+            out.append(f"ae/D {self.ae_d[i]:.2f} outside [{lo:.2f},{hi:.2f}]")
+        if f & (POWER | TORQUE | THRUST):
+            b = self.batch
+            out += limit_issues(self.mech.row(i), {"power": b.max_power[i], "torque": b.max_torque[i],
+                                                    "thrust": b.max_thrust[i]})
+        return out
+
+    def step_results(self) -> List[List[Dict]]:
+        """Per plan, the `step` / `ok` / `issues` of each step (as `validate_plan`)."""
+        b = self.batch
+        out: List[List[Dict]] = [[] for _ in range(b.n_plans)]
+        for i, st in enumerate(b.steps):
+            out[b.plan[i]].append({"step": st["step"], "ok": bool(self.ok[i]),
+                                   "issues": self.messages(i)})
+        return out
+
+
+def validate_bulk(plans: Iterable[PlanInput] | StepBatch,
+                  formulary: cam.Formulary | None = None) -> BulkResult:
+    """Validate many (plan, machine, material) triples; plans may be text or parsed steps."""
+    batch = plans if isinstance(plans, StepBatch) else pack(plans)
+    return BulkResult(batch, formulary or cam.load_formulary())
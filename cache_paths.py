@@ -0,0 +1,19 @@
+# cache_paths.py
+"""Where the on-disk caches live: one folder, shared by every store.
+
+`LLM_CNC_CACHE_DIR` (default `.cache`) is read when a store module is
+imported, so set it first – `batch_runner` points it at a folder per
+endpoint, `benchmark.py pipeline` at a scratch folder.
+
+Usage:
+    from cache_paths import cache_dir
+    _DB_PATH = cache_dir("responses.sqlite")
+"""
+from __future__ import annotations
+import os
+from pathlib import Path
+
+
+def cache_dir(*parts: str) -> Path:
+    """The shared cache folder, or a path inside it."""
+    return Path(os.getenv("LLM_CNC_CACHE_DIR", ".cache"), *parts)
@@ -2,142 +2,341 @@
 """Interactive CAM-plan optimiser with infinite refinement loop.
 
 At each round:
+  ✓ Streams the regenerated plan, validating each step as it arrives (Ctrl-C aborts)
   ✓ Prints full plan
   ✓ Runs validator with ✅ / ⚠️ per parameter
   ✓ Asks user whether to regenerate
+  ✓ Patches parameter-only issues locally (`av.correct_plan`), no LLM call
   ✓ Stops only when user says NO
+
+With `objective` ("mrr" | "time") every step's n / Vf / ap / ae are first
+set by the local optimiser (`param_optimizer`) in one call, so the LLM
+rounds only have to deal with what parameters cannot fix.
+
+With `candidates` > 1 a round sends that many regeneration requests at once
+(spread over TEMPERATURES), scores every answer with `score_plan` and shows
+the best one; the others stay selectable as alternatives.  `max_rounds` /
+`accept_score` end the loop on their own, so it can also run unattended
+(`interactive=False`).  `optimise_round` is a single unattended round that
+writes nothing to stdout – failed candidates are logged (used by `service.py`).
 """
 
 from __future__ import annotations
-import json
-import textwrap
+import logging, math, os
+from dataclasses import asdict, dataclass
 from pathlib import Path
-from typing import List, Dict, Tuple
+from typing import Iterable, List, Dict, Optional, Tuple
 import affordance_validator as av
-from affordance_validator import summarize_validation
-from prompt_utils import build_process_prompt
-from prompt_utils import _fmt_tool_list
-from llm_client import client as _openai
-from llm_client import call_llm_with_system
-from rich.progress import Progress, SpinnerColumn, TextColumn
+import tracing
+from affordance_validator import summarize_step, summarize_validation
+from prompt_assembly import CONTEXT_BUDGET, Section, assemble, relevant_tools
+from prompt_utils import build_machine_block
+from machine_registry import load_machine
+from llm_client import (Image, call_llm_with_system, call_llm_text, stream_llm_with_system,
+                        stream_llm_text, usage_totals)
 
 # ─────────────────────────────────────────────────────────────────────────────
 MODEL = "gpt-4o"
+SYSTEM_MESSAGE = "You are an expert mechanical CAM engineer who assist the user developing the complete manufacturing process."
+CANDIDATES = int(os.getenv("CAM_CANDIDATES", "1"))    # regenerations per round (best-of-N)
+TEMPERATURES = (0.2, 1.0)      # spread over the candidates of a round
+HARD_ISSUE_WEIGHT = 3          # machine limit / LOC / Vc issue, vs. 1 for f_z, ap/D, ae/D
 # ─────────────────────────────────────────────────────────────────────────────
 
+log = logging.getLogger(__name__)
+
+_HARD_ISSUES = ("rpm", "feed", "ap exceeds", "Vc", "P_c", "T_c", "F_f")   # issues that fail a step
+
+_REGENERATE_INSTRUCTIONS = """\
+## Below is the current process plan for the part imported as image with detected issues.
+**Please regenerate the entire process plan, keeping the same numbering, headings, and all the fields that are existing.**
+**Substitute only the corrected parameters (n, Vf, ap, ae) that are suggested.**"""
+
+
+@dataclass
+class Candidate:
+    plan: str
+    score: float
+    failing: int               # steps with ok=False
+    label: str = ""
+
+
 def _read(p: str) -> str:
     return Path(p).read_text(encoding="utf-8")
 
 
+def stream_with_validation(chunks: Iterable[str], machine: Dict, material_desc: str,
+                           label: str = "Generating…") -> str | None:
+    """
+    Consume a streamed plan, printing each step's validator report as soon as
+    the step is complete.  Returns the full plan, or None if the user pressed
+    Ctrl-C (the LLM request is closed, so the rest is not generated).
+    """
+    from rich.console import Console
+    from rich.live import Live
+    from rich.spinner import Spinner
+
+    console = Console()
+    parts: List[str] = []
+    n_steps = n_bad = 0
+    status = lambda: Spinner("dots", f"{label} {sum(map(len, parts))} chars · "
+                                     f"{n_steps} steps validated, {n_bad} failing · Ctrl-C to abort")
+    stream = av.validate_stream(chunks, machine, material_desc)
+    try:
+        with Live(status(), console=console, refresh_per_second=10, transient=True) as live:
+            for chunk, done in stream:
+                parts.append(chunk)
+                for st in done:
+                    n_steps, n_bad = n_steps + 1, n_bad + (not st["ok"])
+                    live.console.print(summarize_step(st, st["ok"], st["issues"]) + "\n",
+                                       markup=False, highlight=False)
+                live.update(status())
+    except KeyboardInterrupt:
+        stream.close()
+        getattr(chunks, "close", lambda: None)()
+        print(f"\n⛔ Generation aborted after {n_steps} validated steps ({n_bad} failing).")
+        return None
+    return "".join(parts)
+
+
+def score_plan(plan_txt: str, machine: Dict, material_desc: str,
+               formulary: av.cam.Formulary | None = None) -> Tuple[float, List[Dict]]:
+    """
+    Validator score of a plan – lower is better, 0 means no issues – and its
+    validated steps.  A plan without any parsable step scores inf.
+    """
+    steps = av.validate_plan(plan_txt, machine, material_desc, formulary)
+    if not steps:
+        return math.inf, steps
+    return float(sum(HARD_ISSUE_WEIGHT if i.startswith(_HARD_ISSUES) else 1
+                     for st in steps for i in st["issues"])), steps
+
+
+def _temperatures(n: int) -> List[Optional[float]]:
+    if n <= 1:
+        return [None]                        # API default
+    lo, hi = TEMPERATURES
+    return [round(lo + (hi - lo) * i / (n - 1), 2) for i in range(n)]
+
+
+def generate_candidates(prompt: str, image_url: Image | None, machine: Dict, material_desc: str,
+                        n: int, formulary: av.cam.Formulary | None = None) -> List[Candidate]:
+    """Send `n` regeneration requests concurrently; returns the answers scored, best first."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    formulary = formulary or av.cam.load_formulary()
+
+    def one(t: Optional[float]) -> Candidate:
+        params = {} if t is None else {"temperature": t}
+        if image_url:
+            text = call_llm_with_system(prompt, image_url, SYSTEM_MESSAGE, model=MODEL, **params)
+        else:
+            text = call_llm_text(prompt, model=MODEL, **params)
+        score, steps = score_plan(text or "", machine, material_desc, formulary)
+        return Candidate(text or "", score, sum(not st["ok"] for st in steps),
+                         "" if t is None else f"T={t:g}")
+
+    temps = _temperatures(n)
+    out: List[Candidate] = []
+    with ThreadPoolExecutor(len(temps)) as pool:
+        for t, fut in [(t, pool.submit(tracing.wrap(one), t)) for t in temps]:
+            try:
+                out.append(fut.result())
+            except Exception as exc:
+                log.warning("⚠️ Candidate %s failed: %s: %s", t, type(exc).__name__, exc)
+    return sorted(out, key=lambda c: (c.score, c.failing))
+
+
+def regeneration_prompt(plan_txt: str, description: str, machine: Dict, tag: str,
+                        checked: List[Dict], context_block: str = ""):
+    """Prompt of a regeneration round: each block once, only the tools in play,
+    context within budget.  `checked` are the plan's validated steps."""
+    tools = machine.get("tool_library", [])
+    issues, fixes = _collect_issues(av.parse_txt_plan(plan_txt), machine, tag, tools)
+    return assemble([
+        Section("", _REGENERATE_INSTRUCTIONS, dedup=False),
+        Section("## Part description / user goal", description),
+        Section("## Process plan", plan_txt, dedup=False),
+        Section("## Detected issues", "\n".join(issues)),
+        Section("## Suggested fixes", "\n".join(fixes)),
+        Section("## Contextual information", context_block, budget=CONTEXT_BUDGET),
+        Section("", build_machine_block(machine, relevant_tools(tools, checked))),
+    ])
+
+
+def optimise_round(plan_txt: str, description: str, machine: Dict, material_desc: str,
+                   image_url: Image | None = None, context_block: str = "", candidates: int = 1,
+                   formulary: av.cam.Formulary | None = None) -> Tuple[Candidate, List[Dict]]:
+    """
+    One unattended round, nothing on stdout: local corrections when they lower
+    the score, else `candidates` regenerations (best-of-N above 1).  Returns the
+    best of the new plan(s) and the current one, and the local changes made.
+    """
+    formulary = formulary or av.cam.load_formulary()
+    score, checked = score_plan(plan_txt, machine, material_desc, formulary)
+    current = Candidate(plan_txt, score, sum(not st["ok"] for st in checked), "previous plan")
+    fixed, changes = av.correct_plan(plan_txt, machine, material_desc, formulary)
+    if changes:
+        new_score, new_steps = score_plan(fixed, machine, material_desc, formulary)
+        if new_score < score:
+            return Candidate(fixed, new_score, sum(not st["ok"] for st in new_steps), "locally corrected"), changes
+
+    tag = av.cam.infer_material_tag(material_desc)
+    prompt = regeneration_prompt(plan_txt, description, machine, tag, checked, context_block)
+    ranked = generate_candidates(prompt.text, image_url, machine, material_desc, candidates, formulary)
+    return sorted(ranked + [current], key=lambda c: (c.score, c.failing))[0], []
+
+
 def optimise_plan(
                   description: str,
                   plan_path: str,
                   machine_path: str,
                   material_desc: str,
-                  image_url: str | None = None,
-                  context_block: str = "") -> str:
+                  image_url: Image | None = None,
+                  context_block: str = "",
+                  candidates: int = CANDIDATES,
+                  max_rounds: int | None = None,
+                  accept_score: float | None = None,
+                  interactive: bool = True,
+                  objective: str | None = None,
+                  session: str | None = None) -> str:
 
     """
-    Infinite refinement loop until user exits.
-    Returns final plan string.
+    Refinement loop until the user exits, the plan scores ≤ `accept_score`
+    or `max_rounds` regenerations were made (unattended runs without either
+    stop after 3).  `objective` optimises the parameters locally before the
+    first round.  With `session` (a `session_store` id) every new plan is
+    saved with its score, issues, prompt hash and token usage, and a session
+    that already has rounds continues from its latest one (`plan_path` is
+    then not read).  Returns final plan string.
     """
-    plan_txt = _read(plan_path)
-    machine = json.loads(_read(machine_path))    
-    tools    = machine.get("tool_library", [])
+    store = head = None
+    if session:
+        from session_store import get_store
+        store = get_store()
+        head = store.round(session)
+    plan_txt = head["plan"] if head else _read(plan_path)
+    machine = load_machine(machine_path)
     tag      = av.cam.infer_material_tag(material_desc)
     
-    tool_block = _fmt_tool_list(machine.get("tool_library", []))
-
-    machine_block = textwrap.dedent(f"""
-    ### CNC Machine Specifications
-    Name: {machine.get('name','')}
-    Axes: {machine.get('axes','')}
-    Max X axis stroke: {machine.get('max_X_axis_stroke','?')} mm
-    Max Y axis stroke: {machine.get('max_Y_axis_stroke','?')} mm
-    Max Z axis stroke: {machine.get('max_Z_axis_stroke','?')} mm
-    Min A axis swivel angle: {machine.get('A_axis_min_swivel_angle','?')} ° (if applicable)
-    Max A axis swivel angle: {machine.get('A_axis_max_swivel_angle','?')} ° (if applicable)
-    Min B axis swivel angle: {machine.get('B_axis_min_swivel_angle','?')} ° (if applicable)
-    Max B axis swivel angle: {machine.get('B_axis_max_swivel_angle','?')} ° (if applicable)
-    Raneg C axis swivel angle: {machine.get('C_axis_swivel_angle','?')} ° (if applicable)
-    Max workpiece diameter: {machine.get('max_workpiece_diameter','?')} mm
-    Max workpiece height: {machine.get('max_workpiece_height','?')} mm
-    Max workpiece weight: {machine.get('max_workpiece_weight','?')} kg
-    Max spindle RPM: {machine.get('max_spindle_rpm','?')} rpm
-    Max feed rate: {machine.get('max_feed_rate','?')} mm/min
-    Max spindle power: {machine.get('spindle_power', '?')} kW
-    Max spindle torque: {machine.get('spindle_torque', '?')} N·m
-    Tool change type: {machine.get('tool_change_type','?')}
-    Storage capacity {machine.get('tool_storage_capacity','?')} tools
-
-    #### Tool Library
-    {tool_block}
-    """).strip()
-
 # ─────────────────────────────────────────────────────────────────────────────
 
+    if not interactive and max_rounds is None and accept_score is None:
+        max_rounds = 3
+    formulary = av.cam.load_formulary()
+    alternatives: List[Candidate] = []
+    label, rounds = "current plan", 0
+    resumed = head is not None and head["n"] > 0
+    if resumed:
+        label = head["label"] or label
+        alternatives = [Candidate(**c) for c in head["alternatives"]]
+        print(f"\n↻ Session {session}: continuing from round {head['n']}")
+    saved, round_prompt, used_since = (head["plan"] if head else None), None, usage_totals()
+    if objective and not resumed:
+        from param_optimizer import optimise_parameters, print_changes
+        plan_txt, changes = optimise_parameters(plan_txt, machine, material_desc, objective, formulary)
+        print(f"\n--- LOCAL OPTIMISATION ({objective}) ---\n")
+        print_changes(changes)
+        label = f"optimised for {objective}"
+
     while True:
         print("\n--- CNC PROCESS PLAN ---\n")
         print(plan_txt)
 
         print("\n--- AFFORDANCE VALIDATOR REPORT ---\n")
-        print(summarize_validation(plan_txt, machine, material_desc))
-
-        answer = input("\n❓ Would you like to regenerate with corrections? [y/N]: ").strip().lower()
-        if answer != "y":
-            break
-
-        # parse steps + collect issues
-        steps = av.parse_txt_plan(plan_txt)
-        issues, fixes = _collect_issues(steps, machine, tag, tools)
+        print(summarize_validation(plan_txt, machine, material_desc, formulary))
 
-        # build prompt
-        prompt = textwrap.dedent(f"""
-            ## Below is the current process plan for the part imported as image with detected issues.
-            **Please regenerate the entire process plan, keeping the same numbering, headings, and all the fields that are existing.**
-            **Substitute only the corrected parameters (n, Vf, ap, ae) that are suggested.**
-                                 
-            ## Part description / user goal
-            {description}
-            
-            ## Process plan
-            {plan_txt}
+        score, checked = score_plan(plan_txt, machine, material_desc, formulary)
+        current = Candidate(plan_txt, score, sum(not st["ok"] for st in checked), label)
+        if store is not None:
+            issues = [{"step": st["step"], "issues": st["issues"]} for st in checked if st["issues"]]
+            if plan_txt != saved:
+                now = usage_totals()
+                store.add_round(session, plan_txt, label or ("regenerated" if round_prompt else ""),
+                                score=score, failing=current.failing, issues=issues, prompt=round_prompt,
+                                usage={k: now[k] - used_since[k] for k in now},
+                                alternatives=[asdict(c) for c in alternatives])
+                saved, round_prompt, used_since = plan_txt, None, now
+            elif head is not None and head["score"] is None:
+                store.update_round(session, head["n"], score=score, failing=current.failing, issues=issues)
+                head = None
+        print(f"\nScore: {score:g} (lower is better)")
+        if alternatives:
+            print("Alternatives:")
+            for i, c in enumerate(alternatives, 2):
+                print(f"  [{i}] score {c.score:g}, {c.failing} failing steps  {c.label}")
 
-            ## Detected issues
-            {chr(10).join(issues)}
-
-            ## Suggested fixes
-            {chr(10).join(fixes)}
-
-            ## Contextual information
-            {context_block}
-
-            {machine_block}
+        if accept_score is not None and score <= accept_score:
+            print(f"\n✅ Score {score:g} ≤ {accept_score:g}: plan accepted.")
+            break
+        if max_rounds is not None and rounds >= max_rounds:
+            print(f"\n⏹ Stopped after {rounds} rounds.")
+            break
+        if interactive:
+            n_alt = len(alternatives)
+            pick = f", {'2' if n_alt == 1 else f'2-{n_alt + 1}'} = switch to alternative" if n_alt else ""
+            answer = input(f"\n❓ Would you like to regenerate with corrections? [y/N{pick}]: ").strip().lower()
+            if answer.isdigit() and 2 <= int(answer) <= len(alternatives) + 1:
+                chosen = alternatives[int(answer) - 2]
+                alternatives[int(answer) - 2] = current
+                plan_txt, label = chosen.plan, chosen.label
+                continue
+            if answer != "y":
+                break
+        rounds += 1
+        with tracing.span("optimise_round", round=rounds):
+            # parameter-only problems are patched locally; the LLM is for the rest
+            fixed, changes = av.correct_plan(plan_txt, machine, material_desc, formulary)
+            if changes and score_plan(fixed, machine, material_desc, formulary)[0] < score:
+                print("\n--- LOCAL CORRECTIONS ---\n")
+                for ch in changes:
+                    print(f"🔧 {ch['step']}: " + ", ".join(f"{k} {old} → {new}"
+                                                         for k, (old, new) in ch["changes"].items()))
+                current.label = "before local correction"
+                plan_txt, label, alternatives = fixed, "locally corrected", [current]
+                continue
 
-            ## Tool Library
-            {tool_block}
-   
-        """)
+            prompt = regeneration_prompt(plan_txt, description, machine, tag, checked, context_block)
+            round_prompt = prompt.text
+            print(f"\nPrompt {prompt.report()}")
+            used = usage_totals()
 
+            if candidates > 1:
+                # best-of-N: concurrent requests, the previous plan competes too
+                from rich.console import Console
+                with Console().status(f"Generating {candidates} candidates…"):
+                    ranked = generate_candidates(prompt.text, image_url, machine, material_desc, candidates, formulary)
+                _print_usage(used)
+                current.label = "previous plan"
+                ranked = sorted(ranked + [current], key=lambda c: (c.score, c.failing))
+                plan_txt, label, alternatives = ranked[0].plan, ranked[0].label, ranked[1:]
+                continue
 
-        # call LLM
-        with Progress(SpinnerColumn(), TextColumn("Regenerating…")) as bar:
-            t = bar.add_task("llm"); bar.start_task(t)
+            # call LLM, validating the new plan while it streams in
+            print("\n--- LIVE VALIDATION ---\n")
             if image_url:
-                plan_txt = call_llm_with_system(prompt, image_url,
-                                                system_message="You are an expert mechanical CAM engineer who assist the user developing the complete manufacturing process.",
-                                                model=MODEL)
+                chunks = stream_llm_with_system(prompt.text, image_url, system_message=SYSTEM_MESSAGE, model=MODEL)
             else:
-                res = _openai.chat.completions.create(
-                    model=MODEL,
-                    messages=[{"role": "user", "content": prompt}]
-                )
-                plan_txt = res.choices[0].message.content
-            bar.stop_task(t)
+                chunks = stream_llm_text(prompt.text, model=MODEL)
+            new_plan = stream_with_validation(chunks, machine, material_desc, "Regenerating…")
+            _print_usage(used)
+            alternatives = []
+            if new_plan is None:
+                print("Keeping the previous plan.")
+            else:
+                plan_txt, label = new_plan, ""
 
     return plan_txt
 
 
+def _print_usage(before: Dict[str, int]) -> None:
+    now = usage_totals()
+    calls = now["calls"] - before["calls"]
+    if calls:
+        print(f"Usage: {calls} call(s), {now['prompt_tokens'] - before['prompt_tokens']} prompt + "
+              f"{now['completion_tokens'] - before['completion_tokens']} completion tokens")
+
+
 def _collect_issues(steps: List[Dict],
                     machine: Dict,
                     tag: str,
@@ -145,25 +344,20 @@ def _collect_issues(steps: List[Dict],
     """
     Returns:
         - List of issue strings (for the prompt)
-        - (Unused) List of suggested corrections (not shown to user)
+        - List of suggested corrections (`av.suggest_corrections`)
     """
     issues_out, fix_out = [], []
-    sugg_fn = getattr(av, "suggest_corrections", None)
 
     for st in steps:
-        res = av.validate_step(st, machine, tag, tools)
-        ok  = res[0]
-        err = res[1]
-        sug = res[2] if len(res) == 3 else {}
-        if not ok and not sug and callable(sugg_fn):
-            tool_obj = next((t for t in tools if t.get("id") == st.get("tool_id")), {})
-            sug = sugg_fn(st, machine, tag, tool_obj)
+        ok, err = av.validate_step(st, machine, tag, tools)
         if not ok:
             issues_out.append(f"Step “{st['step']}”: " + ", ".join(err))
+            sug = av.suggest_corrections(st, machine, tag, av._find_tool(st.get("tool_id"), tools))
             if sug:
+                sug = {k: sug.get(k, st.get(k, "?")) for k in ("n", "vf", "ap", "ae")}
                 fix_out.append(
-                    f"{st['step']} → n={sug.get('n','?')} | Vf={sug.get('vf','?')} | "
-                    f"ap={sug.get('ap','?')} | ae={sug.get('ae','?')}"
+                    f"{st['step']} → n={sug['n']} | Vf={sug['vf']} | "
+                    f"ap={sug['ap']} | ae={sug['ae']}"
                 )
     return issues_out, fix_out
 
@@ -171,12 +365,54 @@ def _collect_issues(steps: List[Dict],
 if __name__ == "__main__":
     import argparse
     cli = argparse.ArgumentParser(description="Interactive CAM Plan Optimiser")
-    cli.add_argument("plan")
-    cli.add_argument("machine")
-    cli.add_argument("material")
-    cli.add_argument("--image")
+    cli.add_argument("plan", nargs="?")
+    cli.add_argument("machine", nargs="?")
+    cli.add_argument("material", nargs="?")
+    cli.add_argument("--goal", default="", help="part description / user goal")
+    cli.add_argument("--image", help="drawing file")
+    cli.add_argument("-n", "--candidates", type=int, default=CANDIDATES, help="concurrent regenerations per round")
+    cli.add_argument("--max-rounds", type=int)
+    cli.add_argument("--accept-score", type=float, help="stop once the plan scores this or lower (0 = no issues)")
+    cli.add_argument("--auto", action="store_true", help="regenerate without asking (unattended)")
+    cli.add_argument("--objective", choices=("mrr", "time"),
+                     help="optimise n / Vf / ap / ae locally first (max. MRR or min. cycle time)")
+    cli.add_argument("--session", action="store_true", help="save every round in a new session (session_store.py)")
+    cli.add_argument("--resume", metavar="SESSION", help="continue a saved session from its latest round")
     args = cli.parse_args()
 
-    final = optimise_plan(args.plan, args.machine, args.material, args.image)
+    from session_store import get_store
+    sid, context = None, ""
+    if args.resume:
+        store = get_store()
+        try:
+            sid = store.resolve(args.resume)
+        except KeyError as exc:
+            cli.error(exc.args[0])
+        meta = store.session(sid)
+        args.machine, args.material = args.machine or meta["machine"], args.material or meta["material"]
+        args.goal, context = args.goal or meta["description"] or "", meta["context"] or ""
+        if not args.image and meta["image_path"]:
+            from image_pipeline import file_sha256
+            if Path(meta["image_path"]).is_file() and file_sha256(meta["image_path"]) == meta["image_sha"]:
+                args.image = meta["image_path"]
+            else:
+                print(f"⚠️ Drawing {meta['image_path']} is gone or changed – regenerating without it.")
+    elif not (args.plan and args.machine and args.material):
+        cli.error("give plan, machine and material, or --resume SESSION")
+
+    image = None
+    if args.image:
+        from pipeline import load_drawing
+        image = load_drawing(args.image)
+    if args.session and not sid:
+        sid = get_store().create(args.goal, args.machine, args.material, _read(args.plan),
+                                 image_path=args.image, image_sha=image.source_sha256 if image else None)
+    if sid:
+        print(f"Session {sid} (resume with: python cam_optimizer.py --resume {sid})")
+    with tracing.span("cam_optimizer"):
+        final = optimise_plan(args.goal, args.plan, args.machine, args.material, image, context,
+                              candidates=args.candidates, max_rounds=args.max_rounds,
+                              accept_score=args.accept_score, interactive=not args.auto,
+                              objective=args.objective, session=sid)
     print("\n--- FINAL PLAN ---\n")
     print(final)
@@ -1,7 +1,9 @@
 # dimension_extractor.py
+from __future__ import annotations
 import json, re
-from typing import Dict
-from llm_client import call_llm_with_system
+from typing import Dict, List
+import tracing
+from llm_client import Image, call_llm_with_system
 
 # ---- LLM prompt that works for pulley drawings ----------
 _DIM_PROMPT = (
@@ -23,34 +25,67 @@ _REQUIRED = {
     "num_teeth"         : "Number of teeth"
 }
 
+def missing_fields(geo: Dict) -> List[str]:
+    """Keys of `_REQUIRED` that are absent or unreadable in `geo`."""
+    return [k for k in _REQUIRED
+            if str(geo.get(k, "")).lower() in {"", "none", "null", "unknown"}]
+
+
 def _ask_missing(llm_geo: Dict) -> Dict:
     """Prompt the user for any geometry values the LLM could not read."""
     filled = llm_geo.copy()
-    for k, label in _REQUIRED.items():
-        v = str(filled.get(k, "")).lower()
-        if v in {"", "none", "null", "unknown"}:
-            while True:
-                try:
-                    filled[k] = float(input(f"❓  {label} not detected – enter value [mm]: "))
-                    break
-                except ValueError:
-                    print("⚠  Please enter a numeric value.")
+    for k in missing_fields(filled):
+        while True:
+            try:
+                filled[k] = float(input(f"❓  {_REQUIRED[k]} not detected – enter value [mm]: "))
+                break
+            except ValueError:
+                print("⚠  Please enter a numeric value.")
     return filled
 
 
-def extract_geometry(image_data_url: str) -> Dict:
-    """
-    Call the vision model, parse its JSON, then interactively
-    ask the user for any missing dimensions.
-    """
+def _llm_geometry(image_data_url: Image) -> Dict:
     llm_raw = call_llm_with_system(
         _DIM_PROMPT,
         image_data_url,
         system_message="You are a mechanical engineer who reads techical drawings."
     )
     match = re.search(r"\{.*?\}", llm_raw, re.S)
-    llm_geo = json.loads(match.group() if match else "{}")
-    return _ask_missing(llm_geo)
+    return json.loads(match.group() if match else "{}")
+
+
+def extract_geometry(image_data_url: Image, interactive: bool = True,
+                     use_store: bool = True, name: str | None = None) -> Dict:
+    """
+    Call the vision model, parse its JSON, then interactively
+    ask the user for any missing dimensions.
+    With `interactive=False` the LLM values are returned as-is
+    (see `missing_fields()` for what could not be read).
+    Drawings already in the geometry store (see `geometry_store.py`) skip
+    the vision call; values typed in by the user are stored as well.
+    """
+    store = sha = None
+    with tracing.span("extract_geometry") as sp:      # without the time spent typing
+        if use_store:
+            from geometry_store import get_store, image_sha
+            store, sha = get_store(), image_sha(image_data_url)
+
+        llm_geo = store.get(sha) if store is not None else None
+        sp.set(store_hit=llm_geo is not None)
+        if llm_geo is None:
+            llm_geo = _llm_geometry(image_data_url)
+            # a refusal or an answer without JSON is not stored: the next call asks again
+            if store is not None and any(v is not None for v in llm_geo.values()):
+                store.record(sha, llm_geo, source="llm", name=name)
+    if not interactive:
+        return llm_geo
+
+    filled = _ask_missing(llm_geo)
+    if store is not None:
+        manual = {k: filled[k] for k in missing_fields(llm_geo)}
+        if manual:
+            store.record(sha, manual, source="user", name=name)
+    return filled
 
 
 def summary_text(geo: Dict) -> str:
@@ -0,0 +1,157 @@
+# embedding_cache.py
+"""Persistent, content-addressed embedding cache.
+
+Vectors are stored in a small SQLite file keyed by (model, sha256(text)), so a
+chunk or query is embedded at most once across runs.  The store is bounded by
+entry count and evicts the least-recently-used vectors first.
+
+`TransportEmbeddings` sends the misses through the shared `llm_transport`
+(pooled, rate-limited, retried) instead of a client of its own.
+
+Usage:
+    from embedding_cache import CachedEmbeddings, TransportEmbeddings
+    emb = CachedEmbeddings(TransportEmbeddings(m), model=m)
+    FAISS.from_documents(docs, emb)        # drop-in for any LangChain Embeddings
+"""
+from __future__ import annotations
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from pathlib import Path
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+from cache_paths import cache_dir
+
+# ---------------------------------------------------------------------------
+# CONFIG
+# ---------------------------------------------------------------------------
+_DB_PATH = cache_dir("embeddings.sqlite")
+_MAX_ENTRIES = 50_000                        # ≈ 300 MB for 1536-d vectors
+_BATCH_SIZE = 64                             # texts per embedding request
+
+
+def text_digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """SQLite-backed (model, digest) -> vector map with LRU eviction."""
+
+    def __init__(self, path: Path | str = _DB_PATH, max_entries: int = _MAX_ENTRIES):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path.as_posix(), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, digest TEXT NOT NULL, vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL, PRIMARY KEY (model, digest))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_lru ON embeddings(last_used)")
+        self._db.commit()
+
+    def get_many(self, model: str, digests: Sequence[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        if not digests:
+            return found
+        now = time.time()
+        with self._lock:
+            for i in range(0, len(digests), 500):          # SQLite variable limit
+                part = list(digests[i:i + 500])
+                marks = ",".join("?" * len(part))
+                rows = self._db.execute(
+                    f"SELECT digest, vector FROM embeddings WHERE model=? AND digest IN ({marks})",
+                    [model, *part],
+                ).fetchall()
+                for dg, blob in rows:
+                    found[dg] = array("f", blob).tolist()
+                self._db.execute(
+                    f"UPDATE embeddings SET last_used=? WHERE model=? AND digest IN ({marks})",
+                    [now, model, *part],
+                )
+            self._db.commit()
+        return found
+
+    def put_many(self, model: str, items: Iterable[Tuple[str, Sequence[float]]]) -> None:
+        now = time.time()
+        rows = [(model, dg, array("f", vec).tobytes(), now) for dg, vec in items]
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO embeddings VALUES (?,?,?,?)", rows)
+            self._evict()
+            self._db.commit()
+
+    def _evict(self) -> None:
+        (count,) = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        if count > self.max_entries:
+            self._db.execute(
+                "DELETE FROM embeddings WHERE rowid IN ("
+                " SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+class TransportEmbeddings(Embeddings):
+    """OpenAI embeddings over `llm_transport.get_transport()`; raw strings, no tiktoken ids."""
+
+    def __init__(self, model: str):
+        self.model = model
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        from llm_transport import get_transport
+        return get_transport().embed(list(texts), self.model) if texts else []
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class CachedEmbeddings(Embeddings):
+    """Wrap any LangChain `Embeddings`; only cache misses reach `inner`, in bounded batches."""
+
+    def __init__(self, inner: Embeddings, model: str,
+                 store: EmbeddingStore | None = None, batch_size: int = _BATCH_SIZE):
+        self.inner = inner
+        self.model = model
+        self.store = store or EmbeddingStore()
+        self.batch_size = batch_size
+        self.hits = self.misses = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        digests = [text_digest(t) for t in texts]
+        known = self.store.get_many(self.model, list(dict.fromkeys(digests)))
+
+        # unique misses only: the same text is never sent twice in one call
+        todo: Dict[str, str] = {}
+        for dg, t in zip(digests, texts):
+            if dg not in known:
+                todo.setdefault(dg, t)
+        self.hits += len(texts) - len(todo)
+        self.misses += len(todo)
+
+        pending = list(todo.items())
+        for i in range(0, len(pending), self.batch_size):
+            batch = pending[i:i + self.batch_size]
+            vectors = self.inner.embed_documents([t for _, t in batch])
+            fresh = [(dg, vec) for (dg, _), vec in zip(batch, vectors)]
+            self.store.put_many(self.model, fresh)
+            known.update(fresh)
+        return [known[dg] for dg in digests]
+
+    def embed_query(self, text: str) -> List[float]:
+        dg = text_digest(text)
+        known = self.store.get_many(self.model, [dg])
+        if dg in known:
+            self.hits += 1
+            return known[dg]
+        self.misses += 1
+        vec = self.inner.embed_query(text)
+        self.store.put_many(self.model, [(dg, vec)])
+        return vec
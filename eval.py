@@ -1,48 +1,266 @@
-import os
-from dotenv import load_dotenv
-import openai
-from openai import OpenAI
-import tkinter as tk
-from tkinter import filedialog
-
-load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
-ENGINE = "gpt-4o"
-client = OpenAI()
-
-instructions = """
-You are an assistant, take the input txt and the query and answer correctly. 
-Answer the question with one word. You are not allowed to add any extra words, spaces or punctuation, even at the end of the answer.
+# eval.py
+"""Headless evaluation of question answering over CAM process plans.
+
+Every question of the bank (`eval_questions.json`) is asked about every step
+it applies to, in every plan (`test_pulley_*.txt` by default).  The expected
+answer is computed locally from the parsed step with the formulary equations
+(Vc = π·D·n/1000, f_z = Vf/(n·z), MRR = ae·ap·Vf, h_av, Taylor, P_c …), so a
+numeric answer is right when it is within the question's relative tolerance.
+
+Questions run concurrently (`-j`).  Answers are cached per (model, prompt
+version, plan, question) in `.cache/eval_answers.sqlite`, so re-runs only ask
+what is new.  Each (model, prompt) run reports accuracy, p50 / p95 latency of
+the API calls and the tokens used; `-o` writes one JSON line per answer.
+
+Usage:
+    python eval.py                                   # gpt-4o, prompt v1, sample plans
+    python eval.py --models gpt-4o gpt-4o-mini --prompts v1 v2 -j 16 -o eval.jsonl
+    python eval.py my_plans/*.txt --questions vc fz --no-cache
+    python eval.py --base-url http://127.0.0.1:8765/v1      # against the mock server
 """
+from __future__ import annotations
+import argparse, glob, json, math, os, re, statistics, sys, time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict, field, replace
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from cache_paths import cache_dir
+
+# ---------------------------------------------------------------------------
+# CONFIG
+# ---------------------------------------------------------------------------
+_QUESTIONS = Path("eval_questions.json")
+_PLANS = "test_pulley_*.txt"
+_CACHE_PATH = cache_dir("eval_answers.sqlite")
+PROMPTS = {
+    # the original single-question prompt
+    "v1": ("You are an assistant, take the input txt and the query and answer correctly. \n"
+           "Answer the question with one word. You are not allowed to add any extra words, spaces "
+           "or punctuation, even at the end of the answer."),
+    "v2": ("You answer questions about the CNC process plan given by the user, using the standard "
+           "machining formulas (v_c = π·D·n/1000, f_z = v_f/(n·z), MRR = a_e·a_p·v_f, …). "
+           "Reply with a single number in the unit asked for – no units, words or explanation."),
+}
+
+_NUMBER = re.compile(r"[-+]?\d[\d,]*(?:\.\d+)?(?:[eE][-+]?\d+)?")
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Ground truth (formulary equations, CAM.txt "Basic Equations")
+# ─────────────────────────────────────────────────────────────────────────────
+def _vc(s, g):
+    return math.pi * s["tool_dia"] * s["n"] / 1000
+
+
+def _fz(s, g):
+    return s["vf"] / (s["n"] * g["z"])
+
+
+def _mrr(s, g):
+    return s["ae"] * s["ap"] * s["vf"]
+
+
+def _h_av(s, g):
+    """Face milling: h_av = 2·f_z·a_e·sin(k_re) / (φ·D), φ = 2·acos(1 − 2·a_e/D)."""
+    D, ae = s["tool_dia"], min(s["ae"], s["tool_dia"])
+    phi = 2 * math.acos(1 - 2 * ae / D)
+    return 2 * _fz(s, g) * ae * math.sin(math.radians(g["k_re"])) / (phi * D)
+
+
+def _tool_life(s, g):
+    """Taylor: v_c · T^n = C."""
+    return (g["C"] / _vc(s, g)) ** (1 / g["n_taylor"])
+
+
+def _power(s, g):
+    """P_c [kW] = k_c · MRR / 60e6 (N/mm² · mm³/min → kW)."""
+    return g["k_c"] * _mrr(s, g) / 60e6
+
+
+def _time(s, g):
+    return g["length"] / s["vf"]
+
+
+_TRUTH: Dict[str, Callable] = {
+    "vc": _vc, "fz": _fz, "mrr": _mrr, "h_av": _h_av, "tool_life": _tool_life,
+    "power": _power, "time": _time, "tool_id": lambda s, g: s["tool_id"],
+}
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Cases
+# ─────────────────────────────────────────────────────────────────────────────
+@dataclass
+class Case:
+    plan: str                  # file name
+    qid: str
+    step: Optional[int]        # 0-based step index, None for plan-level questions
+    question: str
+    expected: float
+    tol: float
+    answer: str = ""
+    value: Optional[float] = None
+    correct: bool = False
+    latency_s: float = 0.0
+    cached: bool = False
+    error: Optional[str] = None
+    model: str = ""
+    prompt: str = ""
+    plan_text: str = field(default="", repr=False)
+
+
+def build_cases(plan_paths: List[Path], bank: List[Dict], only: Optional[List[str]] = None) -> List[Case]:
+    from plan_parser import parse_txt_plan
+    cases = []
+    for path in plan_paths:
+        text = path.read_text(encoding="utf-8")
+        steps = parse_txt_plan(text)
+        if not steps:
+            print(f"⚠️  {path.name}: no steps could be parsed – skipped", file=sys.stderr)
+            continue
+        for q in bank:
+            if only and q["id"] not in only:
+                continue
+            g = q.get("given", {})
+            if q.get("per") == "plan":
+                cases.append(Case(path.name, q["id"], None, q["question"].format(**g),
+                                  len(steps), q["tol"], plan_text=text))
+                continue
+            for i, s in enumerate(steps):
+                if any(k not in s for k in q["needs"]) or s["strategy"] in q.get("skip", ()):
+                    continue
+                ref = f'step {i + 1} ("{s["step"]}")'
+                cases.append(Case(path.name, q["id"], i, q["question"].format(step=ref, **g),
+                                  _TRUTH[q["id"]](s, g), q["tol"], plan_text=text))
+    return cases
+
+
+def parse_number(answer: str) -> Optional[float]:
+    """First number in the answer; "2,405" → 2405, "0,083" → 0.083."""
+    m = _NUMBER.search(answer or "")
+    if not m:
+        return None
+    s = m.group(0)
+    if "," in s:
+        s = s.replace(",", "") if re.fullmatch(r"[-+]?\d{1,3}(?:,\d{3})+(?:\.\d+)?", s) else s.replace(",", ".")
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+
+def _correct(value: Optional[float], expected: float, tol: float) -> bool:
+    if value is None:
+        return False
+    if tol == 0:
+        return value == expected
+    return abs(value - expected) <= tol * abs(expected)
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Runs
+# ─────────────────────────────────────────────────────────────────────────────
+def _ask(case: Case, model: str, prompt: str, cache) -> Case:
+    import llm_client
+    from response_cache import request_key
+
+    system = PROMPTS[prompt]
+    user = f"{case.plan_text}\n\n{case.question}"        # plan first: shared prefix per plan
+    key = request_key(model, [{"role": "system", "content": system}, {"role": "user", "content": user}],
+                      temperature=0, prompt=prompt)
+    case.model, case.prompt = model, prompt
+    t0 = time.perf_counter()
+    try:
+        hit = cache.get(key) if cache is not None else None
+        case.cached = hit is not None
+        case.answer = hit if hit is not None else llm_client.call_llm_text(
+            user, system_message=system, model=model, use_cache=False, temperature=0)
+        if cache is not None and not case.cached and case.answer is not None:
+            cache.put(key, case.answer)
+    except Exception as exc:
+        case.error = f"{type(exc).__name__}: {exc}"
+    case.latency_s = time.perf_counter() - t0
+    case.value = parse_number(case.answer or "")
+    case.correct = _correct(case.value, case.expected, case.tol)
+    return case
+
+
+def run(cases: List[Case], model: str, prompt: str, concurrency: int = 8, cache=None) -> Dict:
+    """Ask every case once (fresh copies); returns the summary and the answered cases."""
+    import llm_client
+    before = llm_client.usage_totals()
+    todo = [replace(c) for c in cases]
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        done = list(pool.map(lambda c: _ask(c, model, prompt, cache), todo))
+    wall = time.perf_counter() - t0
+    after = llm_client.usage_totals()
+    called = sorted(c.latency_s for c in done if not c.cached and c.error is None)
+    by_q: Dict[str, List[bool]] = {}
+    for c in done:
+        by_q.setdefault(c.qid, []).append(c.correct)
+    return {
+        "model": model, "prompt": prompt, "questions": len(done),
+        "accuracy": sum(c.correct for c in done) / max(len(done), 1),
+        "by_question": {q: sum(v) / len(v) for q, v in by_q.items()},
+        "cached": sum(c.cached for c in done), "errors": sum(c.error is not None for c in done),
+        "p50_s": statistics.median(called) if called else None,
+        "p95_s": called[int(0.95 * (len(called) - 1))] if called else None,
+        "prompt_tokens": after["prompt_tokens"] - before["prompt_tokens"],
+        "completion_tokens": after["completion_tokens"] - before["completion_tokens"],
+        "wall_s": wall, "cases": done,
+    }
+
+
+def _report(runs: List[Dict]) -> None:
+    ms = lambda v: f"{v * 1000:7.0f} ms" if v is not None else "      – "
+    print(f"\n{'model':20s} {'prompt':6s} {'n':>5s} {'acc':>6s} {'cached':>6s} {'err':>4s} "
+          f"{'p50':>10s} {'p95':>10s} {'tok in':>8s} {'tok out':>8s} {'wall':>7s}")
+    for r in runs:
+        print(f"{r['model']:20s} {r['prompt']:6s} {r['questions']:5d} {r['accuracy']:6.1%} {r['cached']:6d} "
+              f"{r['errors']:4d} {ms(r['p50_s'])} {ms(r['p95_s'])} {r['prompt_tokens']:8d} "
+              f"{r['completion_tokens']:8d} {r['wall_s']:6.1f}s")
+    qids = sorted({q for r in runs for q in r["by_question"]})
+    print("\naccuracy per question" + "".join(f"  {q:>9s}" for q in qids))
+    for r in runs:
+        print(f"{r['model'][:14]:14s} {r['prompt']:6s}"
+              + "".join(f"  {r['by_question'].get(q, float('nan')):9.0%}" for q in qids))
+
+
+if __name__ == "__main__":
+    cli = argparse.ArgumentParser(description="Batch evaluation of plan question answering")
+    cli.add_argument("plans", nargs="*", help=f"plan .txt files (default: {_PLANS})")
+    cli.add_argument("--models", nargs="+", default=["gpt-4o"])
+    cli.add_argument("--prompts", nargs="+", default=["v1"], choices=sorted(PROMPTS))
+    cli.add_argument("--questions", nargs="+", help="question ids to ask (default: all)")
+    cli.add_argument("-j", "--concurrency", type=int, default=8)
+    cli.add_argument("-o", "--out", help="JSONL file, one line per answer")
+    cli.add_argument("--no-cache", action="store_true", help="ask every question again")
+    cli.add_argument("--base-url", help="OpenAI-compatible endpoint, e.g. a local mock server")
+    a = cli.parse_args()
+
+    if a.base_url:
+        os.environ["OPENAI_BASE_URL"] = a.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "mock")
+    if os.getenv("OPENAI_BASE_URL"):
+        from batch_runner import _isolate_endpoint_caches
+        _isolate_endpoint_caches(os.environ["OPENAI_BASE_URL"])
+        _CACHE_PATH = cache_dir(_CACHE_PATH.name)
+
+    paths = [Path(p) for p in (a.plans or sorted(glob.glob(_PLANS)))]
+    cases = build_cases(paths, json.loads(_QUESTIONS.read_text(encoding="utf-8")), a.questions)
+    print(f"{len(cases)} questions over {len(paths)} plans, "
+          f"{len(a.models) * len(a.prompts)} run(s)")
+    if not cases:
+        sys.exit(1)
 
-# Compute the MRR for the initial facing operation
-# Given constants C=450 and n=0.2 use the Taylor's formula to compute the tool life in min for the tool used for facing operation
-# Compute the cutting speed for the initial facing operation
-question = "Given the tool's entering angle k_re = 90°, compute the average chip thickness h_av for the initial facing operation"
-
-# === Ask user to select a .txt file ===
-root = tk.Tk()
-root.withdraw()
-txt_file_path = filedialog.askopenfilename(
-    title="Select process plan .txt file",
-    filetypes=[("Text files", "*.txt")]
-)
-root.destroy()
-
-if not txt_file_path:
-    print("No file selected. Exiting.")
-    exit(1)
-
-with open(txt_file_path, "r", encoding="utf-8") as f:
-    response = f.read()
-
-completion = client.chat.completions.create(
-     model=ENGINE,
-     messages=[
-        {"role": "developer", "content": instructions},
-        {"role": "user", "content": response},
-        {"role": "user", "content": question}
-    ]
-)
-
-print(completion.choices[0].message.content)
\ No newline at end of file
+    from response_cache import ResponseCache
+    cache = None if a.no_cache else ResponseCache(_CACHE_PATH, ttl=None)
+    runs = [run(cases, m, p, a.concurrency, cache) for m in a.models for p in a.prompts]
+    _report(runs)
+    if a.out:
+        with open(a.out, "w", encoding="utf-8") as out:
+            for r in runs:
+                for c in r["cases"]:
+                    rec = asdict(c)
+                    rec.pop("plan_text")
+                    out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        print(f"\n→ {a.out}")
@@ -0,0 +1,172 @@
+# formulary_chunker.py
+"""Structure-aware chunking of the CAM formulary.
+
+CAM.txt is a sequence of `## Part`s made of `# Section`s, each framed by
+dashed lines; unframed `#` headers ("# Slab Milling", "# Cutting Force and
+Power") are sub-sections of the framed one above.  One section becomes one
+chunk, so a table or a group of equations is never cut in half.  Only a
+section longer than `CHUNK_MAX_CHARS` is split, at blank lines, each piece
+repeating the section header.  A part's intro text goes with its first
+section.
+
+Every `Chunk` carries metadata for filtering:
+    section      "Basic Equations › Milling › Cutting Force and Power"
+    process      "milling" | "turning" | "drilling" | "" (general)
+    operations   strategies its headers name: roughing, finishing, slotting, drilling
+    materials    ISO classes of its table rows, or named in its headers
+
+Usage:
+    chunks = chunk_formulary(Path("CAM.txt").read_text())
+    [c.section for c in chunks if c.matches(process="milling", material="N")]
+    c.for_material("N").text        # ISO tables narrowed to the N rows
+"""
+from __future__ import annotations
+import re
+from dataclasses import dataclass, replace
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# ---------------------------------------------------------------------------
+# CONFIG
+# ---------------------------------------------------------------------------
+CHUNK_MAX_CHARS = 1800
+CHUNKER_VERSION = 1               # bump when the chunk boundaries or metadata change
+
+_PART = re.compile(r"^##\s+(.*?)\s*$")
+_SECTION = re.compile(r"^#\s+(.*?)\s*$")
+_RULE = re.compile(r"^-{20,}\s*$")                        # frame lines around a header
+_ISO_ROW = re.compile(r"^\|?\s*([PMKNSH])\s*\(")         # "P (Steel) …" / "| N (Alu…"
+_PROCESSES = (("turning", ("turning",)),
+              ("drilling", ("drilling", "trepanning", "reaming", "counterboring")),
+              ("milling", ("milling",)))
+_OPERATIONS = {
+    "roughing":  ("roughing", "adaptive", "trochoidal", "hpc"),
+    "finishing": ("finishing", "finish", "ra (", "roughness"),
+    "slotting":  ("slot", "pocket", "groove"),
+    "drilling":  ("drill", "hole", "ream", "pecking"),
+}
+_MATERIAL_WORDS = {"N": ("aluminium", "aluminum"), "M": ("stainless",),
+                   "S": ("titanium", "superalloy", "super-alloy"), "H": ("hardened",),
+                   "K": ("cast iron",)}
+
+
+@dataclass(frozen=True)
+class Chunk:
+    text: str
+    section: str = ""
+    process: str = ""
+    operations: Tuple[str, ...] = ()
+    materials: Tuple[str, ...] = ()
+
+    def matches(self, process: Optional[Iterable[str] | str] = None,
+                operation: Optional[str] = None, material: Optional[str] = None) -> bool:
+        """True unless the chunk is specific to another process / operation / material."""
+        if process and self.process:
+            wanted = (process,) if isinstance(process, str) else tuple(process)
+            if self.process not in wanted:
+                return False
+        if operation and self.operations and operation not in self.operations:
+            return False
+        return not (material and self.materials and material not in self.materials)
+
+    def for_material(self, material: Optional[str]) -> "Chunk":
+        """The chunk with table rows of other ISO classes removed."""
+        if not material or len(self.materials) < 2:
+            return self
+        lines = [ln for ln in self.text.split("\n")
+                 if (m := _ISO_ROW.match(ln)) is None or m.group(1) == material]
+        return replace(self, text="\n".join(lines), materials=(material,))
+
+    def to_dict(self) -> Dict:
+        return {"text": self.text, "section": self.section, "process": self.process,
+                "operations": list(self.operations), "materials": list(self.materials)}
+
+    @classmethod
+    def from_dict(cls, d: Dict) -> "Chunk":
+        return cls(d["text"], d.get("section", ""), d.get("process", ""),
+                   tuple(d.get("operations", ())), tuple(d.get("materials", ())))
+
+
+def _process(path: List[str]) -> str:
+    for title in reversed(path):
+        low = title.lower()
+        for name, words in _PROCESSES:
+            if any(w in low for w in words):
+                return name
+    return ""
+
+
+def _metadata(path: List[str], body: str) -> Dict:
+    # headers only: the body of a general section mentions every strategy in passing
+    head = " ".join(path).lower()
+    ops = tuple(op for op, words in _OPERATIONS.items() if any(w in head for w in words))
+    rows = {m.group(1) for ln in body.split("\n") if (m := _ISO_ROW.match(ln))}
+    if not rows:                   # no ISO table: a section *about* one material class
+        rows = {iso for iso, words in _MATERIAL_WORDS.items() if any(w in head for w in words)}
+    return {"section": " › ".join(path), "process": _process(path), "operations": ops,
+            "materials": tuple(iso for iso in "PMKNSH" if iso in rows)}
+
+
+def _split_long(header: str, body: str, max_chars: int) -> List[str]:
+    """Pieces of at most `max_chars` made of whole blank-line-separated blocks."""
+    pieces, cur = [], ""
+    for block in re.split(r"\n\s*\n", body):
+        if cur and len(header) + len(cur) + len(block) + 2 > max_chars:
+            pieces.append(cur)
+            cur = ""
+        cur = f"{cur}\n\n{block}" if cur else block
+    if cur:
+        pieces.append(cur)
+    return [f"{header}\n{p}" for p in pieces]
+
+
+def chunk_formulary(text: str, max_chars: int = CHUNK_MAX_CHARS) -> List[Chunk]:
+    # collect (path, header line, body lines); unframed `#` headers nest under framed ones
+    sections: List[Tuple[List[str], str, List[str]]] = []
+    part, group, prev = "", "", ""
+    for ln in text.split("\n"):
+        if _RULE.match(ln):
+            prev = ln
+            continue
+        m_part, m_sec = _PART.match(ln), _SECTION.match(ln)
+        if m_part:
+            part, group = m_part.group(1), ""
+            sections.append(([part], ln, []))
+        elif m_sec:
+            title = m_sec.group(1)
+            if _RULE.match(prev) or not group:
+                group, path = title, [part, title]
+            else:
+                path = [part, group, title]
+            sections.append(([p for p in path if p], ln, []))
+        elif sections:
+            sections[-1][2].append(ln)
+        if ln.strip():
+            prev = ln
+
+    chunks: List[Chunk] = []
+    for i, (path, header, body_lines) in enumerate(sections):
+        body = re.sub(r"\n\s*\n(?:\s*\n)+", "\n\n", "\n".join(body_lines)).strip()
+        if not body:
+            continue
+        nxt = sections[i + 1][0] if i + 1 < len(sections) else []
+        if len(path) == 1 and len(nxt) > 1:       # a part's intro goes with its first section
+            sections[i + 1][2][:0] = ["", *body_lines, "", sections[i + 1][1]]
+            sections[i + 1] = (nxt, header, sections[i + 1][2])
+            continue
+        meta = _metadata(path, body)
+        texts = ([f"{header}\n{body}"] if len(header) + len(body) + 1 <= max_chars
+                 else _split_long(header, body, max_chars))
+        chunks.extend(Chunk(t, **meta) for t in texts)
+    return chunks
+
+
+if __name__ == "__main__":
+    import argparse
+    from pathlib import Path
+    cli = argparse.ArgumentParser(description="Show the chunks of a CAM formulary")
+    cli.add_argument("path", nargs="?", default="CAM.txt")
+    cli.add_argument("--max-chars", type=int, default=CHUNK_MAX_CHARS)
+    a = cli.parse_args()
+    for i, c in enumerate(chunk_formulary(Path(a.path).read_text(encoding="utf-8"), a.max_chars)):
+        print(f"{i:2d} {len(c.text):5d} ch  {c.section}  [{c.process or '-'}] "
+              f"ops={','.join(c.operations) or '-'} iso={''.join(c.materials) or '-'}")
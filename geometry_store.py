@@ -0,0 +1,186 @@
+# geometry_store.py
+"""Local database of extracted drawing geometry (SQLite).
+
+Rows are keyed by the sha256 of the drawing file, so a drawing that was read
+once is never sent to the vision model again – whatever its file name or the
+image preset used.  Each field keeps its source (`llm` or `user`) and a
+confidence:
+    user   1.0   typed in by hand (`_ask_missing` or `set`)
+    llm    0.9   the pulley geometry is self-consistent (see `_consistent`)
+    llm    0.5   not checked / inconsistent
+
+Usage:
+    python geometry_store.py prefetch dataset/ [-j 4] [--force]
+    python geometry_store.py show  "dataset/3709N41_….jpg"
+    python geometry_store.py set   "dataset/3709N41_….jpg" bore_diameter_mm=12
+    python geometry_store.py forget "dataset/3709N41_….jpg"
+"""
+from __future__ import annotations
+import base64, hashlib, json, math, sqlite3, threading, time
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from cache_paths import cache_dir
+
+# ---------------------------------------------------------------------------
+# CONFIG
+# ---------------------------------------------------------------------------
+_DB_PATH = cache_dir("geometry.sqlite")
+_PITCH_TOL = 0.03                 # relative tolerance of the pitch-diameter check
+
+_CONFIDENCE = {"user": 1.0, "checked": 0.9, "llm": 0.5}
+
+
+def image_sha(image) -> str:
+    """sha256 of the drawing behind a path, a data URL or a `PreparedImage`."""
+    if hasattr(image, "source_sha256"):
+        return image.source_sha256
+    if isinstance(image, str) and image.startswith("data:") and "," in image:
+        return hashlib.sha256(base64.b64decode(image.split(",", 1)[1])).hexdigest()
+    return hashlib.sha256(Path(image).read_bytes()).hexdigest()
+
+
+def _consistent(geo: Dict) -> bool:
+    """Pitch diameter ≈ pitch · teeth / π and outer < pitch diameter."""
+    try:
+        pd, od = float(geo["pitch_diameter_mm"]), float(geo["outer_diameter_mm"])
+        expected = float(geo["tooth_pitch_mm"]) * float(geo["num_teeth"]) / math.pi
+    except (KeyError, TypeError, ValueError):
+        return False
+    return abs(pd - expected) <= _PITCH_TOL * expected and od < pd
+
+
+class GeometryStore:
+    """sha256 -> {field: value}, with per-field source and confidence."""
+
+    def __init__(self, path: Path | str = _DB_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path.as_posix(), check_same_thread=False)
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS drawings ("
+            " sha TEXT PRIMARY KEY, name TEXT, extracted REAL);"   # NULL: only user values
+            "CREATE TABLE IF NOT EXISTS fields ("
+            " sha TEXT NOT NULL, field TEXT NOT NULL, value TEXT NOT NULL,"
+            " source TEXT NOT NULL, confidence REAL NOT NULL, updated REAL NOT NULL,"
+            " PRIMARY KEY (sha, field));"
+        )
+        self._db.commit()
+
+    def get(self, sha: str) -> Optional[Dict]:
+        """Stored geometry, or None if this drawing was never extracted (or nothing was read)."""
+        with self._lock:
+            row = self._db.execute("SELECT extracted FROM drawings WHERE sha=?", (sha,)).fetchone()
+            if row is None or row[0] is None:
+                return None
+            rows = self._db.execute("SELECT field, value FROM fields WHERE sha=?", (sha,)).fetchall()
+        geo = {f: json.loads(v) for f, v in rows}
+        return geo if any(v is not None for v in geo.values()) else None
+
+    def details(self, sha: str) -> List[Dict]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT field, value, source, confidence, updated FROM fields WHERE sha=? ORDER BY field",
+                (sha,)).fetchall()
+        return [{"field": f, "value": json.loads(v), "source": s, "confidence": c, "updated": u}
+                for f, v, s, c, u in rows]
+
+    def record(self, sha: str, geo: Dict, source: str = "llm", name: str | None = None) -> None:
+        """Store `geo`; LLM values never overwrite values typed in by a user."""
+        now = time.time()
+        if source == "user":
+            conf = _CONFIDENCE["user"]
+        else:
+            conf = _CONFIDENCE["checked" if _consistent(geo) else "llm"]
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO drawings VALUES (?,?,?) ON CONFLICT(sha) DO UPDATE SET"
+                " name=COALESCE(excluded.name, name), extracted=COALESCE(excluded.extracted, extracted)",
+                (sha, name, None if source == "user" else now))
+            for field, value in geo.items():
+                if source != "user" and self._db.execute(
+                        "SELECT 1 FROM fields WHERE sha=? AND field=? AND source='user'",
+                        (sha, field)).fetchone():
+                    continue
+                self._db.execute("INSERT OR REPLACE INTO fields VALUES (?,?,?,?,?,?)",
+                                 (sha, field, json.dumps(value), source, conf, now))
+            self._db.commit()
+
+    def forget(self, sha: str, keep_user: bool = False) -> None:
+        """Drop a drawing (or, with `keep_user`, only its LLM values) so it is re-extracted."""
+        with self._lock:
+            if keep_user:
+                self._db.execute("DELETE FROM fields WHERE sha=? AND source!='user'", (sha,))
+                self._db.execute("UPDATE drawings SET extracted=NULL WHERE sha=?", (sha,))
+            else:
+                self._db.execute("DELETE FROM fields WHERE sha=?", (sha,))
+                self._db.execute("DELETE FROM drawings WHERE sha=?", (sha,))
+            self._db.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM drawings").fetchone()[0]
+
+
+@lru_cache(maxsize=1)
+def get_store() -> GeometryStore:
+    return GeometryStore()
+
+# ─────────────────────────────────────────────────────────────────────────────
+# CLI
+# ─────────────────────────────────────────────────────────────────────────────
+def _prefetch(folder: str, workers: int, force: bool, preset: str | None) -> None:
+    from concurrent.futures import ThreadPoolExecutor
+    from dimension_extractor import extract_geometry, missing_fields
+    from pipeline import load_drawing
+
+    store = get_store()
+    paths = sorted(p for p in Path(folder).iterdir() if p.suffix.lower() in (".png", ".jpg", ".jpeg"))
+
+    def one(p: Path) -> str:
+        image = load_drawing(p, preset)
+        if force:
+            store.forget(image.source_sha256, keep_user=True)
+        cached = store.get(image.source_sha256) is not None
+        geo = extract_geometry(image, interactive=False, name=p.name)
+        miss = missing_fields(geo)
+        return (f"{'cached ' if cached else 'new    '} {p.name}"
+                + (f"  missing: {', '.join(miss)}" if miss else ""))
+
+    with ThreadPoolExecutor(workers) as pool:
+        for line in pool.map(one, paths):
+            print(line)
+    print(f"{len(store)} drawings in {store.path}")
+
+
+if __name__ == "__main__":
+    import argparse
+    cli = argparse.ArgumentParser(description="Extracted-geometry database")
+    sub = cli.add_subparsers(dest="cmd", required=True)
+    s = sub.add_parser("prefetch", help="extract every drawing of a folder")
+    s.add_argument("folder", nargs="?", default="dataset")
+    s.add_argument("-j", "--workers", type=int, default=4)
+    s.add_argument("--force", action="store_true", help="re-extract drawings already stored (hand-entered values are kept)")
+    s.add_argument("--preset", help="image preset (default: IMAGE_PRESET / balanced)")
+    for cmd in ("show", "forget"):
+        sub.add_parser(cmd).add_argument("drawing")
+    s = sub.add_parser("set", help="correct fields by hand (stored as source=user)")
+    s.add_argument("drawing")
+    s.add_argument("values", nargs="+", metavar="field=value")
+    a = cli.parse_args()
+
+    if a.cmd == "prefetch":
+        _prefetch(a.folder, a.workers, a.force, a.preset)
+    else:
+        sha = image_sha(a.drawing)
+        store = get_store()
+        if a.cmd == "set":
+            vals = dict(v.split("=", 1) for v in a.values)
+            store.record(sha, {k: float(v) for k, v in vals.items()}, source="user",
+                         name=Path(a.drawing).name)
+        elif a.cmd == "forget":
+            store.forget(sha)
+        for row in store.details(sha):
+            print(f"{row['field']:20s} {row['value']!s:>10s}  {row['source']:4s} {row['confidence']:.1f}")
@@ -0,0 +1,131 @@
+# hybrid_retrieval.py
+"""In-memory lexical and local-vector search over the formulary chunks.
+
+`BM25Index`     Okapi BM25 over an inverted index; exact terms such as "fz",
+                "Vc", "trochoidal" or an ISO letter decide the ranking.
+`LocalEmbedder` TF-IDF vectors of hashed words + character n-grams (NumPy),
+                a network-free stand-in for the OpenAI embeddings; n-grams make
+                "aluminium" ≈ "aluminum" and "trochoid" ≈ "trochoidal".
+`rrf_fuse`      reciprocal-rank fusion of several rankings.
+
+Everything is built from the chunk texts in a few milliseconds and answers a
+query in well under a millisecond; nothing is persisted.
+
+Usage:
+    bm25, vec = BM25Index(chunks), LocalEmbedder(chunks)
+    ids = rrf_fuse([bm25.rank(q), vec.rank(q)])[:k]
+"""
+from __future__ import annotations
+import hashlib, math, re
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+# ---------------------------------------------------------------------------
+# CONFIG
+# ---------------------------------------------------------------------------
+BM25_K1, BM25_B = 1.5, 0.75
+RRF_K = 60                        # damping constant of reciprocal-rank fusion
+_DIM = 4096                       # hashed feature space of LocalEmbedder
+_NGRAMS = (3, 4, 5)               # character n-gram sizes (on "<word>")
+
+_TOKEN = re.compile(r"[a-z0-9µμ]+(?:(?:[_.]\{?|\{)[a-z0-9,]+\}?)*")
+_STOP = frozenset("""a an and are as at be by for from has in is it its of on or the this to
+                     use used using with what which how when should""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-case word tokens; "f_z" / "k_{c0,4}" / "Vc" become "fz" / "kc0,4" / "vc"."""
+    out = []
+    for t in _TOKEN.findall(text.lower()):
+        t = t.replace("_", "").replace("{", "").replace("}", "").rstrip(".,")
+        if t and t not in _STOP:
+            out.append(t)
+    return out
+
+
+class BM25Index:
+    """Okapi BM25; postings are term -> (doc ids, term frequencies) arrays."""
+
+    def __init__(self, docs: Sequence[str]):
+        self.n = len(docs)
+        tokens = [tokenize(d) for d in docs]
+        self.doc_len = np.array([len(t) for t in tokens], dtype=np.float64)
+        avg = self.doc_len.mean() if self.n else 1.0
+        self._norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_len / (avg or 1.0))
+        postings: Dict[str, Dict[int, int]] = {}
+        for i, toks in enumerate(tokens):
+            for t in toks:
+                d = postings.setdefault(t, {})
+                d[i] = d.get(i, 0) + 1
+        self._postings = {t: (np.fromiter(d.keys(), np.int32, len(d)),
+                              np.fromiter(d.values(), np.float64, len(d)))
+                          for t, d in postings.items()}
+        self._idf = {t: math.log(1 + (self.n - len(ids) + 0.5) / (len(ids) + 0.5))
+                     for t, (ids, _) in self._postings.items()}
+
+    def scores(self, query: str) -> np.ndarray:
+        s = np.zeros(self.n)
+        for t in set(tokenize(query)):
+            hit = self._postings.get(t)
+            if hit is not None:
+                ids, tf = hit
+                s[ids] += self._idf[t] * tf * (BM25_K1 + 1) / (tf + self._norm[ids])
+        return s
+
+    def rank(self, query: str) -> List[int]:
+        """Doc ids with a positive score, best first."""
+        s = self.scores(query)
+        hits = np.nonzero(s)[0]
+        return hits[np.argsort(-s[hits], kind="stable")].tolist()
+
+
+def _bucket(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=4).digest(), "little") % _DIM
+
+
+class LocalEmbedder:
+    """TF-IDF over hashed word + character n-gram features; cosine similarity."""
+
+    def __init__(self, docs: Sequence[str]):
+        self._memo: Dict[str, List[int]] = {}
+        counts = np.stack([self._counts(d) for d in docs]) if docs else np.zeros((0, _DIM))
+        df = (counts > 0).sum(axis=0)
+        self.idf = np.log((1 + len(docs)) / (1 + df)) + 1.0
+        self.matrix = self._normalise(np.log1p(counts) * self.idf)
+
+    def _features(self, word: str) -> List[int]:
+        f = self._memo.get(word)
+        if f is None:
+            w = f"<{word}>"
+            grams = [w[i:i + n] for n in _NGRAMS for i in range(len(w) - n + 1)]
+            f = self._memo[word] = [_bucket("w:" + word)] + [_bucket(g) for g in grams]
+        return f
+
+    def _counts(self, text: str) -> np.ndarray:
+        idx = [b for word in tokenize(text) for b in self._features(word)]
+        return np.bincount(idx, minlength=_DIM).astype(np.float64)
+
+    @staticmethod
+    def _normalise(m: np.ndarray) -> np.ndarray:
+        norm = np.linalg.norm(m, axis=-1, keepdims=True)
+        return m / np.where(norm == 0, 1, norm)
+
+    def embed(self, text: str) -> np.ndarray:
+        return self._normalise(np.log1p(self._counts(text)) * self.idf)
+
+    def scores(self, query: str) -> np.ndarray:
+        return self.matrix @ self.embed(query)
+
+    def rank(self, query: str) -> List[int]:
+        s = self.scores(query)
+        return np.argsort(-s, kind="stable").tolist()
+
+
+def rrf_fuse(rankings: Sequence[Sequence[int]], k: int = RRF_K) -> List[int]:
+    """Reciprocal-rank fusion: Σ 1 / (k + rank) over the rankings, best first."""
+    score: Dict[int, float] = {}
+    for ranking in rankings:
+        for r, doc in enumerate(ranking):
+            score[doc] = score.get(doc, 0.0) + 1.0 / (k + r + 1)
+    return sorted(score, key=lambda d: -score[d])
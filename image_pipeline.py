@@ -0,0 +1,153 @@
+# image_pipeline.py
+"""Shrink drawing scans before they are sent to the vision model.
+
+The dataset pages are ~3300×2550 px colour JPEGs (~700 KB).  For dimension
+reading the model needs far less: this module trims the page frame / margins,
+blanks the title block, converts to grayscale, downsamples and re-encodes, then
+picks the vision `detail` level.  Results are cached on disk per
+(file sha256, settings), so each drawing is processed once.
+
+Usage:
+    from image_pipeline import prepare_image
+    img = prepare_image("dataset/3709N41_….jpg", preset="balanced")
+    call_llm_with_system(prompt, img, system_message=…)   # accepts PreparedImage
+"""
+from __future__ import annotations
+import base64, hashlib, io, json, logging, mimetypes, os
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Dict, Optional
+
+from cache_paths import cache_dir
+
+log = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# CONFIG
+# ---------------------------------------------------------------------------
+_CACHE_DIR = cache_dir("images")
+DEFAULT_PRESET = os.getenv("IMAGE_PRESET", "balanced")
+
+
+@dataclass(frozen=True)
+class ImageSettings:
+    max_side: Optional[int] = None    # px, longest side after cropping; None = keep
+    grayscale: bool = False
+    trim_margins: bool = False        # drop the page frame + blank border
+    blank_title_block: bool = False   # paint the bottom-right title block white
+    quality: int = 85                 # JPEG quality
+    detail: str = "auto"              # OpenAI vision detail: low | high | auto
+
+    @property
+    def passthrough(self) -> bool:
+        return self == ImageSettings()
+
+    def tag(self) -> str:
+        return hashlib.sha256(json.dumps(asdict(self), sort_keys=True).encode()).hexdigest()[:12]
+
+
+PRESETS: Dict[str, ImageSettings] = {
+    "original": ImageSettings(),                                   # bytes as on disk
+    "balanced": ImageSettings(1600, True, True, True, 75, "high"),
+    "compact":  ImageSettings(1024, True, True, True, 65, "high"),
+    "low":      ImageSettings(512,  True, True, True, 70, "low"),
+}
+
+# title block of the McMaster-Carr sheets, as fractions of the page (x0, y0, x1, y1)
+_TITLE_BLOCK = (0.54, 0.875, 0.985, 0.985)
+_FRAME_ZONE = 0.06                # look for the page frame within 6 % of each edge
+_FRAME_FILL = 0.6                 # a frame line covers > 60 % of its row / column
+_INK_THRESHOLD = 200              # grayscale value below which a pixel is "ink"
+
+
+@dataclass(frozen=True)
+class PreparedImage:
+    data_url: str
+    detail: str
+    nbytes: int                   # encoded image size (before base64)
+    source_sha256: str
+    preset: str
+
+
+def file_sha256(path: str | Path) -> str:
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+
+def _ink(im):
+    """Binary mask (255 = ink) of a page image."""
+    from PIL import ImageOps
+    return ImageOps.invert(im.convert("L")).point(lambda v: 255 if v > 255 - _INK_THRESHOLD else 0)
+
+
+def _frame_box(ink) -> tuple[int, int, int, int]:
+    """Box just inside the page frame: rows/cols near the edge that are mostly ink."""
+    from PIL import Image
+
+    w, h = ink.size
+    rows = ink.resize((1, h), Image.BOX).tobytes()      # mean ink per row
+    cols = ink.resize((w, 1), Image.BOX).tobytes()
+    full = _FRAME_FILL * 255
+    edge_y, edge_x = int(h * _FRAME_ZONE), int(w * _FRAME_ZONE)
+    top    = max((y + 1 for y in range(edge_y) if rows[y] > full), default=0)
+    bottom = min((y for y in range(h - edge_y, h) if rows[y] > full), default=h)
+    left   = max((x + 1 for x in range(edge_x) if cols[x] > full), default=0)
+    right  = min((x for x in range(w - edge_x, w) if cols[x] > full), default=w)
+    return left, top, right, bottom
+
+
+def _process(raw: bytes, s: ImageSettings) -> bytes:
+    from PIL import Image, ImageDraw
+
+    im = Image.open(io.BytesIO(raw))
+    im = im.convert("L") if s.grayscale else im.convert("RGB")
+    w, h = im.size
+    if s.blank_title_block:
+        x0, y0, x1, y1 = _TITLE_BLOCK
+        ImageDraw.Draw(im).rectangle((x0 * w, y0 * h, x1 * w, y1 * h), fill="white")
+    if s.trim_margins:
+        im = im.crop(_frame_box(_ink(im)))
+        bbox = _ink(im).getbbox()
+        if bbox:
+            pad = int(0.01 * max(im.size))
+            im = im.crop((max(bbox[0] - pad, 0), max(bbox[1] - pad, 0),
+                          min(bbox[2] + pad, im.width), min(bbox[3] + pad, im.height)))
+    if s.max_side and max(im.size) > s.max_side:
+        im.thumbnail((s.max_side, s.max_side), Image.LANCZOS)
+    out = io.BytesIO()
+    im.save(out, format="JPEG", quality=s.quality, optimize=True)
+    return out.getvalue()
+
+
+def prepare_image(path: str | Path, preset: str = DEFAULT_PRESET) -> PreparedImage:
+    """Encode a drawing for the vision model, reusing the on-disk cache when possible."""
+    settings = PRESETS[preset]
+    raw = Path(path).read_bytes()
+    sha = hashlib.sha256(raw).hexdigest()
+    mime = mimetypes.guess_type(str(path))[0] or "image/jpeg"
+
+    if not settings.passthrough:
+        cached = _CACHE_DIR / f"{sha}-{settings.tag()}.jpg"
+        if cached.exists():
+            raw, mime = cached.read_bytes(), "image/jpeg"
+        else:
+            try:
+                raw, mime = _process(raw, settings), "image/jpeg"
+                cached.parent.mkdir(parents=True, exist_ok=True)
+                cached.write_bytes(raw)
+            except ImportError:
+                log.warning("Pillow not installed – sending %s unprocessed.", path)
+
+    b64 = base64.b64encode(raw).decode()
+    return PreparedImage(f"data:{mime};base64,{b64}", settings.detail, len(raw), sha, preset)
+
+
+if __name__ == "__main__":
+    import argparse
+    cli = argparse.ArgumentParser(description="Preprocess drawings into the image cache")
+    cli.add_argument("paths", nargs="+")
+    cli.add_argument("--preset", default=DEFAULT_PRESET, choices=sorted(PRESETS))
+    a = cli.parse_args()
+    for p in a.paths:
+        img = prepare_image(p, a.preset)
+        print(f"{Path(p).name}: {Path(p).stat().st_size / 1024:.0f} KB → {img.nbytes / 1024:.0f} KB "
+              f"(detail={img.detail})")
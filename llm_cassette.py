@@ -0,0 +1,289 @@
+# llm_cassette.py
+"""Record / replay LLM backend: real exchanges on tape, deterministic offline runs.
+
+A cassette is a JSONL file, one line per exchange:
+    {"kind": "chat" | "stream" | "embed", "key", "model", "preview",
+     "latency_s", "response" | "chunks" + "t" | "embedding"}
+Chat keys are `response_cache.request_key` (model, messages with images by
+digest, params), so an image is never written to the tape; embeddings are
+stored per text, which keeps replays independent of the embedding cache.
+
+`RecordingTransport` wraps the live `llm_transport.Transport` and appends
+every answer (and its latency – for streams the arrival time of each chunk)
+to the cassette.  `ReplayTransport` answers from the cassette only; a request
+that is not on it raises `CassetteMiss`.  A request made several times (best-of-N,
+repeated runs) replays its recordings in turn.  Replay latency is
+    0            answer at once – measures the pipeline's own overhead
+    "recorded"   sleep as long as the API took when it was recorded
+    <seconds>    a fixed time per call (streams: before the first chunk)
+
+Both are selected with `LLM_BACKEND` (see `llm_transport.get_transport`):
+    LLM_BACKEND=record:cassettes/run.jsonl python main.py
+    LLM_BACKEND=replay:cassettes/run.jsonl LLM_REPLAY_LATENCY=recorded python eval.py
+
+Usage:
+    from llm_cassette import Cassette, ReplayTransport
+    llm_transport.set_transport(ReplayTransport(Cassette("cassettes/run.jsonl"), latency=0))
+
+    python llm_cassette.py stats cassettes/run.jsonl     # exchanges, models, recorded latency
+"""
+from __future__ import annotations
+import asyncio, hashlib, json, threading, time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Union
+
+# ---------------------------------------------------------------------------
+# CONFIG
+# ---------------------------------------------------------------------------
+_PREVIEW_CHARS = 80                # of the last user text, to tell exchanges apart
+
+Latency = Union[float, str]         # seconds, or "recorded"
+
+
+class CassetteMiss(LookupError):
+    """The replayed request was never recorded (prompt, params or model changed?)."""
+
+
+def _embed_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+def _chat_key(model: str, messages: List[Dict], params: Dict) -> str:
+    from response_cache import request_key
+    return request_key(model, messages, **params)
+
+
+def _preview(messages: List[Dict]) -> str:
+    for m in reversed(messages):
+        content = m.get("content")
+        if isinstance(content, list):
+            content = " ".join(p.get("text", "") for p in content if p.get("type") == "text")
+        if content:
+            return " ".join(content.split())[:_PREVIEW_CHARS]
+    return ""
+
+
+class Cassette:
+    """Exchanges of one JSONL file, by (kind, key); appends are thread-safe."""
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._tape: Dict[tuple, List[Dict]] = {}
+        self._next: Dict[tuple, int] = {}
+        if self.path.exists():
+            for ln in self.path.read_text(encoding="utf-8").splitlines():
+                if ln.strip():
+                    rec = json.loads(ln)
+                    self._tape.setdefault((rec["kind"], rec["key"]), []).append(rec)
+
+    def __len__(self) -> int:
+        return sum(len(v) for v in self._tape.values())
+
+    def append(self, rec: Dict) -> None:
+        line = json.dumps(rec, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._tape.setdefault((rec["kind"], rec["key"]), []).append(rec)
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as out:
+                out.write(line)
+
+    def play(self, kind: str, key: str, what: str = "") -> Dict:
+        """The next recording of a request; they repeat once all were played."""
+        with self._lock:
+            recs = self._tape.get((kind, key))
+            if not recs:
+                raise CassetteMiss(f"{kind} request not on {self.path.name}: {what!r}")
+            i = self._next.get((kind, key), 0)
+            self._next[(kind, key)] = i + 1
+            return recs[i % len(recs)]
+
+    def rewind(self) -> None:
+        with self._lock:
+            self._next.clear()
+
+    def records(self) -> List[Dict]:
+        return [r for recs in self._tape.values() for r in recs]
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Backends (same methods as llm_transport.Transport)
+# ─────────────────────────────────────────────────────────────────────────────
+class RecordingTransport:
+    """The live transport, with every answer also written to the cassette."""
+
+    def __init__(self, cassette: Cassette, inner=None):
+        if inner is None:
+            from llm_transport import Transport
+            inner = Transport()
+        self.cassette, self.inner = cassette, inner
+
+    @property
+    def client(self):
+        return self.inner.client
+
+    @property
+    def stats(self) -> Dict:
+        return self.inner.stats
+
+    def warm_up(self) -> None:
+        self.inner.warm_up()
+
+    def _chat_rec(self, kind: str, messages: List[Dict], model: str, params: Dict, t0: float) -> Dict:
+        return {"kind": kind, "key": _chat_key(model, messages, params), "model": model,
+                "preview": _preview(messages), "latency_s": round(time.perf_counter() - t0, 4)}
+
+    def chat(self, messages: List[Dict], model: str, deadline: Optional[float] = None, **params):
+        t0 = time.perf_counter()
+        resp = self.inner.chat(messages, model, deadline, **params)
+        rec = self._chat_rec("chat", messages, model, params, t0)
+        self.cassette.append({**rec, "response": resp.model_dump(mode="json")})
+        return resp
+
+    async def achat(self, messages: List[Dict], model: str, deadline: Optional[float] = None, **params):
+        t0 = time.perf_counter()
+        resp = await self.inner.achat(messages, model, deadline, **params)
+        rec = self._chat_rec("chat", messages, model, params, t0)
+        self.cassette.append({**rec, "response": resp.model_dump(mode="json")})
+        return resp
+
+    def chat_stream(self, messages: List[Dict], model: str, deadline: Optional[float] = None,
+                    **params) -> Iterator:
+        """Recorded as far as it was read: a replay closed at the same point matches."""
+        t0 = time.perf_counter()
+        chunks, offsets = [], []
+        stream = self.inner.chat_stream(messages, model, deadline, **params)
+        try:
+            for chunk in stream:
+                offsets.append(round(time.perf_counter() - t0, 4))
+                chunks.append(chunk.model_dump(mode="json"))
+                yield chunk
+        finally:
+            stream.close()
+            if chunks:
+                rec = self._chat_rec("stream", messages, model, params, t0)
+                self.cassette.append({**rec, "chunks": chunks, "t": offsets})
+
+    def _embed_recs(self, texts: List[str], model: str, vectors: List[List[float]], t0: float) -> None:
+        latency = round(time.perf_counter() - t0, 4)
+        for text, vec in zip(texts, vectors):
+            self.cassette.append({"kind": "embed", "key": _embed_key(model, text), "model": model,
+                                  "preview": text[:_PREVIEW_CHARS], "latency_s": latency, "embedding": vec})
+
+    def embed(self, texts: List[str], model: str, deadline: Optional[float] = None) -> List[List[float]]:
+        t0 = time.perf_counter()
+        vectors = self.inner.embed(texts, model, deadline)
+        self._embed_recs(texts, model, vectors, t0)
+        return vectors
+
+    async def aembed(self, texts: List[str], model: str, deadline: Optional[float] = None) -> List[List[float]]:
+        t0 = time.perf_counter()
+        vectors = await self.inner.aembed(texts, model, deadline)
+        self._embed_recs(texts, model, vectors, t0)
+        return vectors
+
+
+class ReplayTransport:
+    """Answers from the cassette only – no network, no API key."""
+
+    def __init__(self, cassette: Cassette, latency: Latency = 0.0):
+        if latency != "recorded":
+            latency = float(latency)
+        self.cassette, self.latency = cassette, latency
+        self.stats = {"calls": 0, "misses": 0}
+        self._stats_lock = threading.Lock()
+
+    @property
+    def client(self):
+        raise RuntimeError("the replay backend has no API client")
+
+    def warm_up(self) -> None:
+        from openai.types import CreateEmbeddingResponse            # noqa: F401 – import cost up front
+        from openai.types.chat import ChatCompletion, ChatCompletionChunk   # noqa: F401
+
+    def _delay(self, rec: Dict) -> float:
+        return rec.get("latency_s", 0.0) if self.latency == "recorded" else self.latency
+
+    def _play(self, kind: str, key: str, what: str) -> Dict:
+        try:
+            rec = self.cassette.play(kind, key, what)
+        except CassetteMiss:
+            with self._stats_lock:
+                self.stats["misses"] += 1
+            raise
+        with self._stats_lock:
+            self.stats["calls"] += 1
+        return rec
+
+    def _chat(self, messages: List[Dict], model: str, params: Dict):
+        from openai.types.chat import ChatCompletion
+        rec = self._play("chat", _chat_key(model, messages, params), _preview(messages))
+        return rec, ChatCompletion.model_validate(rec["response"])
+
+    def chat(self, messages: List[Dict], model: str, deadline: Optional[float] = None, **params):
+        rec, resp = self._chat(messages, model, params)
+        time.sleep(self._delay(rec))
+        return resp
+
+    async def achat(self, messages: List[Dict], model: str, deadline: Optional[float] = None, **params):
+        rec, resp = self._chat(messages, model, params)
+        await asyncio.sleep(self._delay(rec))
+        return resp
+
+    def chat_stream(self, messages: List[Dict], model: str, deadline: Optional[float] = None,
+                    **params) -> Iterator:
+        from openai.types.chat import ChatCompletionChunk
+        rec = self._play("stream", _chat_key(model, messages, params), _preview(messages))
+        chunks = [ChatCompletionChunk.model_validate(c) for c in rec["chunks"]]
+        if self.latency != "recorded":
+            time.sleep(self.latency)
+            yield from chunks
+            return
+        t0 = time.perf_counter()
+        for at, chunk in zip(rec["t"], chunks):
+            wait = at - (time.perf_counter() - t0)
+            if wait > 0:
+                time.sleep(wait)
+            yield chunk
+
+    def _embed(self, texts: List[str], model: str) -> tuple:
+        recs = [self._play("embed", _embed_key(model, t), t[:_PREVIEW_CHARS]) for t in texts]
+        return max((self._delay(r) for r in recs), default=0.0), [r["embedding"] for r in recs]
+
+    def embed(self, texts: List[str], model: str, deadline: Optional[float] = None) -> List[List[float]]:
+        delay, vectors = self._embed(texts, model)
+        time.sleep(delay)
+        return vectors
+
+    async def aembed(self, texts: List[str], model: str, deadline: Optional[float] = None) -> List[List[float]]:
+        delay, vectors = self._embed(texts, model)
+        await asyncio.sleep(delay)
+        return vectors
+
+
+def backend(spec: str, latency: Latency = 0.0):
+    """"live" → None (the plain transport), "record:<file>" / "replay:<file>" → a backend."""
+    mode, _, path = spec.partition(":")
+    if mode == "live" or not spec:
+        return None
+    if mode not in ("record", "replay") or not path:
+        raise ValueError(f"LLM backend must be live, record:<file> or replay:<file>, not {spec!r}")
+    cassette = Cassette(path)
+    return RecordingTransport(cassette) if mode == "record" else ReplayTransport(cassette, latency)
+
+
+if __name__ == "__main__":
+    import argparse, statistics
+    cli = argparse.ArgumentParser(description="Inspect LLM cassettes")
+    sub = cli.add_subparsers(dest="cmd", required=True)
+    s = sub.add_parser("stats", help="exchanges per kind and model, recorded latency")
+    s.add_argument("cassettes", nargs="+")
+    a = cli.parse_args()
+    for path in a.cassettes:
+        recs = Cassette(path).records()
+        print(f"{path}: {len(recs)} exchanges")
+        groups: Dict[tuple, List[float]] = {}
+        for r in recs:
+            groups.setdefault((r["kind"], r["model"]), []).append(r.get("latency_s", 0.0))
+        for (kind, model), lat in sorted(groups.items()):
+            print(f"  {kind:7s} {model:24s} {len(lat):5d}  p50 {statistics.median(lat) * 1000:7.0f} ms"
+                  f"  max {max(lat) * 1000:7.0f} ms")
@@ -1,40 +1,243 @@
 # llm_client.py
-import os
-from dotenv import load_dotenv
-from openai import OpenAI
+"""Thin wrapper around the OpenAI chat API.
 
-load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+An opt-in response cache (see `response_cache.py`) can be turned on with
+`LLM_CACHE=1` in the environment / .env, or `enable_cache()`.  Pass
+`use_cache=False` to any call that must hit the model (non-deterministic runs).
 
+`stream_llm_with_system()` / `stream_llm_text()` yield the answer as it is
+generated; closing the generator early stops the request.
 
-def call_llm(prompt: str, image_data_url: str, model: str = "gpt-4o") -> str:
+Every request goes through the shared `llm_transport.Transport`: pooled
+connections, requests / tokens-per-minute limits, retries with backoff and a
+deadline per call (`deadline=` seconds on any call, default `LLM_DEADLINE`).
+`LLM_BACKEND=record:<file>` / `replay:<file>` swaps it for a cassette
+recorder / player (`llm_cassette.py`), so runs can be repeated offline.
+
+Prompt / completion tokens of every API call are logged (INFO) and summed
+in `usage_totals()`; with tracing on (`tracing.py`) every call or cache hit
+is an `llm.chat` span with its tokens, request bytes and time to first token.
+"""
+from __future__ import annotations
+import json, logging, os, threading, time
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Union
+
+import tracing
+
+if TYPE_CHECKING:
+    from image_pipeline import PreparedImage
+
+Image = Union[str, "PreparedImage"]     # data URL, or a preprocessed drawing
+
+log = logging.getLogger(__name__)
+
+_cache = None                   # ResponseCache once enabled
+_cache_checked = False          # env var LLM_CACHE read?
+_usage = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+_usage_lock = threading.Lock()
+
+
+def get_client():
+    """The pooled OpenAI client of the shared transport, created on first use
+    (importing `openai` is slow).  It does not retry; the `call_*` functions do."""
+    from llm_transport import get_transport
+    return get_transport().client
+
+
+def warm_up() -> None:
+    """Open the transport's connection pool and the response cache up front."""
+    from llm_transport import get_transport
+    get_transport().warm_up()
+    get_cache()
+
+
+def __getattr__(name: str):
+    # backwards compatibility: `from llm_client import client`
+    if name == "client":
+        return get_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# ---------------------------------------------------------------------------
+# Response cache
+# ---------------------------------------------------------------------------
+
+def enable_cache(**kwargs):
+    """Turn the response cache on; kwargs go to `ResponseCache` (path, ttl, max_entries…)."""
+    global _cache, _cache_checked
+    from response_cache import ResponseCache
+    _cache, _cache_checked = ResponseCache(**kwargs), True
+    return _cache
+
+
+def disable_cache() -> None:
+    global _cache, _cache_checked
+    _cache, _cache_checked = None, True
+
+
+def get_cache():
+    """The active `ResponseCache`, or None if caching is off."""
+    global _cache_checked
+    if not _cache_checked:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _cache_checked = True
+        if os.getenv("LLM_CACHE", "").lower() in {"1", "true", "yes", "on"}:
+            enable_cache()
+    return _cache
+
+
+# ---------------------------------------------------------------------------
+# Token usage
+# ---------------------------------------------------------------------------
+
+def _record_usage(model: str, usage, span=None) -> None:
+    if usage is None:
+        return
+    p, c = usage.prompt_tokens or 0, usage.completion_tokens or 0
+    with _usage_lock:
+        _usage["calls"] += 1
+        _usage["prompt_tokens"] += p
+        _usage["completion_tokens"] += c
+    (span or tracing.current()).add(prompt_tokens=p, completion_tokens=c)
+    log.info("%s: %d prompt + %d completion tokens", model, p, c)
+
+
+def usage_totals() -> Dict[str, int]:
+    """Calls and tokens sent to the API by this process so far (cache hits are free)."""
+    with _usage_lock:
+        return dict(_usage)
+
+
+def _payload_bytes(messages: List[Dict]) -> int:
+    return len(json.dumps(messages, ensure_ascii=False).encode()) if tracing.enabled() else 0
+
+
+def _chat(messages: List[Dict], model: str, use_cache: bool = True,
+          cache_ttl: Optional[float] = None, deadline: Optional[float] = None, **params) -> str:
+    with tracing.span("llm.chat", model=model, stream=False) as sp:
+        cache = get_cache() if use_cache else None
+        if cache is not None:
+            from response_cache import request_key
+            key = request_key(model, messages, **params)
+            hit = cache.get(key)
+            if hit is not None:
+                sp.add(cache_hits=1)
+                return hit
+        sp.add(llm_calls=1, payload_bytes=_payload_bytes(messages))
+        from llm_transport import get_transport
+        resp = get_transport().chat(messages, model, deadline, **params)
+        _record_usage(model, getattr(resp, "usage", None))
+        text = resp.choices[0].message.content
+        if cache is not None and text is not None:
+            cache.put(key, text, ttl=cache_ttl)
+        return text
+
+
+def _chat_stream(messages: List[Dict], model: str, use_cache: bool = True,
+                 cache_ttl: Optional[float] = None, deadline: Optional[float] = None,
+                 **params) -> Iterator[str]:
+    """Like `_chat`, but yield the completion in pieces.  Only complete answers are cached."""
+    sp = tracing.start_span("llm.chat", model=model, stream=True)     # not current: we yield
+    try:
+        cache = get_cache() if use_cache else None
+        if cache is not None:
+            from response_cache import request_key
+            key = request_key(model, messages, **params)
+            hit = cache.get(key)
+            if hit is not None:
+                sp.add(cache_hits=1)
+                yield hit
+                return
+        sp.add(llm_calls=1, payload_bytes=_payload_bytes(messages))
+        t0 = time.perf_counter()
+        from llm_transport import get_transport
+        stream = get_transport().chat_stream(messages, model, deadline,
+                                             stream_options={"include_usage": True}, **params)
+        parts, finished = [], False
+        try:
+            for chunk in stream:
+                _record_usage(model, getattr(chunk, "usage", None), sp)     # last chunk only
+                if not chunk.choices:
+                    continue
+                piece = chunk.choices[0].delta.content
+                if piece:
+                    if not parts:
+                        sp.set(ttft_ms=round((time.perf_counter() - t0) * 1000, 1))
+                    parts.append(piece)
+                    yield piece
+                finished = finished or chunk.choices[0].finish_reason is not None
+        finally:
+            stream.close()                       # aborted early: drop the connection
+            sp.set(finished=finished)
+        if cache is not None and finished:
+            cache.put(key, "".join(parts), ttl=cache_ttl)
+    finally:
+        sp.end()
+
+
+def _image_url(image: Image) -> Dict:
+    if isinstance(image, str):
+        return {"url": image}
+    return {"url": image.data_url, "detail": image.detail}
+
+
+def _vision_messages(prompt: str, image: Image, system_message: str) -> List[Dict]:
+    return [
+        {"role": "system", "content": system_message},
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": prompt},
+                {"type": "image_url", "image_url": _image_url(image)},
+            ],
+        },
+    ]
+
+# ---------------------------------------------------------------------------
+# Public API
+# ---------------------------------------------------------------------------
+
+def call_llm(prompt: str, image_data_url: Image, model: str = "gpt-4o", use_cache: bool = True) -> str:
     messages = [
         {
             "role": "user",
             "content": [
                 {"type": "text", "text": prompt},
-                {"type": "image_url", "image_url": {"url": image_data_url}}
+                {"type": "image_url", "image_url": _image_url(image_data_url)}
             ]
         }
     ]
-    resp = client.chat.completions.create(model=model, messages=messages)
-    return resp.choices[0].message.content
+    return _chat(messages, model, use_cache)
 
 
-def call_llm_with_system(prompt: str, image_data_url: str, system_message: str, model: str = "gpt-4o") -> str:
+def call_llm_with_system(prompt: str, image_data_url: Image, system_message: str, model: str = "gpt-4o",
+                         use_cache: bool = True, **params) -> str:
     """
     Send a prompt + image + system message to the vision model.
+    `image_data_url` may also be an `image_pipeline.PreparedImage`; extra
+    `params` (temperature, …) go to the API and into the cache key.
     Keeps `call_llm()` unchanged for other uses.
     """
-    messages = [
-        {"role": "system", "content": system_message},
-        {
-            "role": "user",
-            "content": [
-                {"type": "text", "text": prompt},
-                {"type": "image_url", "image_url": {"url": image_data_url}},
-            ],
-        },
-    ]
-    resp = client.chat.completions.create(model=model, messages=messages)
-    return resp.choices[0].message.content
+    return _chat(_vision_messages(prompt, image_data_url, system_message), model, use_cache, **params)
+
+
+def stream_llm_with_system(prompt: str, image_data_url: Image, system_message: str, model: str = "gpt-4o",
+                           use_cache: bool = True, **params) -> Iterator[str]:
+    """Streaming `call_llm_with_system`: yields text pieces as the model writes them."""
+    return _chat_stream(_vision_messages(prompt, image_data_url, system_message), model, use_cache, **params)
+
+
+def call_llm_text(prompt: str, system_message: str | None = None, model: str = "gpt-4o",
+                  use_cache: bool = True, **params) -> str:
+    """Text-only variant (no image)."""
+    messages = [{"role": "system", "content": system_message}] if system_message else []
+    messages.append({"role": "user", "content": prompt})
+    return _chat(messages, model, use_cache, **params)
+
+
+def stream_llm_text(prompt: str, system_message: str | None = None, model: str = "gpt-4o",
+                    use_cache: bool = True, **params) -> Iterator[str]:
+    """Streaming `call_llm_text`."""
+    messages = [{"role": "system", "content": system_message}] if system_message else []
+    messages.append({"role": "user", "content": prompt})
+    return _chat_stream(messages, model, use_cache, **params)
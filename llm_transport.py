@@ -0,0 +1,437 @@
+# llm_transport.py
+"""Shared transport for every OpenAI call: pooling, rate limits, retries, deadlines.
+
+One `Transport` per process (`get_transport()`) owns
+• keep-alive connection pools (httpx) under a sync `OpenAI` and, per event
+  loop, an `AsyncOpenAI` client – the SDK's own retries are off;
+• two token buckets, requests / min and tokens / min, that every call
+  reserves from before it is sent.  A call's tokens are estimated from its
+  text (chars / 4, images as `_IMAGE_TOKENS`) plus `max_tokens`, and settled
+  against the real usage afterwards.  Limits come from `LLM_RPM` / `LLM_TPM`
+  or, when unset, from the `x-ratelimit-limit-*` headers of the answers, and
+  `x-ratelimit-remaining-*` keeps the buckets in step with the server; a 429
+  pauses the bucket for everybody for its Retry-After, so a burst of callers
+  does not turn into a 429 storm;
+• at most `LLM_MAX_IN_FLIGHT` concurrent requests;
+• retries of 429 / 408 / 409 / 5xx / connection errors / timeouts with
+  exponential backoff and full jitter (at least `Retry-After`);
+• a deadline per call (`deadline=` seconds, default `LLM_DEADLINE`): waits,
+  attempts and backoff all fit in it, else `DeadlineExceeded`.
+
+Used by `llm_client` (chat, streamed chat) and the embeddings of
+`retrieve_context`; `eval.py` and `batch_runner.py` go through `llm_client`.
+
+Usage:
+    from llm_transport import get_transport
+    t = get_transport()
+    resp = t.chat(messages, model="gpt-4o", temperature=0)           # ChatCompletion
+    for chunk in t.chat_stream(messages, model="gpt-4o"): ...
+    vectors = t.embed(["text", ...], model="text-embedding-ada-002")
+    resp = await t.achat(messages, model="gpt-4o", deadline=30)      # asyncio
+
+    LLM_BACKEND=replay:cassettes/run.jsonl python eval.py            # offline (llm_cassette)
+"""
+from __future__ import annotations
+import asyncio, logging, os, random, re, threading, time, weakref
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import tracing
+
+# ---------------------------------------------------------------------------
+# CONFIG
+# ---------------------------------------------------------------------------
+def _env(name: str, default: float) -> float:
+    return float(os.getenv(name) or default)
+
+
+RPM = _env("LLM_RPM", 0)                       # requests / min, 0 = from the API's headers
+TPM = _env("LLM_TPM", 0)                       # tokens / min, 0 = from the API's headers
+MAX_IN_FLIGHT = int(_env("LLM_MAX_IN_FLIGHT", 16))
+ATTEMPT_TIMEOUT = _env("LLM_TIMEOUT", 120)     # seconds per attempt
+DEADLINE = _env("LLM_DEADLINE", 300)           # seconds per call, retries included
+MAX_RETRIES = int(_env("LLM_MAX_RETRIES", 6))
+BACKOFF_BASE, BACKOFF_CAP = 0.5, 30.0          # seconds: base · 2^attempt, capped, full jitter
+POOL_CONNECTIONS = MAX_IN_FLIGHT + 4
+_IMAGE_TOKENS = 800                            # estimate per image part (high detail ≈ 765)
+_COMPLETION_TOKENS = 1000                      # estimate when the call sets no max_tokens
+
+_RETRY_STATUS = {408, 409, 429}
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNIT = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+log = logging.getLogger(__name__)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The call could not complete (or even start) within its deadline."""
+
+
+def _parse_duration(value: Optional[str]) -> Optional[float]:
+    """"6m0s" / "1.5s" / "20ms" / "2" → seconds."""
+    if not value:
+        return None
+    parts = _DURATION.findall(value)
+    if parts:
+        return sum(float(n) * _UNIT[u] for n, u in parts)
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Token bucket
+# ─────────────────────────────────────────────────────────────────────────────
+class TokenBucket:
+    """`rate` units per minute, bursts up to one minute's worth.
+
+    `reserve(n)` takes the units at once (the level may go negative) and
+    returns how long the caller must wait before using them, which serves
+    threads (`time.sleep`) and coroutines (`asyncio.sleep`) alike."""
+
+    def __init__(self, rate: float = 0.0):
+        self._lock = threading.Lock()
+        self.rate = rate                     # 0 = unlimited
+        self._level = rate
+        self._t = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        if self.rate:
+            self._level = min(self.rate, self._level + (now - self._t) * self.rate / 60)
+        self._t = now
+
+    def set_rate(self, rate: float) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if not self.rate:
+                self._level = rate
+            self.rate = rate
+
+    def reserve(self, n: float) -> float:
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._paused_until - now)
+            if not self.rate:
+                return wait
+            self._refill(now)
+            self._level -= min(n, self.rate)           # larger than a minute: wait a minute
+            if self._level < 0:
+                wait = max(wait, -self._level * 60 / self.rate)
+            return wait
+
+    def refund(self, n: float) -> None:
+        """Give back (n > 0) or take more (n < 0) after the real usage is known."""
+        with self._lock:
+            if self.rate:
+                self._level = min(self.rate, self._level + n)
+
+    def sync(self, remaining: float) -> None:
+        """Lower the level to what the server says is left (other processes share the limit)."""
+        with self._lock:
+            if self.rate:
+                self._refill(time.monotonic())
+                self._level = min(self._level, remaining)
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Transport
+# ─────────────────────────────────────────────────────────────────────────────
+def estimate_tokens(messages: List[Dict], max_tokens: Optional[int] = None) -> int:
+    """Rough request size for the tokens-per-minute bucket."""
+    chars, images = 0, 0
+    for m in messages:
+        content = m.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                chars += len(part.get("text", ""))
+            else:
+                images += 1
+    return chars // 4 + images * _IMAGE_TOKENS + (max_tokens or _COMPLETION_TOKENS)
+
+
+class Transport:
+    def __init__(self, rpm: float = RPM, tpm: float = TPM, max_in_flight: int = MAX_IN_FLIGHT,
+                 attempt_timeout: float = ATTEMPT_TIMEOUT, deadline: float = DEADLINE,
+                 max_retries: int = MAX_RETRIES, api_key: Optional[str] = None,
+                 base_url: Optional[str] = None):
+        self.requests, self.tokens = TokenBucket(rpm), TokenBucket(tpm)
+        self._fixed = (bool(rpm), bool(tpm))            # explicit limits are not overridden by headers
+        self.max_in_flight = max_in_flight
+        self.attempt_timeout, self.deadline, self.max_retries = attempt_timeout, deadline, max_retries
+        self._api_key, self._base_url = api_key, base_url
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._async: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Tuple[Any, asyncio.Semaphore]]" = \
+            weakref.WeakKeyDictionary()
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {"calls": 0, "attempts": 0, "retries": 0, "rate_limited": 0, "throttled_s": 0.0}
+
+    # -- clients ------------------------------------------------------------
+    def _kwargs(self) -> Dict:
+        from dotenv import load_dotenv
+        load_dotenv()
+        return {"api_key": self._api_key or os.getenv("OPENAI_API_KEY"),
+                "base_url": self._base_url or os.getenv("OPENAI_BASE_URL") or None,
+                "max_retries": 0, "timeout": self.attempt_timeout}
+
+    @property
+    def client(self):
+        """The pooled sync `OpenAI` client (no SDK retries – use the methods below)."""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    import httpx
+                    from openai import OpenAI
+                    limits = httpx.Limits(max_connections=POOL_CONNECTIONS,
+                                          max_keepalive_connections=POOL_CONNECTIONS, keepalive_expiry=60)
+                    self._client = OpenAI(http_client=httpx.Client(limits=limits, timeout=self.attempt_timeout),
+                                          **self._kwargs())
+        return self._client
+
+    def _async_client(self) -> Tuple[Any, asyncio.Semaphore]:
+        """`AsyncOpenAI` + in-flight semaphore of the running loop (pools are per loop)."""
+        loop = asyncio.get_running_loop()
+        pair = self._async.get(loop)
+        if pair is None:
+            import httpx
+            from openai import AsyncOpenAI
+            limits = httpx.Limits(max_connections=POOL_CONNECTIONS,
+                                  max_keepalive_connections=POOL_CONNECTIONS, keepalive_expiry=60)
+            client = AsyncOpenAI(http_client=httpx.AsyncClient(limits=limits, timeout=self.attempt_timeout),
+                                 **self._kwargs())
+            pair = self._async[loop] = (client, asyncio.Semaphore(self.max_in_flight))
+        return pair
+
+    def warm_up(self) -> None:
+        """Create the sync client now (importing `openai` is slow)."""
+        self.client
+
+    # -- policy -------------------------------------------------------------
+    def _reserve(self, tokens: int) -> float:
+        return max(self.requests.reserve(1), self.tokens.reserve(tokens))
+
+    def _learn(self, headers) -> None:
+        """Adopt the limits and remaining allowance the API reports; a used-up bucket
+        of unknown rate is paused until its reset."""
+        if headers is None:
+            return
+        for bucket, kind, fixed in ((self.requests, "requests", self._fixed[0]),
+                                    (self.tokens, "tokens", self._fixed[1])):
+            limit = headers.get(f"x-ratelimit-limit-{kind}")
+            if limit and not fixed:
+                try:
+                    if float(limit) != bucket.rate:
+                        bucket.set_rate(float(limit))
+                except ValueError:
+                    pass
+            remaining = _parse_duration(headers.get(f"x-ratelimit-remaining-{kind}"))
+            if remaining is None:
+                continue
+            if bucket.rate:
+                bucket.sync(remaining)
+            elif remaining == 0:
+                reset = _parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                if reset:
+                    bucket.pause(reset)
+
+    def _retry_delay(self, exc: Exception, attempt: int) -> Optional[float]:
+        """Backoff before the next attempt, or None if `exc` is not worth retrying."""
+        import openai
+        status = getattr(exc, "status_code", None)
+        if isinstance(exc, (openai.APITimeoutError, openai.APIConnectionError)):
+            after = None
+        elif isinstance(exc, openai.APIStatusError) and (status in _RETRY_STATUS or status >= 500):
+            headers = exc.response.headers
+            self._learn(headers)
+            ms = _parse_duration(headers.get("retry-after-ms"))
+            after = ms / 1000 if ms is not None else _parse_duration(headers.get("retry-after"))
+            if status == 429:
+                self._count(rate_limited=1)
+                if after:                                  # everybody waits, not just this caller
+                    self.requests.pause(after)
+        else:
+            return None
+        if attempt >= self.max_retries:
+            return None
+        backoff = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+        return max(backoff, after or 0.0)
+
+    def _count(self, **kv) -> None:
+        with self._stats_lock:
+            for k, v in kv.items():
+                self.stats[k] += v
+
+    # -- sync ---------------------------------------------------------------
+    def _call(self, create: Callable, tokens: int, deadline: Optional[float], hold: bool = False):
+        """Run `create(timeout)` → raw response under the limits, with retries.
+        With `hold` the connection slot stays taken; the caller releases it."""
+        end = time.monotonic() + (deadline or self.deadline)
+        self._count(calls=1)
+        attempt = 0
+        while True:
+            wait = self._reserve(tokens)
+            if time.monotonic() + wait >= end:
+                self.requests.refund(1)
+                self.tokens.refund(tokens)
+                raise DeadlineExceeded(f"rate limit wait {wait:.1f}s exceeds the deadline")
+            if wait:
+                self._count(throttled_s=wait)
+                time.sleep(wait)
+            if not self._slots.acquire(timeout=max(0.0, end - time.monotonic())):
+                raise DeadlineExceeded("no free connection slot before the deadline")
+            try:
+                self._count(attempts=1)
+                raw = create(min(self.attempt_timeout, max(0.1, end - time.monotonic())))
+            except Exception as exc:
+                self._slots.release()
+                delay = self._retry_delay(exc, attempt)
+                if delay is None:
+                    raise
+                if time.monotonic() + delay >= end:
+                    raise DeadlineExceeded(f"gave up after {attempt + 1} attempt(s): {exc}") from exc
+                log.info("retry %d in %.2fs after %s", attempt + 1, delay, type(exc).__name__)
+                self._count(retries=1)
+                tracing.add(retries=1)
+                attempt += 1
+                time.sleep(delay)
+                continue
+            if not hold:
+                self._slots.release()
+            self._learn(raw.headers)
+            return raw
+
+    def _settle(self, estimate: int, usage) -> None:
+        if usage is not None:
+            self.tokens.refund(estimate - (usage.total_tokens or 0))
+
+    def chat(self, messages: List[Dict], model: str, deadline: Optional[float] = None, **params):
+        """`chat.completions.create` (non-streaming) under the limits; returns the ChatCompletion."""
+        est = estimate_tokens(messages, params.get("max_tokens"))
+        raw = self._call(lambda t: self.client.chat.completions.with_raw_response.create(
+            model=model, messages=messages, timeout=t, **params), est, deadline)
+        resp = raw.parse()
+        self._settle(est, getattr(resp, "usage", None))
+        return resp
+
+    def chat_stream(self, messages: List[Dict], model: str, deadline: Optional[float] = None,
+                    **params) -> Iterator:
+        """Streamed chat: yields the SDK's chunks.  Only opening the stream is retried;
+        the connection slot is held until the stream ends or is closed."""
+        est = estimate_tokens(messages, params.get("max_tokens"))
+        raw = self._call(lambda t: self.client.chat.completions.with_raw_response.create(
+            model=model, messages=messages, stream=True, timeout=t, **params), est, deadline, hold=True)
+        try:
+            stream = raw.parse()
+            try:
+                for chunk in stream:
+                    self._settle(est, getattr(chunk, "usage", None))
+                    yield chunk
+            finally:
+                stream.close()
+        finally:
+            self._slots.release()
+
+    def embed(self, texts: List[str], model: str, deadline: Optional[float] = None) -> List[List[float]]:
+        est = sum(len(t) for t in texts) // 4 + 1
+        raw = self._call(lambda t: self.client.embeddings.with_raw_response.create(
+            model=model, input=texts, timeout=t), est, deadline)
+        resp = raw.parse()
+        self._settle(est, getattr(resp, "usage", None))
+        return [d.embedding for d in sorted(resp.data, key=lambda d: d.index)]
+
+    # -- async --------------------------------------------------------------
+    async def _acall(self, create: Callable, tokens: int, deadline: Optional[float]):
+        end = time.monotonic() + (deadline or self.deadline)
+        self._count(calls=1)
+        _, slots = self._async_client()
+        attempt = 0
+        while True:
+            wait = self._reserve(tokens)
+            if time.monotonic() + wait >= end:
+                self.requests.refund(1)
+                self.tokens.refund(tokens)
+                raise DeadlineExceeded(f"rate limit wait {wait:.1f}s exceeds the deadline")
+            if wait:
+                self._count(throttled_s=wait)
+                await asyncio.sleep(wait)
+            try:
+                await asyncio.wait_for(slots.acquire(), max(0.0, end - time.monotonic()))
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded("no free connection slot before the deadline") from None
+            error = None
+            try:
+                self._count(attempts=1)
+                raw = await create(min(self.attempt_timeout, max(0.1, end - time.monotonic())))
+            except Exception as exc:
+                error = exc
+            finally:
+                slots.release()                      # not held through the backoff below
+            if error is None:
+                self._learn(raw.headers)
+                return raw
+            delay = self._retry_delay(error, attempt)
+            if delay is None:
+                raise error
+            if time.monotonic() + delay >= end:
+                raise DeadlineExceeded(f"gave up after {attempt + 1} attempt(s): {error}") from error
+            log.info("retry %d in %.2fs after %s", attempt + 1, delay, type(error).__name__)
+            self._count(retries=1)
+            tracing.add(retries=1)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def achat(self, messages: List[Dict], model: str, deadline: Optional[float] = None, **params):
+        client, _ = self._async_client()
+        est = estimate_tokens(messages, params.get("max_tokens"))
+        raw = await self._acall(lambda t: client.chat.completions.with_raw_response.create(
+            model=model, messages=messages, timeout=t, **params), est, deadline)
+        resp = raw.parse()
+        self._settle(est, getattr(resp, "usage", None))
+        return resp
+
+    async def aembed(self, texts: List[str], model: str, deadline: Optional[float] = None) -> List[List[float]]:
+        client, _ = self._async_client()
+        est = sum(len(t) for t in texts) // 4 + 1
+        raw = await self._acall(lambda t: client.embeddings.with_raw_response.create(
+            model=model, input=texts, timeout=t), est, deadline)
+        resp = raw.parse()
+        self._settle(est, getattr(resp, "usage", None))
+        return [d.embedding for d in sorted(resp.data, key=lambda d: d.index)]
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """The process-wide backend, created on first use from the environment:
+    `LLM_BACKEND` = live (default) | record:<cassette> | replay:<cassette>,
+    `LLM_REPLAY_LATENCY` = 0 | recorded | <seconds> (see `llm_cassette`)."""
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                spec = os.getenv("LLM_BACKEND", "live")
+                if spec == "live":
+                    _transport = Transport()
+                else:
+                    from llm_cassette import backend
+                    _transport = backend(spec, os.getenv("LLM_REPLAY_LATENCY", "0"))
+    return _transport
+
+
+def set_transport(transport) -> Optional[Transport]:
+    """Plug in another backend (a `Transport`, `llm_cassette.ReplayTransport`, …);
+    None goes back to the environment's.  Returns the previous one."""
+    global _transport
+    with _transport_lock:
+        previous, _transport = _transport, transport
+    return previous
@@ -0,0 +1,251 @@
+# machine_registry.py
+"""Validated, read-only machine specs, loaded once per file version.
+
+`load_machine()` returns a `MachineSpec` for a path, a file stem in
+`machines/` or a machine name.  Specs are cached by path and re-read only
+when the file's mtime / size change, so batch jobs and long-running services
+share one immutable object per machine.
+
+A `MachineSpec` is a read-only mapping over the JSON (`spec.get("max_feed_rate")`
+works as on the plain dict), with typed attributes for the limits and a
+`ToolLibrary` indexed by id, type and diameter.  `spec.prompt_block(tools)`
+memoizes the markdown machine block of `prompt_utils`.
+
+Usage:
+    from machine_registry import load_machine
+    m = load_machine("machines/haas_umc_1000.json")      # or "haas_umc_1000"
+    m.max_spindle_rpm, m.tools.get(12).dia, m.tools.of_type("drill")
+    m.tools.with_diameter(8, 12)
+
+    python machine_registry.py            # validate and list every machine
+"""
+from __future__ import annotations
+import bisect, json, logging, math, threading
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from types import MappingProxyType
+from typing import Dict, Iterator, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# CONFIG
+# ---------------------------------------------------------------------------
+_MACHINE_DIR = Path("machines")
+_REQUIRED = ("name", "max_spindle_rpm", "max_feed_rate", "tool_library")
+_NON_NEGATIVE = ("spindle_power", "spindle_torque", "max_thrust_force", "max_X_axis_stroke",
+                 "max_Y_axis_stroke", "max_Z_axis_stroke", "max_workpiece_diameter",
+                 "max_workpiece_height", "max_workpiece_weight", "tool_storage_capacity")
+
+
+class MachineSpecError(ValueError):
+    """A machine file is missing required fields or has invalid values."""
+
+
+def _number(v) -> bool:
+    return isinstance(v, (int, float)) and not isinstance(v, bool) and math.isfinite(v)
+
+
+def _frozen(v):
+    if isinstance(v, dict):
+        return MappingProxyType({k: _frozen(x) for k, x in v.items()})
+    if isinstance(v, list):
+        return tuple(_frozen(x) for x in v)
+    return v
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Model
+# ─────────────────────────────────────────────────────────────────────────────
+@dataclass(frozen=True, slots=True, eq=False)
+class Tool(Mapping):
+    """One tool; reads like its JSON object (`tool.get("loc")`) and has typed fields."""
+    id: int
+    type: str
+    dia: float
+    flutes: int
+    loc_mm: float              # LOC resolved to mm ("3xD" → 3·dia), inf if unknown
+    raw: Mapping
+
+    def __getitem__(self, key):
+        return self.raw[key]
+
+    def __iter__(self) -> Iterator:
+        return iter(self.raw)
+
+    def __len__(self) -> int:
+        return len(self.raw)
+
+
+class ToolLibrary(tuple):
+    """The tools in file order, indexed by id, type and diameter."""
+
+    def __new__(cls, tools: List[Tool]):
+        lib = super().__new__(cls, tools)
+        lib.by_id = MappingProxyType({t.id: t for t in tools})
+        types: Dict[str, List[Tool]] = {}
+        for t in tools:
+            types.setdefault(t.type, []).append(t)
+        lib.by_type = MappingProxyType({k: tuple(v) for k, v in types.items()})
+        by_dia = sorted(tools, key=lambda t: t.dia)
+        lib._dias, lib._by_dia = [t.dia for t in by_dia], tuple(by_dia)
+        return lib
+
+    def get(self, tool_id, default=None) -> Optional[Tool]:
+        return self.by_id.get(tool_id, default)
+
+    def of_type(self, kind: str) -> Tuple[Tool, ...]:
+        return self.by_type.get(kind, ())
+
+    def with_diameter(self, lo: float, hi: float = math.inf) -> Tuple[Tool, ...]:
+        """Tools with lo ≤ dia ≤ hi, smallest first."""
+        return self._by_dia[bisect.bisect_left(self._dias, lo):bisect.bisect_right(self._dias, hi)]
+
+
+@dataclass(frozen=True, slots=True, eq=False)
+class MachineSpec(Mapping):
+    """A machine file; reads like the JSON dict, `tool_library` is a `ToolLibrary`."""
+    path: str
+    name: str
+    axes: int
+    max_spindle_rpm: float
+    max_feed_rate: float
+    spindle_power: Optional[float]
+    spindle_torque: Optional[float]
+    tools: ToolLibrary
+    raw: Mapping
+    _blocks: Dict = field(default_factory=dict, repr=False)    # tool ids -> prompt block
+
+    def __getitem__(self, key):
+        return self.tools if key == "tool_library" else self.raw[key]
+
+    def __iter__(self) -> Iterator:
+        return iter(self.raw)
+
+    def __len__(self) -> int:
+        return len(self.raw)
+
+    def prompt_block(self, tools: Optional[List] = None) -> str:
+        """Memoized `prompt_utils.build_machine_block` (all tools, or just `tools`)."""
+        key = None if tools is None else tuple(t.get("id") for t in tools)
+        block = self._blocks.get(key)
+        if block is None:
+            from prompt_utils import render_machine_block
+            block = self._blocks[key] = render_machine_block(self, tools)
+        return block
+
+    def to_dict(self) -> Dict:
+        return json.loads(json.dumps(self.raw, default=dict))
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Loading / validation
+# ─────────────────────────────────────────────────────────────────────────────
+def _tool(t, i: int, errors: List[str]) -> Optional[Tool]:
+    from affordance_validator import _loc_to_mm
+    if not isinstance(t, dict):
+        errors.append(f"tool #{i}: not an object")
+        return None
+    tid, dia, z = t.get("id"), t.get("dia"), t.get("flutes", 1)
+    bad = [k for k, ok in (("id", isinstance(tid, int) and not isinstance(tid, bool)),
+                           ("dia", _number(dia) and dia > 0),
+                           ("flutes", isinstance(z, int) and z >= 1)) if not ok]
+    if bad:
+        errors.append(f"tool #{i} (id {tid!r}): invalid {', '.join(bad)}")
+        return None
+    return Tool(tid, str(t.get("type", "")), float(dia), z,
+                _loc_to_mm(t.get("loc", math.inf), dia), _frozen(t))
+
+
+def parse_machine(data: Dict, path: str = "<dict>") -> MachineSpec:
+    """Validate a machine dict; raises `MachineSpecError` listing every problem."""
+    errors = [f"missing {k!r}" for k in _REQUIRED if k not in data]
+    for k in ("max_spindle_rpm", "max_feed_rate"):
+        if k in data and not (_number(data[k]) and data[k] > 0):
+            errors.append(f"{k} must be a positive number")
+    for k in _NON_NEGATIVE:
+        if k in data and not (_number(data[k]) and data[k] >= 0):
+            errors.append(f"{k} must be a non-negative number")
+    tools: List[Tool] = []
+    lib = data.get("tool_library", [])
+    if not isinstance(lib, list):
+        errors.append("tool_library must be a list")
+        lib = []
+    for i, t in enumerate(lib):
+        tool = _tool(t, i, errors)
+        if tool is not None:
+            if any(x.id == tool.id for x in tools):
+                errors.append(f"duplicate tool id {tool.id}")
+            tools.append(tool)
+    if errors:
+        raise MachineSpecError(f"{path}: " + "; ".join(errors))
+    return MachineSpec(path, str(data["name"]), int(data.get("axes", 3) or 3),
+                       float(data["max_spindle_rpm"]), float(data["max_feed_rate"]),
+                       data.get("spindle_power"), data.get("spindle_torque"),
+                       ToolLibrary(tools), _frozen(data))
+
+
+class MachineRegistry:
+    """path -> MachineSpec, re-read when a file's mtime or size changes."""
+
+    def __init__(self, folder: Path | str = _MACHINE_DIR):
+        self.folder = Path(folder)
+        self._lock = threading.Lock()
+        self._specs: Dict[Path, Tuple[int, int, MachineSpec]] = {}
+
+    def _resolve(self, ref: str | Path) -> Path:
+        p = Path(ref)
+        if p.is_file():
+            return p.resolve()
+        q = self.folder / (p.name if p.suffix == ".json" else f"{p.name}.json")
+        if q.is_file():
+            return q.resolve()
+        for spec in self.all():                       # a machine name
+            if spec.name.lower() == str(ref).lower():
+                return Path(spec.path)
+        raise FileNotFoundError(f"No machine {ref!r} (looked in {self.folder}/)")
+
+    def get(self, ref: str | Path) -> MachineSpec:
+        path = self._resolve(ref)
+        st = path.stat()
+        with self._lock:
+            hit = self._specs.get(path)
+            if hit and hit[:2] == (st.st_mtime_ns, st.st_size):
+                return hit[2]
+        spec = parse_machine(json.loads(path.read_text(encoding="utf-8")), path.as_posix())
+        with self._lock:
+            self._specs[path] = (st.st_mtime_ns, st.st_size, spec)
+        if hit:
+            log.info("Reloaded %s", path)
+        return spec
+
+    def all(self) -> List[MachineSpec]:
+        return [self.get(p) for p in sorted(self.folder.glob("*.json"))]
+
+
+@lru_cache(maxsize=1)
+def get_registry() -> MachineRegistry:
+    return MachineRegistry()
+
+
+def load_machine(ref: str | Path) -> MachineSpec:
+    return get_registry().get(ref)
+
+
+if __name__ == "__main__":
+    import argparse, sys
+    cli = argparse.ArgumentParser(description="Validate and list machine specs")
+    cli.add_argument("folder", nargs="?", default=_MACHINE_DIR.as_posix())
+    a = cli.parse_args()
+    failed = 0
+    for p in sorted(Path(a.folder).glob("*.json")):
+        try:
+            m = MachineRegistry(a.folder).get(p)
+        except (MachineSpecError, ValueError) as exc:
+            print(f"✗ {exc}")
+            failed += 1
+            continue
+        kinds = ", ".join(f"{len(v)} {k}" for k, v in m.tools.by_type.items())
+        print(f"✓ {p.name:32s} {m.name:28s} {m.axes} axes  {m.max_spindle_rpm:.0f} rpm  "
+              f"{m.max_feed_rate:.0f} mm/min  tools: {kinds}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,199 @@
+# mechanics.py
+"""Cutting mechanics of plan steps with the formulary equations (NumPy).
+
+For every step – one value or whole arrays at once – computes
+    h      mean chip thickness [mm]
+    kc     cutting pressure k_c = k_c0,4 · (0.4 / h)^x [N/mm²]
+    Fc     cutting force [N]        (drilling: per lip)
+    Ff     feed / thrust force [N]  (drilling only, else 0)
+    Pc     cutting power [kW]
+    Tc     spindle torque [Nm]
+    MRR    material removal rate [mm³/min]
+from CAM.txt:
+    milling   h_av = f_z·√(a_e/D)                               (a_e/D ≤ 0.1)
+              h_av = f_z·a_e·sin(k_re)·180 / (π·D·asin°(a_e/D))  (a_e/D > 0.1)
+              MRR = a_e·a_p·v_f,  P_c = k_c·MRR,  T_c = P_c / ω,  F_c = 2·T_c / D
+    drilling  h = f_n/2·sin(k_re),  A_D = f_n·D/4,  F_c = k_c·A_D,  T_c = F_c·D/2,
+              F_f = 0.5·k_c·D/2·f_n·sin(k_re),  MRR = π·D²·v_f / 4
+k_c0,4 and x are the middle of the formulary range for the ISO class.
+Machining time is t = l / v_f for a path length, or V / MRR for a volume.
+
+`step_mechanics` is the per-step path (plain `math`, as `validate_step`);
+`compute` is the same model on NumPy arrays, used by `bulk_validator`.
+
+Usage:
+    from mechanics import step_mechanics, compute
+    m = step_mechanics(step, tool, "N")          # {"h", "kc", "Fc", "Ff", "Pc", "Tc", "MRR"}
+    m = compute(D, z, n, vf, ap, ae, drilling, kc0_4, x)    # arrays in, arrays out
+
+    python mechanics.py plan.txt machines/haas_umc_1000.json steel [--length 200]
+"""
+from __future__ import annotations
+import math
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+import parse_cam_formulary as cam
+
+if TYPE_CHECKING:                 # NumPy is imported by `compute`, not by the validator
+    import numpy as np
+
+# ---------------------------------------------------------------------------
+# CONFIG
+# ---------------------------------------------------------------------------
+MILL_KRE_DEG = 90.0               # entering angle of square end mills
+DRILL_KRE_DEG = 59.0              # half of a 118° twist-drill point
+_H_REF = 0.4                      # chip thickness of k_c0,4 [mm]
+
+
+@dataclass
+class Mechanics:
+    h: np.ndarray
+    kc: np.ndarray
+    Fc: np.ndarray
+    Ff: np.ndarray
+    Pc: np.ndarray
+    Tc: np.ndarray
+    MRR: np.ndarray
+
+    def row(self, i: int = 0) -> Dict[str, float]:
+        import numpy as np
+        return {k: float(np.atleast_1d(getattr(self, k))[i]) for k in ("h", "kc", "Fc", "Ff", "Pc", "Tc", "MRR")}
+
+
+def material_constants(iso: str, formulary: cam.Formulary | None = None) -> tuple:
+    """(k_c0,4, x) – middle of the formulary ranges."""
+    lim = cam.get_limits_for(iso, formulary)
+    return sum(lim["kc0_4"]) / 2, sum(lim["x"]) / 2
+
+
+def compute(D, z, n, vf, ap, ae, drilling, kc0_4, x) -> Mechanics:
+    """Vectorised mechanics; every argument is a scalar or an array of one value per step."""
+    import numpy as np
+    D, z, n, vf, ap, ae, kc0_4, x = (np.asarray(v, dtype=np.float64) for v in (D, z, n, vf, ap, ae, kc0_4, x))
+    drilling = np.asarray(drilling, dtype=bool)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ok = (D > 0) & (n > 0) & (vf > 0)
+        n_ = np.where(ok, n, 1.0)
+        D_ = np.where(D > 0, D, 1.0)
+        omega = 2 * math.pi * n_ / 60                              # rad/s
+
+        # milling
+        fz = vf / (n_ * np.where(z > 0, z, 1))
+        r = np.clip(ae / D_, 0.0, 1.0)
+        sin_m = math.sin(math.radians(MILL_KRE_DEG))
+        h_thin = fz * np.sqrt(r)
+        h_wide = fz * r * sin_m * 180 / (math.pi * np.degrees(np.arcsin(np.where(r > 0, r, 1))))
+        h_mill = np.where(r <= 0.1, h_thin, h_wide)
+        mrr_mill = r * D * ap * vf
+
+        # drilling
+        fn = vf / n_
+        sin_d = math.sin(math.radians(DRILL_KRE_DEG))
+        h_drill = fn / 2 * sin_d
+
+        h = np.where(ok, np.where(drilling, h_drill, h_mill), 0.0)
+        kc = np.where(h > 0, kc0_4 * (_H_REF / np.where(h > 0, h, 1)) ** x, 0.0)
+
+        Fc_drill = kc * fn * D / 4                                  # per lip
+        Tc_drill = Fc_drill * D / 2 / 1000
+        Pc_mill = kc * mrr_mill / 60e6                              # N/mm² · mm³/min → kW
+        Tc_mill = Pc_mill * 1000 / omega
+
+        Tc = np.where(ok, np.where(drilling, Tc_drill, Tc_mill), 0.0)
+        Pc = np.where(ok, np.where(drilling, Tc_drill * omega / 1000, Pc_mill), 0.0)
+        Fc = np.where(ok, np.where(drilling, Fc_drill, 2000 * Tc_mill / D_), 0.0)
+        Ff = np.where(ok & drilling, 0.5 * kc * D / 2 * fn * sin_d, 0.0)
+        MRR = np.where(ok, np.where(drilling, math.pi * D ** 2 * vf / 4, mrr_mill), 0.0)
+    return Mechanics(h, kc, Fc, Ff, Pc, Tc, MRR)
+
+
+_ZERO = {"h": 0.0, "kc": 0.0, "Fc": 0.0, "Ff": 0.0, "Pc": 0.0, "Tc": 0.0, "MRR": 0.0}
+
+
+def step_mechanics(step: Dict, tool: Dict, iso: str,
+                   formulary: cam.Formulary | None = None) -> Dict[str, float]:
+    """Mechanics of one parsed plan step with its tool-library entry (as `compute`)."""
+    kc0_4, x = material_constants(iso, formulary)
+    D = float(tool.get("dia", step.get("tool_dia", 0)) or 0)
+    z = float(tool.get("flutes", 1) or 0)
+    n, vf = float(step.get("n", 0)), float(step.get("vf", 0))
+    ap, ae = float(step.get("ap", 0)), float(step.get("ae", 0))
+    if not (D > 0 and n > 0 and vf > 0):
+        return dict(_ZERO)
+    omega = 2 * math.pi * n / 60
+    if step["strategy"] == "drilling":
+        fn = vf / n
+        sin_d = math.sin(math.radians(DRILL_KRE_DEG))
+        h = fn / 2 * sin_d
+        kc = kc0_4 * (_H_REF / h) ** x if h > 0 else 0.0
+        Fc = kc * fn * D / 4
+        Tc = Fc * D / 2 / 1000
+        return {"h": h, "kc": kc, "Fc": Fc, "Ff": 0.5 * kc * D / 2 * fn * sin_d,
+                "Pc": Tc * omega / 1000, "Tc": Tc, "MRR": math.pi * D ** 2 * vf / 4}
+    fz = vf / (n * (z if z > 0 else 1))
+    r = min(max(ae / D, 0.0), 1.0)
+    if r <= 0.1:
+        h = fz * math.sqrt(r)
+    else:
+        h = fz * r * math.sin(math.radians(MILL_KRE_DEG)) * 180 / (math.pi * math.degrees(math.asin(r)))
+    kc = kc0_4 * (_H_REF / h) ** x if h > 0 else 0.0
+    mrr = r * D * ap * vf
+    Pc = kc * mrr / 60e6
+    Tc = Pc * 1000 / omega
+    return {"h": h, "kc": kc, "Fc": 2000 * Tc / D, "Ff": 0.0, "Pc": Pc, "Tc": Tc, "MRR": mrr}
+
+
+def machine_limits(machine: Dict) -> Dict[str, float]:
+    """Spindle power [kW], torque [Nm] and thrust [N] limits; inf when not given."""
+    get = lambda k: float(machine.get(k) or math.inf)
+    return {"power": get("spindle_power"), "torque": get("spindle_torque"), "thrust": get("max_thrust_force")}
+
+
+def limit_issues(mech: Dict[str, float], limits: Dict[str, float]) -> List[str]:
+    """Power / torque / thrust issues, worded as in the validator report."""
+    out = []
+    if mech["Pc"] > limits["power"]:
+        out.append(f"P_c {mech['Pc']:.1f} kW > spindle {limits['power']:.1f} kW")
+    if mech["Tc"] > limits["torque"]:
+        out.append(f"T_c {mech['Tc']:.0f} Nm > spindle {limits['torque']:.0f} Nm")
+    if mech["Ff"] > limits["thrust"]:
+        out.append(f"F_f {mech['Ff']:.0f} N > thrust limit {limits['thrust']:.0f} N")
+    return out
+
+
+def machining_time(vf: float, length: Optional[float] = None, volume: Optional[float] = None,
+                   mrr: Optional[float] = None) -> float:
+    """Minutes for a path `length` [mm] at vf, or to remove `volume` [mm³] at `mrr`."""
+    if length is not None:
+        return length / vf if vf else math.inf
+    if volume is not None and mrr:
+        return volume / mrr
+    return math.nan
+
+
+if __name__ == "__main__":
+    import argparse
+    from pathlib import Path
+    import affordance_validator as av
+    from machine_registry import load_machine
+
+    cli = argparse.ArgumentParser(description="Cutting force, power, torque and time per plan step")
+    cli.add_argument("plan")
+    cli.add_argument("machine")
+    cli.add_argument("material")
+    cli.add_argument("--length", type=float, default=100.0, help="toolpath length per step [mm]")
+    a = cli.parse_args()
+    machine = load_machine(a.machine)
+    iso, lim = cam.infer_material_tag(a.material), machine_limits(machine)
+    total = 0.0
+    print(f"{'step':32s} {'h mm':>6s} {'kc':>6s} {'Fc N':>7s} {'Ff N':>6s} {'Pc kW':>6s} "
+          f"{'Tc Nm':>6s} {'MRR cm³/min':>11s} {'t min':>6s}")
+    for st in av.parse_txt_plan(Path(a.plan).read_text(encoding="utf-8")):
+        m = step_mechanics(st, av._find_tool(st.get("tool_id"), machine.get("tool_library", [])), iso)
+        t = machining_time(st.get("vf", 0), a.length)
+        total += t
+        flags = "  ⚠️ " + "; ".join(limit_issues(m, lim)) if limit_issues(m, lim) else ""
+        print(f"{st['step'][:32]:32s} {m['h']:6.3f} {m['kc']:6.0f} {m['Fc']:7.0f} {m['Ff']:6.0f} "
+              f"{m['Pc']:6.2f} {m['Tc']:6.1f} {m['MRR'] / 1000:11.1f} {t:6.2f}{flags}")
+    print(f"{'total':32s} {'':>58s} {total:6.2f}  ({a.length:.0f} mm per step)")
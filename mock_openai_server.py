@@ -0,0 +1,212 @@
+# mock_openai_server.py
+"""Local stand-in for the OpenAI API, for offline / load testing.
+
+Serves `/v1/chat/completions` and `/v1/embeddings` with canned but well-formed
+answers:
+• geometry prompts (asking for `outer_diameter_mm` …) get a fixed JSON object
+• every other chat prompt gets the plan in `--plan` (default: a test pulley plan)
+• embeddings are deterministic hash vectors, so retrieval still works
+• `"stream": true` chat requests get server-sent events, one word per chunk
+  (`--token-delay` seconds apart)
+
+For load / resilience tests it can add random latency (`--jitter`), enforce a
+requests-per-minute limit (`--rpm`, answered with 429 + Retry-After and
+`x-ratelimit-*` headers like the real API) and fail a share of the requests
+at random with 429 (`--error-rate`).
+
+Usage:
+    python mock_openai_server.py --port 8765 --latency 0.2
+    python mock_openai_server.py --port 8765 --latency 0.2 --jitter 0.3 --rpm 600 --error-rate 0.1
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=mock python batch_runner.py --sweep ...
+"""
+from __future__ import annotations
+import argparse, hashlib, json, math, random, re, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+_GEOMETRY = {
+    "outer_diameter_mm": 69.1, "pitch_diameter_mm": 70.0, "bore_diameter_mm": 12.0,
+    "total_width_mm": 32.0, "belt_width_mm": 22.0, "tooth_pitch_mm": 10.0, "num_teeth": 22,
+}
+_EMBED_DIM = 1536
+
+
+def _hash_vector(item, dim: int = _EMBED_DIM) -> list[float]:
+    """Deterministic unit vector from the token/word content of `item`."""
+    words = item.lower().split() if isinstance(item, str) else [str(t) for t in item]
+    vec = [0.0] * dim
+    for w in words:
+        h = int.from_bytes(hashlib.blake2b(w.encode(), digest_size=8).digest(), "little")
+        vec[h % dim] += 1.0 if (h >> 63) else -1.0
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+
+def _prompt_text(messages: list[dict]) -> str:
+    parts = []
+    for m in messages:
+        content = m.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        else:
+            parts += [c.get("text", "") for c in content or [] if c.get("type") == "text"]
+    return "\n".join(parts)
+
+
+class MockState:
+    def __init__(self, plan_text: str, latency: float, token_delay: float = 0.0, jitter: float = 0.0,
+                 rpm: int = 0, error_rate: float = 0.0):
+        self.plan_text = plan_text
+        self.latency = latency
+        self.token_delay = token_delay
+        self.jitter = jitter
+        self.rpm = rpm                   # 0 = unlimited
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rejected = 0                # answered with 429
+        self._allowance = float(rpm)     # token bucket of the rpm limit
+        self._last = time.monotonic()
+
+    def admit(self) -> float:
+        """0 if the request may proceed, else the seconds until it would."""
+        with self.lock:
+            self.requests += 1
+            if self.error_rate and random.random() < self.error_rate:
+                self.rejected += 1
+                return 1.0
+            if not self.rpm:
+                return 0.0
+            now = time.monotonic()
+            self._allowance = min(self.rpm, self._allowance + (now - self._last) * self.rpm / 60)
+            self._last = now
+            if self._allowance >= 1:
+                self._allowance -= 1
+                return 0.0
+            self.rejected += 1
+            return (1 - self._allowance) * 60 / self.rpm
+
+    def headers(self) -> dict:
+        if not self.rpm:
+            return {}
+        reset = max(0.0, (self.rpm - self._allowance) * 60 / self.rpm)
+        return {"x-ratelimit-limit-requests": str(self.rpm),
+                "x-ratelimit-remaining-requests": str(int(self._allowance)),
+                "x-ratelimit-reset-requests": f"{reset:.3f}s"}
+
+
+class Handler(BaseHTTPRequestHandler):
+    state: MockState                 # set on the class by `serve()`
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):     # keep the console quiet
+        pass
+
+    def _send(self, code: int, body: dict, headers: dict | None = None) -> None:
+        raw = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        for k, v in {**self.state.headers(), **(headers or {})}.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _stream(self, model: str, text: str, usage: dict | None = None) -> None:
+        """Send `text` as chat.completion.chunk events (chunked transfer encoding);
+        `usage` is sent in a last, choice-less chunk (`stream_options.include_usage`)."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        for k, v in self.state.headers().items():
+            self.send_header(k, v)
+        self.end_headers()
+        base = {"id": f"chatcmpl-mock-{self.state.requests}", "object": "chat.completion.chunk",
+                "created": int(time.time()), "model": model}
+        pieces = [{"role": "assistant", "content": ""}] + [{"content": w} for w in re.findall(r"\S+\s*|\s+", text)]
+        try:
+            for i, delta in enumerate(pieces + [None]):
+                choice = ({"index": 0, "delta": delta, "finish_reason": None} if delta is not None
+                          else {"index": 0, "delta": {}, "finish_reason": "stop"})
+                event = f"data: {json.dumps({**base, 'choices': [choice]})}\n\n".encode()
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(event), event))
+                if self.state.token_delay and 0 < i < len(pieces):
+                    time.sleep(self.state.token_delay)
+            if usage:
+                event = f"data: {json.dumps({**base, 'choices': [], 'usage': usage})}\n\n".encode()
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(event), event))
+            done = b"data: [DONE]\n\n"
+            self.wfile.write(b"%x\r\n%s\r\n0\r\n\r\n" % (len(done), done))
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True           # client aborted the generation
+
+    def do_POST(self):
+        size = int(self.headers.get("Content-Length", 0))
+        req = json.loads(self.rfile.read(size) or b"{}")
+        wait = self.state.admit()
+        if wait:
+            return self._send(429, {"error": {"message": "Rate limit reached (mock)", "type": "requests",
+                                              "code": "rate_limit_exceeded"}},
+                              {"retry-after-ms": str(int(wait * 1000)), "retry-after": str(math.ceil(wait))})
+        if self.state.latency or self.state.jitter:
+            time.sleep(self.state.latency + random.uniform(0, self.state.jitter))
+
+        if self.path.endswith("/chat/completions"):
+            prompt = _prompt_text(req.get("messages", []))
+            text = json.dumps(_GEOMETRY) if "outer_diameter_mm" in prompt else self.state.plan_text
+            p_tok, c_tok = len(prompt) // 4, len(text) // 4
+            usage = {"prompt_tokens": p_tok, "completion_tokens": c_tok, "total_tokens": p_tok + c_tok}
+            if req.get("stream"):
+                wants = (req.get("stream_options") or {}).get("include_usage")
+                return self._stream(req.get("model", "mock"), text, usage if wants else None)
+            self._send(200, {
+                "id": f"chatcmpl-mock-{self.state.requests}", "object": "chat.completion",
+                "created": int(time.time()), "model": req.get("model", "mock"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": text}}],
+                "usage": usage,
+            })
+        elif self.path.endswith("/embeddings"):
+            inputs = req.get("input", [])
+            if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+                inputs = [inputs]
+            self._send(200, {
+                "object": "list", "model": req.get("model", "mock"),
+                "data": [{"object": "embedding", "index": i, "embedding": _hash_vector(x)}
+                         for i, x in enumerate(inputs)],
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            })
+        else:
+            self._send(404, {"error": {"message": f"unknown route {self.path}"}})
+
+
+def serve(host: str = "127.0.0.1", port: int = 8765, plan: str | Path = "test_pulley_3709N41.txt",
+          latency: float = 0.0, token_delay: float = 0.0, jitter: float = 0.0, rpm: int = 0,
+          error_rate: float = 0.0) -> ThreadingHTTPServer:
+    """Build (but do not start) the server; call `.serve_forever()` on the result.
+    Port 0 picks a free port (`srv.server_address[1]`); the state is `srv.state`."""
+    state = MockState(Path(plan).read_text(encoding="utf-8"), latency, token_delay, jitter, rpm, error_rate)
+    handler = type("Handler", (Handler,), {"state": state})      # one state per server
+    srv = ThreadingHTTPServer((host, port), handler)
+    srv.daemon_threads = True
+    srv.state = state
+    return srv
+
+
+if __name__ == "__main__":
+    cli = argparse.ArgumentParser(description="Mock OpenAI-compatible server")
+    cli.add_argument("--host", default="127.0.0.1")
+    cli.add_argument("--port", type=int, default=8765)
+    cli.add_argument("--plan", default="test_pulley_3709N41.txt", help="canned plan text")
+    cli.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    cli.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed chunks")
+    cli.add_argument("--jitter", type=float, default=0.0, help="up to this many extra seconds, at random")
+    cli.add_argument("--rpm", type=int, default=0, help="requests per minute before answering 429")
+    cli.add_argument("--error-rate", type=float, default=0.0, help="share of requests failed with 429")
+    a = cli.parse_args()
+    srv = serve(a.host, a.port, a.plan, a.latency, a.token_delay, a.jitter, a.rpm, a.error_rate)
+    print(f"Mock OpenAI API on http://{a.host}:{a.port}/v1  (Ctrl-C to stop)")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,221 @@
+# param_optimizer.py
+"""Local cutting-parameter optimiser: best n / Vf / ap / ae per plan step.
+
+The feasible region of a step is
+    Vc band and f_z band of the material        (formulary, no tolerance)
+    ap/D and ae/D band of the strategy          (formulary)
+    n ≤ max_spindle_rpm,  Vf ≤ max_feed_rate,  ap ≤ tool LOC
+    P_c ≤ spindle_power,  T_c ≤ spindle_torque,  F_f ≤ max_thrust_force
+and the objective is
+    "mrr"   maximum material removal rate; roughing steps also choose ap / ae
+            up to what the step states
+    "time"  maximum feed rate at the step's own ap / ae (shortest cycle
+            time for the same toolpath)
+ap and ae are never raised: the plan's values come from the stock and the
+part, which the optimiser does not see.  Above the band's upper bound (or the
+tool LOC) they are lowered to it; finishing, slotting, drilling and ball-mill
+steps, and every step under "time", keep them otherwise.
+
+f_z × (ae/D) is a grid; n and ap are solved in closed form per grid point,
+since P_c grows linearly with n (and ap in milling) while T_c and F_f do not
+depend on n (`mechanics.compute` evaluated once at a reference n and unit ap).
+Values are then rounded down (n, Vf to 10, ap / ae to 0.01 mm), which only
+lowers the loads.  A plan is optimised in a few milliseconds; steps without a
+feasible point get `av.suggest_corrections` instead.
+
+Usage:
+    from param_optimizer import optimise_step, optimise_parameters
+    opt = optimise_step(step, tool, machine, "N")       # Optimum(n, vf, ap, ae, mrr, …)
+    new_txt, report = optimise_parameters(plan_txt, machine, "aluminium", objective="time")
+
+    python param_optimizer.py plan.txt machines/haas_umc_1000.json aluminium [--objective time] [-o out.txt]
+"""
+from __future__ import annotations
+import math
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+import affordance_validator as av
+import parse_cam_formulary as cam
+from mechanics import compute, machine_limits, material_constants, step_mechanics
+
+# ---------------------------------------------------------------------------
+# CONFIG
+# ---------------------------------------------------------------------------
+OBJECTIVES = ("mrr", "time")
+FZ_POINTS = 33                    # grid over the f_z band
+AE_POINTS = 33                    # grid over ae/D up to the step's ae (free engagement only)
+FREE_ENGAGEMENT = ("roughing",)   # strategies whose ap / ae the "mrr" objective may choose
+_N_REF = 1000.0                   # reference rpm of the unit loads
+
+
+@dataclass
+class Optimum:
+    step: str
+    n: int = 0
+    vf: int = 0
+    ap: float = 0.0
+    ae: float = 0.0
+    mrr: float = 0.0               # mm³/min
+    feasible: bool = True
+    reason: str = ""               # why not, when infeasible
+
+    def changes(self, step: Dict) -> Dict[str, float]:
+        """Fields the step states whose value differs from the optimum."""
+        new = {"n": self.n, "vf": self.vf, "ap": self.ap, "ae": self.ae}
+        return {k: v for k, v in new.items() if k in step and v != step[k]}
+
+
+def _floor(v: float, step: float) -> float:
+    return math.floor(v / step + 1e-9) * step
+
+
+def optimise_step(step: Dict, tool: Dict, machine: Dict, iso: str,
+                  formulary: cam.Formulary | None = None, objective: str = "mrr") -> Optimum:
+    """Best feasible parameters of one parsed step for `objective` ("mrr" | "time")."""
+    if objective not in OBJECTIVES:
+        raise ValueError(f"objective must be one of {OBJECTIVES}, not {objective!r}")
+    D = float(tool.get("dia", step.get("tool_dia", 0)) or 0)
+    z = float(tool.get("flutes", 1) or 1)
+    if not D:
+        return Optimum(step["step"], feasible=False, reason="unknown tool diameter")
+    strat = step["strategy"]
+    drilling = strat == "drilling"
+    fixed = drilling or tool.get("type") == "ballmill"
+    free = objective == "mrr" and strat in FREE_ENGAGEMENT and not fixed
+
+    lim = cam.get_limits_for(iso, formulary)
+    vc_lo, vc_hi = lim["Vc"]
+    fz_lo, fz_hi = lim["fz_finish"] if strat == "finishing" else lim["fz_rough"]
+    if not fz_lo:                                    # no f_z band: keep the step's chip load
+        fz_lo = fz_hi = av._calc_values(step, tool)["fz"]
+    loads = machine_limits(machine)
+    n_lo = vc_lo * 1000 / (math.pi * D)
+    n_cap = min(machine.get("max_spindle_rpm", 9e9), vc_hi * 1000 / (math.pi * D))
+    if n_lo > n_cap:
+        return Optimum(step["step"], feasible=False,
+                       reason=f"Vc ≥ {vc_lo:.0f} m/min needs {n_lo:.0f} rpm > {n_cap:.0f} rpm")
+    loc_mm = av._loc_to_mm(tool.get("loc", math.inf), D)
+
+    # engagement: never deeper / wider than the step states (that is where the stock
+    # and the part are), lowered into the band and under the tool LOC
+    ap, ae = step.get("ap", 0), min(step.get("ae", 0), D)
+    if free:                                         # not stated: the band decides
+        ap, ae = ap or math.inf, ae or D
+    eng = cam.get_engagement_limits(strat, formulary)
+    if not fixed:
+        ap = min(ap, eng["ap_d"][1] * D)
+        if strat != "slotting":                      # full width; the table gives no ae band
+            ae = min(ae, eng["ae_d"][1] * D)
+    ap_hi = min(ap, loc_mm)
+    if free:
+        ap_lo = min(eng["ap_d"][0] * D, ap_hi)
+        r = np.linspace(min(eng["ae_d"][0] * D, ae), ae, AE_POINTS) / D
+    else:
+        ap_lo = ap_hi
+        r = np.array([ae / D])
+    fz = np.linspace(fz_lo, fz_hi, FZ_POINTS)[:, None]
+    r = r[None, :]
+
+    # unit loads at _N_REF (and ap = 1 mm in milling): P_c ∝ n·ap, T_c ∝ ap, F_f const.
+    kc0_4, x = material_constants(iso, formulary)
+    unit = compute(D, z, _N_REF, fz * z * _N_REF, 1.0 if not drilling else ap_hi, r * D,
+                   drilling, kc0_4, x)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        budget = np.where(unit.Pc > 0, loads["power"] * _N_REF / unit.Pc, math.inf)   # n·ap (milling), n (drilling)
+        n_hi = np.minimum(n_cap, machine.get("max_feed_rate", 9e9) / (fz * z))
+        if drilling:
+            n = np.minimum(n_hi, budget)
+            ap_g = np.full_like(n, ap_hi)
+            ok = (unit.Tc <= loads["torque"]) & (unit.Ff <= loads["thrust"])
+        else:
+            ap_max = np.minimum(ap_hi, np.where(unit.Tc > 0, loads["torque"] / unit.Tc, math.inf))
+            ap_g = np.minimum(ap_max, budget / n_hi)
+            n = np.where(ap_g < ap_lo, budget / max(ap_lo, 1e-9), n_hi)
+            ap_g = np.maximum(ap_g, ap_lo)
+            ok = ap_max >= ap_lo
+    ok &= n >= n_lo
+    vf = fz * z * n
+    gain = vf if objective == "time" else (math.pi * D ** 2 / 4 * vf if drilling else r * D * ap_g * vf)
+    gain = np.where(ok, np.broadcast_to(gain, ok.shape), -math.inf)
+    if not np.isfinite(gain.max()):
+        return Optimum(step["step"], feasible=False,
+                       reason="no parameters within the power / torque / thrust limits")
+
+    i, j = np.unravel_index(int(np.argmax(gain)), gain.shape)
+    n_best = _floor(float(n[i, j]), 10)
+    if n_best < n_lo:                                # rounding must not leave the Vc band
+        n_best = math.ceil(n_lo)
+    vf_best = _floor(float(fz[i, 0] * z * n_best), 10)
+    if free:
+        ap_best, ae_best = float(ap_g[i, j]), float(r[0, j] * D)
+    else:
+        ap_best, ae_best = ap_lo, ae
+    # untouched values are kept as written, changed ones rounded down to 0.01 mm
+    ap_best, ae_best = (v if v == step.get(k, 0) else round(_floor(v, 0.01), 2)
+                        for k, v in (("ap", ap_best), ("ae", ae_best)))
+    best = {**step, "n": n_best, "vf": vf_best, "ap": ap_best, "ae": ae_best}
+    return Optimum(step["step"], int(n_best), int(vf_best), ap_best, ae_best,
+                   step_mechanics(best, tool, iso, formulary)["MRR"])
+
+
+def optimise_parameters(plan_txt: str, machine: Dict, material: str, objective: str = "mrr",
+                        formulary: cam.Formulary | None = None) -> Tuple[str, List[Dict]]:
+    """Optimise every step and write the values back into the plan text.
+
+    Returns the new text and, per changed step, `{"step", "changes":
+    {field: (old, new)}, "mrr": (old, new)}`; infeasible steps get the nearest
+    compliant values (`suggest_corrections`) and a `"reason"`."""
+    formulary = formulary or cam.load_formulary()
+    tag, tools = cam.infer_material_tag(material), machine.get("tool_library", [])
+    edits, report = {}, []
+    for i, st in enumerate(av.parse_txt_plan(plan_txt)):
+        tool = av._find_tool(st.get("tool_id"), tools)
+        opt = optimise_step(st, tool, machine, tag, formulary, objective)
+        fix = opt.changes(st) if opt.feasible else av.suggest_corrections(st, machine, tag, tool, formulary)
+        if not fix:
+            continue
+        edits[i] = fix
+        before = step_mechanics(st, tool, tag, formulary)["MRR"]
+        after = opt.mrr if opt.feasible else step_mechanics({**st, **fix}, tool, tag, formulary)["MRR"]
+        entry = {"step": st["step"], "changes": {k: (st.get(k), v) for k, v in fix.items()},
+                 "mrr": (before, after)}
+        if not opt.feasible:
+            entry["reason"] = opt.reason
+        report.append(entry)
+    return (av.rewrite_fields(plan_txt, edits) if edits else plan_txt), report
+
+
+def print_changes(report: List[Dict], file=None) -> None:
+    for ch in report:
+        mrr = ch.get("mrr")
+        gain = f"  (MRR {mrr[0] / 1000:.1f} → {mrr[1] / 1000:.1f} cm³/min)" if mrr else ""
+        note = f"  [{ch['reason']}]" if ch.get("reason") else ""
+        print(f"🔧 {ch['step']}: " + ", ".join(f"{k} {o} → {n}" for k, (o, n) in ch["changes"].items())
+              + gain + note, file=file)
+
+
+if __name__ == "__main__":
+    import argparse, sys, time
+    from pathlib import Path
+    from machine_registry import load_machine
+
+    cli = argparse.ArgumentParser(description="Optimise the cutting parameters of a plan locally")
+    cli.add_argument("plan")
+    cli.add_argument("machine")
+    cli.add_argument("material")
+    cli.add_argument("--objective", choices=OBJECTIVES, default="mrr")
+    cli.add_argument("-o", "--out", help="write the optimised plan here (default: stdout)")
+    a = cli.parse_args()
+    text, mach, f = Path(a.plan).read_text(encoding="utf-8"), load_machine(a.machine), cam.load_formulary()
+    t0 = time.perf_counter()
+    new, changes = optimise_parameters(text, mach, a.material, a.objective, f)
+    dt = time.perf_counter() - t0
+    if a.out:
+        Path(a.out).write_text(new, encoding="utf-8")
+    else:
+        print(new)
+    print_changes(changes, file=sys.stderr)
+    print(f"{len(changes)} step(s) changed in {dt * 1000:.1f} ms", file=sys.stderr)
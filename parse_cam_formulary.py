@@ -1,163 +1,305 @@
 # parse_cam_formulary.py
 """Parse CAM.txt and expose cutting‑parameter reference limits.
 
-Dynamic extraction of:
-• Cutting speed Vc ranges per ISO material class
-• Feed per tooth fz ranges (rough / finish)
-• Depth engagement ratios ap/D and ae/D for strategies (roughing, finishing, slotting)
-• Cutting‑pressure constants kc0_4 and exponent x
+One pass over the file fills an immutable `Formulary` with:
+• Cutting speed Vc ranges per ISO material class (§1)
+• Feed per tooth fz ranges (rough / finish) (§2)
+• Depth engagement ratios ap/D and ae/D for strategies (roughing, finishing, slotting) (§3)
+• Taylor tool‑life exponent n (§5)
+• Surface‑finish Ra targets per strategy (§8)
+• Cutting‑pressure constants kc0_4 and exponent x (§9)
+• Flute count → ferrous / non‑ferrous recommendation (§10)
+
+The parsed tables are written to a small JSON snapshot keyed by the sha256 of
+the formulary, so later processes skip the parse; editing CAM.txt invalidates
+it.  Formularies are memoised per path, so several can be used side by side.
 
 Public helpers
 --------------
-infer_material_tag(text)  -> 'P' | 'M' | 'K' | 'N' | 'S' | 'H'
+load_formulary(path=None)  -> Formulary   (CAM.txt from $CAM_FORMULARY, cwd or this folder)
+infer_material_tag(text, default='P') -> 'P' | 'M' | 'K' | 'N' | 'S' | 'H', or `default` if unknown
 get_limits_for('N')       -> { 'Vc': (lo,hi), 'fz_rough': (lo,hi), 'fz_finish': (lo,hi), 'kc0_4': (lo,hi), 'x': (lo,hi) }
 get_engagement_limits('finishing') -> { 'ap_d': (lo,hi), 'ae_d': (lo,hi) }
 """
 from __future__ import annotations
-import re
+import hashlib, json, os, re, threading
+from dataclasses import dataclass, fields
 from pathlib import Path
-from typing import Dict, Tuple
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from cache_paths import cache_dir
+
+Range = Tuple[float, float]
 
 # ─────────────────────────────────────────────────────────────────────────────
-# 0 . Load formulary
+# 0 . Locate formulary
 # ─────────────────────────────────────────────────────────────────────────────
 _CAM = Path("CAM.txt")
-if not _CAM.exists():
-    raise FileNotFoundError("CAM.txt not found – please place it in project root.")
-_lines = [ln.rstrip() for ln in _CAM.read_text(encoding="utf-8").splitlines()]
+_HERE = Path(__file__).resolve().parent
+_SNAPSHOT_DIR = cache_dir("formulary")
+_SNAPSHOT_VERSION = 1            # bump when the parser output changes
+
 _RANGE = re.compile(r"([\d\.]+)\s*[–-]\s*([\d\.]+)")  # e.g. 180 – 250
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+_HEADING = re.compile(r"^#\s+(?:(\d+)\.\s*)?(.*?)\s*$")  # "# 9. Typical …" / "# Roughness"
+_ISO_ROW = re.compile(r"^([PMKNSH])\s*\(")              # "P (Steel) …"
+_FLUTES = re.compile(r"(\d+)-flute:\s*Recommended for (non-ferrous|ferrous)", re.I)
+_STRATEGIES = ("roughing", "finishing", "slotting")
 
 
-def _rng(s: str) -> Tuple[float, float]:
+def _rng(s: str) -> Range:
     m = _RANGE.search(s)
     return (float(m.group(1)), float(m.group(2))) if m else (0.0, 0.0)
 
-# ─────────────────────────────────────────────────────────────────────────────
-# 1 . Cutting‑speed Vc table (§1)
-# ─────────────────────────────────────────────────────────────────────────────
-_VC: Dict[str, Tuple[float, float]] = {}
-sec = False
-for ln in _lines:
-    if ln.startswith("# 1. Cutting Speed"):
-        sec = True
-        continue
-    if sec and ln.startswith("# ") and not ln.startswith("# 1"):
-        break
-    if sec and "|" in ln and ln.strip()[0] in "PMKNSH":
-        iso = ln.strip()[0]
-        _VC[iso] = _rng(ln)
+
+def _resolve(path: str | Path | None) -> Path:
+    """Explicit path, else $CAM_FORMULARY, else ./CAM.txt, else CAM.txt next to this module."""
+    if path is None and os.getenv("CAM_FORMULARY"):
+        path = os.environ["CAM_FORMULARY"]
+    candidates = [Path(path)] if path is not None else [_CAM, _HERE / _CAM]
+    for p in candidates:
+        if p.exists():
+            return p.resolve()
+    raise FileNotFoundError(
+        f"CAM.txt not found (looked in {', '.join(str(p) for p in candidates)}) "
+        "– place it in the project root or set CAM_FORMULARY.")
 
 # ─────────────────────────────────────────────────────────────────────────────
-# 2 . Feed‑per‑tooth fz table (§2)
+# 1 . Formulary object
 # ─────────────────────────────────────────────────────────────────────────────
-_FZ_ROUGH: Dict[str, Tuple[float, float]] = {}
-_FZ_FINISH: Dict[str, Tuple[float, float]] = {}
-sec = False
-for ln in _lines:
-    if ln.startswith("# 2. Feed per Tooth"):
-        sec = True
-        continue
-    if sec and ln.startswith("# ") and not ln.startswith("# 2"):
-        break
-    if sec and "|" in ln and ln.strip()[0] in "PMKNSH":
-        iso = ln.strip()[0]
-        if "Roughing" in ln:
-            _FZ_ROUGH[iso] = _rng(ln)
-        else:
-            _FZ_FINISH[iso] = _rng(ln)
+def _freeze(v):
+    if isinstance(v, dict):
+        return MappingProxyType({k: _freeze(x) for k, x in v.items()})
+    if isinstance(v, list):
+        return tuple(_freeze(x) for x in v)
+    return v
+
+
+def _thaw(v):
+    if isinstance(v, Mapping):
+        return {k: _thaw(x) for k, x in v.items()}
+    return v
+
+
+@dataclass(frozen=True)
+class Formulary:
+    """Read-only tables of one CAM formulary file."""
+    source: str
+    sha256: str
+    vc: Mapping[str, Range]
+    fz_rough: Mapping[str, Range]
+    fz_finish: Mapping[str, Range]
+    engagement: Mapping[str, Mapping[str, Range]]
+    kc0_4: Mapping[str, Range]                  # union of the sub-class rows (e.g. two P steels)
+    x: Mapping[str, Range]
+    taylor_n: Range
+    ra_targets: Mapping[str, float]             # µm per strategy
+    flutes: Mapping[int, str]                   # flute count -> 'ferrous' | 'non-ferrous'
+
+    def __post_init__(self):
+        for f in fields(self):
+            object.__setattr__(self, f.name, _freeze(getattr(self, f.name)))
+
+    # ---- lookups ------------------------------------------------------------
+    def limits_for(self, iso: str) -> Dict[str, Range]:
+        return {
+            "Vc": self.vc.get(iso, (0, 0)),
+            "fz_rough": self.fz_rough.get(iso, (0, 0)),
+            "fz_finish": self.fz_finish.get(iso, (0, 0)),
+            "kc0_4": self.kc0_4.get(iso, (0, 0)),
+            "x": self.x.get(iso, (0, 0)),
+        }
+
+    def engagement_limits(self, strategy: str = "roughing") -> Mapping[str, Range]:
+        return self.engagement.get(strategy.lower(), self.engagement["roughing"])
+
+    def recommended_flutes(self, iso: str) -> List[int]:
+        group = "non-ferrous" if iso == "N" else "ferrous"
+        return sorted(z for z, g in self.flutes.items() if g == group)
+
+    # ---- snapshot -----------------------------------------------------------
+    def to_json(self) -> str:
+        d = {f.name: _thaw(getattr(self, f.name)) for f in fields(self)}
+        return json.dumps(d, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, blob: str) -> "Formulary":
+        d = json.loads(blob)
+        tup = lambda m: {k: tuple(v) for k, v in m.items()}
+        return cls(
+            source=d["source"], sha256=d["sha256"],
+            vc=tup(d["vc"]), fz_rough=tup(d["fz_rough"]), fz_finish=tup(d["fz_finish"]),
+            engagement={s: tup(e) for s, e in d["engagement"].items()},
+            kc0_4=tup(d["kc0_4"]), x=tup(d["x"]), taylor_n=tuple(d["taylor_n"]),
+            ra_targets=d["ra_targets"], flutes={int(z): g for z, g in d["flutes"].items()},
+        )
 
 # ─────────────────────────────────────────────────────────────────────────────
-# 3 . Engagement ratios table (§3)
+# 2 . Single‑pass parser
 # ─────────────────────────────────────────────────────────────────────────────
-_ENG: Dict[str, Dict[str, Tuple[float, float]]] = {}
-sec = False
-for ln in _lines:
-    if ln.startswith("# 3. Depths of Cut"):
-        sec = True
-        continue
-    if sec and ln.startswith("# ") and not ln.startswith("# 3"):
-        break
-    if sec and "|" in ln and any(k in ln for k in ("Finishing", "Roughing", "Slotting")):
-        cols = [c.strip() for c in ln.split("|")]
-        key = cols[0].lower()
-        _ENG[key] = {"ap_d": _rng(cols[1]), "ae_d": _rng(cols[2])}
-# ensure keys exist to avoid KeyError
-for k in ("roughing", "finishing", "slotting"):
-    _ENG.setdefault(k, {"ap_d": (0, 0), "ae_d": (0, 0)})
+def parse_formulary(text: str, source: str = "<string>") -> Formulary:
+    vc: Dict[str, Range] = {}
+    fz_rough: Dict[str, Range] = {}
+    fz_finish: Dict[str, Range] = {}
+    eng: Dict[str, Dict[str, Range]] = {}
+    kc: Dict[str, Range] = {}
+    x: Dict[str, Range] = {}
+    taylor_n: Range = (0.0, 0.0)
+    ra: Dict[str, float] = {}
+    flutes: Dict[int, str] = {}
+
+    sec: Optional[str] = None          # "1".."11" or the heading text of unnumbered sections
+    in_x = False                       # §9: past the "Typical exponent x" header
+    for ln in text.splitlines():
+        ln = ln.strip()
+        if not ln:
+            continue
+        if ln.startswith("##"):
+            sec = None
+            continue
+        h = _HEADING.match(ln)
+        if h:
+            sec, in_x = h.group(1) or h.group(2).lower(), False
+            continue
+        row = _ISO_ROW.match(ln)
+        iso = row.group(1) if row else None
+
+        if sec == "1" and iso and "|" in ln:
+            vc[iso] = _rng(ln)
+        elif sec == "2" and iso and "|" in ln:
+            (fz_rough if "Roughing" in ln else fz_finish)[iso] = _rng(ln)
+        elif sec == "3" and "|" in ln:
+            cols = [c.strip() for c in ln.split("|")]
+            if cols[0].lower() in _STRATEGIES:
+                eng[cols[0].lower()] = {"ap_d": _rng(cols[1]), "ae_d": _rng(cols[2])}
+        elif sec == "5" and "exponent" in ln:
+            taylor_n = _rng(ln)
+        elif sec == "8" and "|" in ln:
+            cols = [c.strip() for c in ln.strip("|").split("|")]
+            num = _NUMBER.search(cols[-1])
+            if num and cols[0]:
+                ra[cols[0].lower()] = float(num.group())
+        elif sec == "9":
+            if "Typical exponent" in ln:
+                in_x = True
+            elif iso and "->" in ln:
+                lo, hi = _rng(ln)
+                if in_x:
+                    x[iso] = (lo, hi)
+                else:
+                    prev = kc.get(iso)
+                    kc[iso] = (min(prev[0], lo), max(prev[1], hi)) if prev else (lo, hi)
+        elif sec == "10":
+            m = _FLUTES.search(ln)
+            if m:
+                flutes[int(m.group(1))] = m.group(2).lower()
+
+    # ensure keys exist to avoid KeyError
+    for k in _STRATEGIES:
+        eng.setdefault(k, {"ap_d": (0, 0), "ae_d": (0, 0)})
+    return Formulary(
+        source=source, sha256=hashlib.sha256(text.encode("utf-8")).hexdigest(),
+        vc=vc, fz_rough=fz_rough, fz_finish=fz_finish, engagement=eng,
+        kc0_4=kc, x=x, taylor_n=taylor_n, ra_targets=ra, flutes=flutes,
+    )
 
 # ─────────────────────────────────────────────────────────────────────────────
-# 4 . Cutting‑pressure constants kc0_4 + exponent x (§9)
+# 3 . Snapshot + per‑file memo
 # ─────────────────────────────────────────────────────────────────────────────
-_KC: Dict[str, Tuple[float, float]] = {}
-_X: Dict[str, Tuple[float, float]] = {}
-sec_kc = sec_x = False
-for ln in _lines:
-    if ln.startswith("# 9. Typical values"):
-        sec_kc = True
-        continue
-    if sec_kc and "Typical exponent" in ln:
-        sec_x = True
-        continue
-    if sec_kc and ln.startswith("# ") and not ln.startswith("# 9"):
-        sec_kc = False
-    if sec_x and ln.startswith("# ") and not ln.startswith("# 9"):
-        sec_x = False
-    if sec_kc and "->" in ln and ln.strip()[0] in "PMKNSH":
-        iso = ln.strip()[0]
-        _KC[iso] = _rng(ln)
-    if sec_x and "->" in ln and ln.strip()[0] in "PMKNSH":
-        iso = ln.strip()[0]
-        _X[iso] = _rng(ln)
+_loaded: Dict[Tuple[str, int, int], Formulary] = {}   # (path, mtime_ns, size) -> Formulary
+_lock = threading.Lock()
+
+
+def _snapshot_path(sha: str) -> Path:
+    return _SNAPSHOT_DIR / f"{sha[:20]}-v{_SNAPSHOT_VERSION}.json"
+
+
+def _load_or_parse(path: Path) -> Formulary:
+    raw = path.read_bytes()
+    sha = hashlib.sha256(raw).hexdigest()
+    snap = _snapshot_path(sha)
+    try:
+        f = Formulary.from_json(snap.read_text(encoding="utf-8"))
+        if f.sha256 == sha:
+            return f
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    f = parse_formulary(raw.decode("utf-8"), source=path.as_posix())
+    try:
+        snap.parent.mkdir(parents=True, exist_ok=True)
+        tmp = snap.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(f.to_json(), encoding="utf-8")
+        tmp.replace(snap)
+    except OSError:
+        pass                                        # read-only cache: parse again next time
+    return f
+
+
+def load_formulary(path: str | Path | None = None) -> Formulary:
+    """The formulary at `path` (default CAM.txt), parsed at most once per file version."""
+    p = _resolve(path)
+    st = p.stat()
+    key = (p.as_posix(), st.st_mtime_ns, st.st_size)
+    with _lock:
+        f = _loaded.get(key)
+        if f is None:
+            f = _loaded[key] = _load_or_parse(p)
+    return f
+
+
+def warm_up() -> None:
+    """Parse CAM.txt (or load its snapshot) ahead of the first lookup."""
+    load_formulary()
 
 # ─────────────────────────────────────────────────────────────────────────────
-# 5 . Public helpers
+# 4 . Public helpers
 # ─────────────────────────────────────────────────────────────────────────────
 _MAT = {
     "steel": "P", "carbon steel": "P", "mild steel": "P",
     "stainless": "M", "stainless steel": "M",
     "cast iron": "K", "grey iron": "K", "gray iron": "K",
-    "aluminium": "N", "aluminum": "N",
-    "titanium": "S", "superalloy": "S", "nickel alloy": "S",
+    "aluminium": "N", "aluminum": "N", "brass": "N", "bronze": "N", "copper": "N",
+    "titanium": "S", "ti6al4v": "S", "ti-6al-4v": "S", "superalloy": "S", "nickel alloy": "S",
+    "inconel": "S",
     "hardened": "H", "hardened steel": "H", "tool steel": "H",
 }
+_MAT_KEYWORDS = sorted(_MAT.items(), key=lambda kv: -len(kv[0]))   # "stainless steel" before "steel"
 
 
-def infer_material_tag(text: str) -> str:
+def infer_material_tag(text: str, default: Optional[str] = "P") -> Optional[str]:
+    """ISO class of a material description; `default` when no keyword matches."""
     txt = text.lower()
-    for kw, tag in _MAT.items():
+    for kw, tag in _MAT_KEYWORDS:
         if kw in txt:
             return tag
-    return "P"
+    return default
 
 
-def get_limits_for(material: str | None) -> Dict:
+def get_limits_for(material: str | None, formulary: Formulary | None = None) -> Dict:
     iso = (material or "P").upper()[0]
-    return {
-        "Vc": _VC.get(iso, (0, 0)),
-        "fz_rough": _FZ_ROUGH.get(iso, (0, 0)),
-        "fz_finish": _FZ_FINISH.get(iso, (0, 0)),
-        "kc0_4": _KC.get(iso, (0, 0)),
-        "x": _X.get(iso, (0, 0)),
-    }
+    return (formulary or load_formulary()).limits_for(iso)
 
 
-def get_engagement_limits(strategy: str = "roughing") -> Dict[str, Tuple[float, float]]:
-    return _ENG.get(strategy.lower(), _ENG["roughing"])
+def get_engagement_limits(strategy: str = "roughing",
+                          formulary: Formulary | None = None) -> Mapping[str, Range]:
+    return (formulary or load_formulary()).engagement_limits(strategy)
 
 # ─────────────────────────────────────────────────────────────────────────────
-# 6 . Smoke test (optional)
+# 5 . Smoke test (optional)
 # ─────────────────────────────────────────────────────────────────────────────
 if __name__ == "__main__":
     mat_desc = input("Material description: ")
     tag = infer_material_tag(mat_desc)
     print("ISO tag:", tag)
     print("Limits:", get_limits_for(tag))
-    print("Finishing engagement:", get_engagement_limits("finishing"))
-    print("Roughing engagement:", get_engagement_limits("roughing"))
-    print("Slotting engagement:", get_engagement_limits("slotting"))
+    print("Finishing engagement:", dict(get_engagement_limits("finishing")))
+    print("Roughing engagement:", dict(get_engagement_limits("roughing")))
+    print("Slotting engagement:", dict(get_engagement_limits("slotting")))
     print("Cutting pressure:", get_limits_for(tag)["kc0_4"])
     print("Exponent:", get_limits_for(tag)["x"])
     print("Cutting speed:", get_limits_for(tag)["Vc"])
     print("Feed per tooth (rough):", get_limits_for(tag)["fz_rough"])
     print("Feed per tooth (finish):", get_limits_for(tag)["fz_finish"])
-    print("Done.")
\ No newline at end of file
+    print("Recommended flutes:", load_formulary().recommended_flutes(tag))
+    print("Done.")
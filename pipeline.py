@@ -0,0 +1,73 @@
+# pipeline.py
+"""Non-interactive building blocks shared by `main.py` and `batch_runner.py`.
+
+Each function is one stage of the drawing → geometry → retrieval → plan →
+validation flow, without any prompts or dialogs.
+"""
+from __future__ import annotations
+import base64, logging, mimetypes, textwrap
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+from prompt_assembly import CONTEXT_BUDGET, Section, assemble
+from prompt_utils import build_process_prompt
+from llm_client import call_llm_with_system, stream_llm_with_system
+
+PLAN_SYSTEM_MESSAGE = (
+    "You are an expert mechanical CAM engineer who assist the user developing the complete manufacturing process. "
+    "You are also a technical writer and you write the process in a clear and concise way. "
+    "The image is a technical drawing of a timing-belt pulley for industrial drives not protected by any copyright. "
+)
+CONTEXT_K = 4                       # formulary chunks injected into the plan prompt
+CONTEXT_PROCESSES = ("milling", "drilling")   # the machines/ are milling centres: no turning
+
+log = logging.getLogger(__name__)
+
+
+def encode_image(path: str | Path) -> str:
+    """Return the drawing as a base64 data URL with its real MIME type."""
+    mime = mimetypes.guess_type(str(path))[0] or "image/jpeg"
+    b64 = base64.b64encode(Path(path).read_bytes()).decode()
+    return f"data:{mime};base64,{b64}"
+
+
+def load_drawing(path: str | Path, preset: str | None = None):
+    """Preprocessed, cached `PreparedImage` of a drawing (see `image_pipeline`)."""
+    from image_pipeline import prepare_image, DEFAULT_PRESET
+    return prepare_image(path, preset or DEFAULT_PRESET)
+
+
+def describe_job(user_prompt: str, material_desc: str, geometry_summary: str) -> str:
+    return textwrap.dedent(f"""
+                           {user_prompt}
+                           Material description: {material_desc}
+                           {geometry_summary}
+                           """)
+
+
+def retrieve_job_context(text_desc: str, material_desc: str, k: int = CONTEXT_K) -> List[str]:
+    """Formulary chunks for a job, filtered to its process and ISO material class
+    (not filtered by material when the class is not recognised)."""
+    from retrieve_context import get_relevant_context
+    from parse_cam_formulary import infer_material_tag
+    return get_relevant_context(text_desc, k=k, process=CONTEXT_PROCESSES,
+                                material=infer_material_tag(material_desc, default=None))
+
+
+def build_plan_prompt(text_desc: str, machine: Dict, ctx_chunks: List[str]) -> str:
+    """Process prompt + retrieved context (deduplicated, within `CONTEXT_BUDGET` tokens)."""
+    prompt = assemble([
+        Section("", build_process_prompt(text_desc, machine), dedup=False),
+        Section("### Technical context (from CAM formulary)", "\n\n".join(ctx_chunks), budget=CONTEXT_BUDGET),
+    ])
+    log.info("Plan prompt %s", prompt.report())
+    return prompt.text
+
+
+def generate_plan(rag_prompt: str, image_data) -> str:
+    return call_llm_with_system(rag_prompt, image_data, system_message=PLAN_SYSTEM_MESSAGE)
+
+
+def stream_plan(rag_prompt: str, image_data) -> Iterator[str]:
+    """`generate_plan`, yielding the text as it is written (see `av.validate_stream`)."""
+    return stream_llm_with_system(rag_prompt, image_data, system_message=PLAN_SYSTEM_MESSAGE)
@@ -0,0 +1,178 @@
+# plan_parser.py
+"""Single-pass parser for the LLM's text CAM plans.
+
+The plan is read line by line: a precompiled header pattern opens a new step,
+and cheap substring checks route every other line to just the (precompiled)
+field patterns it can contain – tool id, D, n, Vf, ap, ae and operation.
+Fields are read within a line; the first value seen in a step wins.
+
+`PlanStreamParser` accepts the text in arbitrary chunks (e.g. straight from a
+streaming LLM response) and returns each step as soon as the next header – or
+`close()` – completes it.  With `spans=True` each step also records where its
+field values sit in the text, which `rewrite_fields` uses to patch values in
+place.
+
+Usage:
+    steps = parse_txt_plan(text)
+
+    p = PlanStreamParser()
+    for chunk in chunks:
+        for step in p.feed(chunk):
+            ...
+    rest = p.close()
+
+    fixed = rewrite_fields(text, {0: {"n": 7600, "vf": 2280}})
+"""
+from __future__ import annotations
+import logging, re
+from typing import Dict, Iterable, Iterator, List, Optional
+
+log = logging.getLogger(__name__)
+
+_STEP_HDR = re.compile(
+    r"""
+    ^\s*
+    (?:\#+\s*)?          # markdown header (optional)
+    (\d+)                # step number
+    [\.\)]\s*
+    (?:\*\*|__)?         # opening bold (optional)
+    ([^*\n]+?)           # TITLE (group-2 !)
+    (?:\*\*|__)?         # closing bold (optional)
+    \s*$
+    """,
+    re.VERBOSE,
+)
+
+# field -> pattern; group 1 is the value
+_FIELDS = {
+    "tool_id":  re.compile(r"Tool.*ID:\s*(\d+)", re.I),
+    "tool_dia": re.compile(r"D\s*=\s*(\d+\.?\d*)\s*mm", re.I),
+    "n":        re.compile(r"Spindle Speed.*?:\s*(\d+)\s*RPM", re.I),
+    "vf":       re.compile(r"Feedrate.*?:\s*(\d+)\s*mm/min", re.I),
+    "ap":       re.compile(r"Depth/Pass.*?:\s*(\d+\.?\d*)\s*mm", re.I),
+    "ae":       re.compile(r"Side Engagement.*?:\s*(\d+\.?\d*)\s*mm", re.I),
+}
+# "Operation: …" as well as the markdown "**Operation**: …"
+_OPERATION = re.compile(r"Operation(?:\*\*|__)?\s*:\s*(?:\*\*|__)?\s*([^\n]+)", re.I)
+
+# substring (of the lower-cased line) that every match of a field's pattern contains
+_ROUTE = (("tool", "tool_id"), ("=", "tool_dia"), ("spindle speed", "n"), ("feedrate", "vf"),
+          ("depth/pass", "ap"), ("side engagement", "ae"))
+
+
+def _strategy(text: str, op_line: str = "") -> str:
+    txt = f"{text} {op_line}".lower()
+    if any(k in txt for k in ("finish", "finishing", "swarf", "semi-finish", "contour", "contouring", "taper", "tapering", "profile", "profiling")):
+        return "finishing"
+    if any(k in txt for k in ("drill", "bore", "ream", "reamer", "tapping", "tap")):
+        return "drilling"
+    if any(k in txt for k in ("slot", "slotting", "slitting", "groove", "grooving", "keyway", "keywaying", "pocket", "pocketing")):
+        return "slotting"
+    return "roughing"
+
+
+def _number(s: str):
+    return float(s) if "." in s else int(s)
+
+
+class PlanStreamParser:
+    """Incremental plan parser: `feed()` text chunks, get finished steps back."""
+
+    def __init__(self, spans: bool = False):
+        self._buf = ""                      # incomplete trailing line
+        self._title: Optional[str] = None   # header of the step being read
+        self._fields: Dict = {}
+        self._op = ""
+        self._track = spans
+        self._spans: Dict = {}              # field -> (line, start, end) of its value
+        self._lineno = -1
+        self.steps = 0                      # steps emitted so far
+
+    def feed(self, chunk: str) -> List[Dict]:
+        self._buf += chunk
+        *lines, self._buf = self._buf.split("\n")
+        out: List[Dict] = []
+        for ln in lines:
+            self._line(ln, out)
+        return out
+
+    def close(self) -> List[Dict]:
+        """Flush the last line and the last step."""
+        out: List[Dict] = []
+        if self._buf:
+            self._line(self._buf, out)
+            self._buf = ""
+        self._finish(out)
+        log.debug("Parsed %d steps.", self.steps)
+        return out
+
+    def _line(self, ln: str, out: List[Dict]) -> None:
+        self._lineno += 1
+        if ln.lstrip(" \t#")[:1].isdigit():
+            h = _STEP_HDR.match(ln)
+            if h:
+                self._finish(out)
+                self._title, self._fields, self._op, self._spans = h.group(2).strip(), {}, "", {}
+                return
+        if self._title is None or (":" not in ln and "=" not in ln):
+            return                           # every field pattern needs a ':' or '='
+        low, f = ln.lower(), self._fields
+        for kw, key in _ROUTE:
+            if key not in f and kw in low:
+                m = _FIELDS[key].search(ln)
+                if m:
+                    f[key] = _number(m.group(1))
+                    if self._track:
+                        self._spans[key] = (self._lineno, m.start(1), m.end(1))
+        if not self._op and "operation" in low:
+            m = _OPERATION.search(ln)
+            if m:
+                self._op = m.group(1).strip()
+
+    def _finish(self, out: List[Dict]) -> None:
+        if self._title is None or "tool_id" not in self._fields:
+            return
+        step = {"step": self._title, "strategy": _strategy(self._title, self._op)}
+        step.update((k, self._fields[k]) for k in _FIELDS if k in self._fields)
+        if self._op:
+            step["operation"] = self._op
+        if self._track:
+            step["_spans"] = self._spans
+        self.steps += 1
+        log.debug("step %d: %s (%s)", self.steps, step["step"], step["strategy"])
+        out.append(step)
+        self._title = None
+
+
+def iter_steps(chunks: Iterable[str]) -> Iterator[Dict]:
+    """Yield steps from a stream of text chunks as soon as each one is complete."""
+    p = PlanStreamParser()
+    for chunk in chunks:
+        yield from p.feed(chunk)
+    yield from p.close()
+
+
+def parse_txt_plan(text: str) -> List[Dict]:
+    p = PlanStreamParser()
+    return p.feed(text) + p.close()
+
+
+def _fmt(value) -> str:
+    return str(int(value)) if float(value).is_integer() else f"{value:.2f}".rstrip("0").rstrip(".")
+
+
+def rewrite_fields(text: str, edits: Dict[int, Dict[str, float]]) -> str:
+    """
+    Replace field values in place.  `edits` maps a step index (as in
+    `parse_txt_plan`) to {field: new value}; fields the step does not state
+    are skipped and all other text is left untouched.
+    """
+    p = PlanStreamParser(spans=True)
+    steps = p.feed(text) + p.close()
+    subs = sorted((steps[i]["_spans"][k] + (_fmt(v),)
+                   for i, fields in edits.items() for k, v in fields.items()
+                   if k in steps[i]["_spans"]), reverse=True)     # right to left within a line
+    lines = text.split("\n")
+    for ln, a, b, v in subs:
+        lines[ln] = lines[ln][:a] + v + lines[ln][b:]
+    return "\n".join(lines)
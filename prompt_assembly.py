@@ -0,0 +1,139 @@
+# prompt_assembly.py
+"""Token-aware assembly of the prompts sent to the LLM.
+
+A prompt is a list of `Section`s (heading line + text).  `assemble()`
+  • drops paragraphs already sent in an earlier section (a tool table given
+    twice, overlapping RAG chunks …)
+  • trims sections with a `budget` to that many tokens, whole paragraphs at a
+    time, keeping the first (best-ranked) ones
+  • counts the tokens of every section – with tiktoken, or ≈ chars / 4 when
+    the encoding cannot be loaded (offline)
+and returns the text together with a per-section report.
+
+Usage:
+    p = assemble([Section("## Process plan", plan_txt, dedup=False),
+                  Section("## Contextual information", ctx, budget=CONTEXT_BUDGET)])
+    p.text, p.tokens, p.report()
+"""
+from __future__ import annotations
+import logging, os, re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional
+
+log = logging.getLogger(__name__)
+
+# ---------------------------------------------------------------------------
+# CONFIG
+# ---------------------------------------------------------------------------
+CONTEXT_BUDGET = int(os.getenv("PROMPT_CONTEXT_TOKENS", "2000"))   # retrieved context per prompt
+_ENCODING = "o200k_base"          # gpt-4o / gpt-4o-mini
+_MIN_DEDUP_CHARS = 40             # shorter paragraphs (headings, "---") are never dropped
+
+_PARAGRAPH = re.compile(r"\n\s*\n")
+
+
+@lru_cache(maxsize=1)
+def _encoder():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(_ENCODING)
+    except Exception as exc:          # not installed, or the encoding file cannot be downloaded
+        log.warning("tiktoken unavailable (%s) – estimating tokens as chars/4.", type(exc).__name__)
+        return None
+
+
+def count_tokens(text: str) -> int:
+    enc = _encoder()
+    return len(enc.encode(text, disallowed_special=())) if enc else (len(text) + 3) // 4
+
+
+@dataclass
+class Section:
+    heading: str                      # e.g. "## Process plan"; "" for none
+    text: str
+    budget: Optional[int] = None      # max tokens of the text
+    dedup: bool = True                # drop paragraphs seen in earlier sections
+
+
+@dataclass
+class Prompt:
+    text: str
+    sections: List[Dict] = field(default_factory=list)   # heading, tokens, duplicates, trimmed
+
+    @property
+    def tokens(self) -> int:
+        return count_tokens(self.text)
+
+    def report(self) -> str:
+        """One line: tokens per section, duplicates dropped and paragraphs trimmed."""
+        parts = []
+        for s in self.sections:
+            extra = [f"{s['duplicates']} dup"] if s["duplicates"] else []
+            extra += [f"{s['trimmed']} trimmed"] if s["trimmed"] else []
+            name = s["heading"].lstrip("# ") or "(intro)"
+            parts.append(f"{name} {s['tokens']}" + (f" ({', '.join(extra)})" if extra else ""))
+        return f"{self.tokens} tokens: " + " · ".join(parts)
+
+
+def _key(paragraph: str) -> str:
+    return " ".join(paragraph.split()).lower()
+
+
+def _fit(paragraphs: List[str], budget: int) -> List[str]:
+    kept, used = [], 0
+    for p in paragraphs:
+        used += count_tokens(p) + 1
+        if used > budget:
+            break
+        kept.append(p)
+    return kept
+
+
+def assemble(sections: Iterable[Section]) -> Prompt:
+    seen: set = set()
+    blocks: List[str] = []
+    rows: List[Dict] = []
+    for sec in sections:
+        kept, keys, dups = [], set(), 0
+        for p in _PARAGRAPH.split(sec.text.strip()):
+            if not p.strip():
+                continue
+            k = _key(p)
+            if len(k) >= _MIN_DEDUP_CHARS:
+                if sec.dedup and (k in seen or k in keys):
+                    dups += 1
+                    continue
+                keys.add(k)
+            kept.append(p)
+        n_kept = len(kept)
+        if sec.budget is not None:
+            kept = _fit(kept, sec.budget)
+        seen.update(_key(p) for p in kept)      # only what is actually sent
+        if not kept:
+            continue
+        block = "\n\n".join(kept)
+        if sec.heading:
+            block = f"{sec.heading}\n{block}"
+        blocks.append(block)
+        rows.append({"heading": sec.heading, "tokens": count_tokens(block),
+                     "duplicates": dups, "trimmed": n_kept - len(kept)})
+    return Prompt("\n\n".join(blocks), rows)
+
+
+def relevant_tools(tools: List[Dict], steps: List[Dict]) -> List[Dict]:
+    """
+    Tool-library rows worth sending with a plan: the tools its steps use, plus
+    every tool of the same type as a failing step's tool (the candidates for a
+    swap).  A failing step with an unknown tool keeps the whole library.
+    """
+    by_id = {t.get("id"): t for t in tools}
+    used = {st.get("tool_id") for st in steps}
+    swap_types = set()
+    for st in steps:
+        if not st.get("ok", True):
+            tool = by_id.get(st.get("tool_id"))
+            if tool is None:
+                return list(tools)
+            swap_types.add(tool.get("type"))
+    return [t for t in tools if t.get("id") in used or t.get("type") in swap_types]
@@ -4,8 +4,10 @@ Returns a rich system/user prompt that:
 - Describes the part & user intent
 - Injects all relevant machine capabilities
 - Lists full tool library with critical data (diameter, flutes, coating, LOC…) 
-- Asks the LLM to CHECK manufacturability (envelope, weight, reach, power/torque, axis limits…)
+- Asks the LLM to CHECK manufacturability (envelope, weight, reach, axis limits…); spindle
+  power / torque are computed by the validator (`mechanics.py`)
 """
+from __future__ import annotations
 from typing import Dict, List
 import textwrap
 
@@ -24,12 +26,19 @@ def _fmt_tool_list(tools: List[Dict]) -> str:
 
 
 
-def build_process_prompt(description: str, machine: Dict) -> str:
-    """Return a detailed prompt string for CAM reasoning."""
+def build_machine_block(machine: Dict, tools: List[Dict] | None = None) -> str:
+    """Machine specifications + tool table (`tools` defaults to the whole library).
+    Memoized on a `machine_registry.MachineSpec`."""
+    if hasattr(machine, "prompt_block"):
+        return machine.prompt_block(tools)
+    return render_machine_block(machine, tools)
+
 
-    tool_block = _fmt_tool_list(machine.get("tool_library", []))
+def render_machine_block(machine: Dict, tools: List[Dict] | None = None) -> str:
 
-    machine_block = textwrap.dedent(f"""
+    tool_block = _fmt_tool_list(machine.get("tool_library", []) if tools is None else tools)
+
+    return textwrap.dedent(f"""
     ### CNC Machine Specifications
     Name: {machine.get('name','')}
     Axes: {machine.get('axes','')}
@@ -55,12 +64,18 @@ def build_process_prompt(description: str, machine: Dict) -> str:
     {tool_block}
     """).strip()
 
+
+def build_process_prompt(description: str, machine: Dict) -> str:
+    """Return a detailed prompt string for CAM reasoning."""
+
+    machine_block = build_machine_block(machine)
+
     manufacturability = textwrap.dedent("""
     ### Manufacturability checks (MUST perform before outputting plan)
     1. Envelope: Confirm the part bounding box fits within machine XYZ travel (include any rotary table tilt).
     2. Weight: Ensure workpiece weight ≤ machine limit.
     3. Tool reach: Compare pocket depth / wall height vs available LOC; suggest alternative tool if too short.
-    4. Spindle capability: Ensure required torque / power for roughing ops ≤ machine limits.
+    4. Spindle capability: cutting power, torque and drill thrust are computed from your n / Vf / ap / ae by the validator – state the parameters, no need to calculate them.
     5. Axis limits & collisions: Consider fixture height and rotary axes when planning 5 axis moves.
     6. Material compatibility: Apply appropriate cutting data from formulary for specified material.
     If ANY check fails, explain the issue and propose mitigations (different setup, smaller cutter, etc.).
@@ -0,0 +1,143 @@
+# response_cache.py
+"""Persistent cache of LLM chat responses (SQLite).
+
+Entries are keyed by a stable hash of (model, messages, parameters) in which
+every inline image is replaced by the sha256 of its decoded bytes, so the key
+does not depend on how the image was base64-labelled.  The store has a
+per-entry TTL and is bounded by entry count and total size (LRU eviction).
+
+Usage:
+    python response_cache.py stats     # hit/miss counters, size
+    python response_cache.py clear
+"""
+from __future__ import annotations
+import base64, hashlib, json, sqlite3, threading, time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from cache_paths import cache_dir
+
+# ---------------------------------------------------------------------------
+# CONFIG
+# ---------------------------------------------------------------------------
+_DB_PATH = cache_dir("responses.sqlite")
+_MAX_ENTRIES = 20_000
+_MAX_BYTES = 200 * 1024 * 1024               # stored response text
+_TTL = 30 * 24 * 3600.0                      # seconds; None = never expires
+
+
+def image_digest(data_url: str) -> str:
+    """sha256 of the image bytes behind a data URL (or of the URL itself)."""
+    if data_url.startswith("data:") and "," in data_url:
+        raw = base64.b64decode(data_url.split(",", 1)[1])
+    else:
+        raw = data_url.encode("utf-8")
+    return "sha256:" + hashlib.sha256(raw).hexdigest()
+
+
+def _normalise(messages: List[Dict]) -> List[Dict]:
+    out = []
+    for m in messages:
+        content = m.get("content")
+        if isinstance(content, list):
+            content = [
+                {**c, "image_url": {**c["image_url"], "url": image_digest(c["image_url"]["url"])}}
+                if c.get("type") == "image_url" else c
+                for c in content
+            ]
+        out.append({**m, "content": content})
+    return out
+
+
+def request_key(model: str, messages: List[Dict], **params) -> str:
+    blob = json.dumps({"model": model, "messages": _normalise(messages), "params": params},
+                      sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """key -> response text, with TTL, LRU eviction and hit/miss counters."""
+
+    def __init__(self, path: Path | str = _DB_PATH, max_entries: int = _MAX_ENTRIES,
+                 max_bytes: int = _MAX_BYTES, ttl: Optional[float] = _TTL):
+        self.path = Path(path)
+        self.max_entries, self.max_bytes, self.ttl = max_entries, max_bytes, ttl
+        self.hits = self.misses = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path.as_posix(), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, expires REAL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses(last_used)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)")
+        self._db.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, expires FROM responses WHERE key=?",
+                                   (key,)).fetchone()
+            if row and row[1] is not None and row[1] < now:
+                self._db.execute("DELETE FROM responses WHERE key=?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._db.execute("UPDATE responses SET last_used=? WHERE key=?", (now, key))
+            self._db.execute(
+                "INSERT INTO counters VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET value=value+1",
+                ("hits" if row else "misses",))
+            self._db.commit()
+        return row[0] if row else None
+
+    def put(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        expires = now + ttl if ttl else None
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?,?,?,?,?,?)",
+                             (key, value, len(value.encode("utf-8")), now, expires, now))
+            self._evict(now)
+            self._db.commit()
+
+    def _evict(self, now: float) -> None:
+        self._db.execute("DELETE FROM responses WHERE expires IS NOT NULL AND expires < ?", (now,))
+        count, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size),0) FROM responses").fetchone()
+        if count <= self.max_entries and size <= self.max_bytes:
+            return
+        for key, sz in self._db.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall():
+            if count <= self.max_entries and size <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM responses WHERE key=?", (key,))
+            count, size = count - 1, size - sz
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._db.execute("DELETE FROM counters")
+            self._db.commit()
+
+    def stats(self) -> Dict:
+        """Counters of this process (`hits`, `misses`) and of the store's lifetime (`total_*`)."""
+        with self._lock:
+            count, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size),0) FROM responses").fetchone()
+            totals = dict(self._db.execute("SELECT name, value FROM counters").fetchall())
+        return {"hits": self.hits, "misses": self.misses,
+                "total_hits": totals.get("hits", 0), "total_misses": totals.get("misses", 0),
+                "entries": count, "bytes": size}
+
+
+if __name__ == "__main__":
+    import argparse
+    cli = argparse.ArgumentParser(description="LLM response cache maintenance")
+    cli.add_argument("cmd", choices=["stats", "clear"])
+    a = cli.parse_args()
+    cache = ResponseCache()
+    if a.cmd == "clear":
+        cache.clear()
+    print(cache.stats())
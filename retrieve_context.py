@@ -1,63 +1,306 @@
 # retrieve_context.py
 """RAG helper: index `CAM.txt` and fetch the most relevant chunks.
 
+CAM.txt is split along its section headers (`formulary_chunker`), so tables
+and equation groups stay whole and every chunk carries section / process /
+operation / material metadata; `RAG_CHUNKER=recursive` restores the old
+fixed-size 1000-character windows.
+
+The FAISS index in `vectorstore/` is reused across runs.  A small manifest
+(`vectorstore/manifest.json`) records the CAM.txt hash, chunking parameters and
+embedding model used to build it; the index is only rebuilt when one of them
+changes, and then only the chunks whose text changed are re-embedded.
+Chunk and query embeddings also go through the on-disk `embedding_cache`, so
+the same text is never sent to the embedding API twice.
+
+Retrieval modes (`RAG_MODE`, or `mode=` per call):
+    vector   FAISS similarity with OpenAI embeddings (one query embedding call)
+    bm25     lexical BM25 only
+    local    BM25 fused with local TF-IDF vectors – no network at all
+    hybrid   BM25 fused with FAISS (default); falls back to `local` when the
+             embedding endpoint cannot be reached, and tries it again a minute later
+The lexical / local indexes (`hybrid_retrieval`) are built in memory from the
+same chunks, which are kept in `vectorstore/chunks.json`.
+
+Nothing is loaded at import time: the index is opened on the first query, or
+up front with `warm_up()`.
+
+Filters (`process=`, `operation=`, `material=`) drop chunks specific to
+another process, strategy or ISO class; `material=` also narrows ISO tables
+to that class's rows.
+
 Usage:
-    from retrieve_context import get_relevant_context
+    from retrieve_context import get_relevant_context, search
     context_chunks = get_relevant_context("milling pocket aluminium", k=3)
+    context_chunks = get_relevant_context("fz roughing steel", k=3, mode="local")
+    hits = search("fz roughing", k=3, process=("milling", "drilling"), material="N")
+    [(c.section, c.text) for c in hits]
 """
+from __future__ import annotations
+import hashlib
+import json
+import logging
 import os
-import shutil
+import time
 from pathlib import Path
-from typing import List
-from dotenv import load_dotenv
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional
+
+import tracing
+from formulary_chunker import CHUNK_MAX_CHARS, CHUNKER_VERSION, Chunk, chunk_formulary
+
+if TYPE_CHECKING:                            # LangChain is imported on first use
+    from langchain_community.vectorstores import FAISS
+
+log = logging.getLogger(__name__)
 
 # ---------------------------------------------------------------------------
 # CONFIG
 # ---------------------------------------------------------------------------
 _DOC_PATH = Path("CAM.txt")                  # technical formulary
-_INDEX_DIR = Path("vectorstore")             # persistent FAISS folder
-_CHUNK_SIZE = 1000                           # characters per chunk
-_CHUNK_OVERLAP = 100                         # overlap for better context
+_INDEX_DIR = Path(os.getenv("RAG_INDEX_DIR", "vectorstore"))  # persistent FAISS folder
+_MANIFEST = _INDEX_DIR / "manifest.json"     # what the index was built from
+_CHUNKER = os.getenv("RAG_CHUNKER", "sections")  # sections | recursive
+_CHUNK_SIZE = 1000                           # characters per chunk (recursive)
+_CHUNK_OVERLAP = 100                         # overlap for better context (recursive)
+_EMBED_MODEL = "text-embedding-ada-002"      # OpenAI embedding model
+_CHUNKS_FILE = _INDEX_DIR / "chunks.json"    # chunks + metadata, for the in-memory indexes
+MODES = ("vector", "bm25", "local", "hybrid")
+_MODE = os.getenv("RAG_MODE", "hybrid")      # default retrieval mode
+_VECTOR_RETRY_S = 60.0                       # after an embedding failure, `hybrid` uses `local` this long
 
 # ---------------------------------------------------------------------------
-# INITIALISE (load env, embeddings)
+# INITIALISE (load env, embeddings) – lazily
 # ---------------------------------------------------------------------------
-load_dotenv()
-_embeddings = OpenAIEmbeddings()
+_embeddings = None
+_vectorstore = None
+_local = None                                # (chunks, BM25Index, LocalEmbedder)
+_vector_down = 0.0                           # time.monotonic() of the last embedding failure, 0 = up
+
+
+def _get_embeddings():
+    global _embeddings
+    if _embeddings is None:
+        from dotenv import load_dotenv
+        from embedding_cache import CachedEmbeddings, TransportEmbeddings
+
+        load_dotenv()
+        # shared pooled / rate-limited transport; chunks are far below the model's context
+        _embeddings = CachedEmbeddings(TransportEmbeddings(_EMBED_MODEL), model=_EMBED_MODEL)
+    return _embeddings
 
 # ---------------------------------------------------------------------------
 # BUILD OR LOAD INDEX
 # ---------------------------------------------------------------------------
 
-def _build_index() -> FAISS:
-    """Create FAISS index from `CAM.txt`. Saved for later reuse."""
-    if not _DOC_PATH.exists():
-        raise FileNotFoundError(f"Formulary file not found: {_DOC_PATH}")
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _chunking() -> str:
+    if _CHUNKER == "recursive":
+        return f"recursive-{_CHUNK_SIZE}-{_CHUNK_OVERLAP}"
+    return f"sections-v{CHUNKER_VERSION}-{CHUNK_MAX_CHARS}"
+
+
+def _wanted_manifest(text: str) -> Dict:
+    """Manifest fields that must match for the stored index to be reusable."""
+    return {
+        "doc_sha256": _sha256(text),
+        "chunking": _chunking(),
+        "embedding_model": _EMBED_MODEL,
+    }
+
+
+def _read_manifest() -> Dict:
+    try:
+        return json.loads(_MANIFEST.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def _load_index() -> Optional[FAISS]:
+    from langchain_community.vectorstores import FAISS
+
+    if not (_INDEX_DIR / "index.faiss").exists():
+        return None
+    try:
+        return FAISS.load_local(_INDEX_DIR.as_posix(), _get_embeddings(),
+                                allow_dangerous_deserialization=True)
+    except Exception as exc:                 # corrupt / incompatible pickle
+        log.warning("Could not load %s (%s) – rebuilding.", _INDEX_DIR, exc)
+        return None
+
+
+def _stored_vectors(store: FAISS) -> Dict[str, List[float]]:
+    """Map chunk hash -> embedding for every chunk already in `store`."""
+    vectors = {}
+    for pos, doc_id in store.index_to_docstore_id.items():
+        doc = store.docstore.search(doc_id)
+        if hasattr(doc, "page_content"):
+            vectors[_sha256(doc.page_content)] = store.index.reconstruct(pos).tolist()
+    return vectors
+
+
+def _split(text: str) -> List[Chunk]:
+    if _CHUNKER != "recursive":
+        return chunk_formulary(text)
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
 
-    text = _DOC_PATH.read_text(encoding="utf-8")
     splitter = RecursiveCharacterTextSplitter(
         chunk_size=_CHUNK_SIZE,
         chunk_overlap=_CHUNK_OVERLAP,
     )
-    docs = splitter.create_documents([text])
+    return [Chunk(d.page_content) for d in splitter.create_documents([text])]
+
 
-    store = FAISS.from_documents(docs, _embeddings)
+def _build_index(text: str, previous: Optional[FAISS] = None) -> FAISS:
+    """Create FAISS index from `CAM.txt`, re-embedding only chunks not in `previous`."""
+    from langchain_community.vectorstores import FAISS
+
+    chunks = [c.text for c in _load_chunks(text)]
+    hashes = [_sha256(c) for c in chunks]
+
+    known = _stored_vectors(previous) if previous is not None else {}
+    missing = [i for i, h in enumerate(hashes) if h not in known]
+    fresh = _get_embeddings().embed_documents([chunks[i] for i in missing]) if missing else []
+    known.update({hashes[i]: vec for i, vec in zip(missing, fresh)})
+    log.info("Index rebuild: %d chunks, %d re-embedded.", len(chunks), len(missing))
+
+    store = FAISS.from_embeddings([(c, known[h]) for c, h in zip(chunks, hashes)], _get_embeddings())
     store.save_local(_INDEX_DIR.as_posix())
     return store
 
-_vectorstore = _build_index()
+
+def _load_or_build_index() -> FAISS:
+    """Load the persisted index if the manifest matches, else (incrementally) rebuild it."""
+    if not _DOC_PATH.exists():
+        raise FileNotFoundError(f"Formulary file not found: {_DOC_PATH}")
+
+    text = _DOC_PATH.read_text(encoding="utf-8")
+    wanted = _wanted_manifest(text)
+    current = _read_manifest()
+    if all(current.get(k) == v for k, v in wanted.items()):
+        store = _load_index()
+        if store is not None:
+            return store
+
+    # vectors can only be reused if they come from the same embedding model
+    previous = _load_index() if current.get("embedding_model") == _EMBED_MODEL else None
+    store = _build_index(text, previous)
+    _MANIFEST.write_text(json.dumps({**wanted, "chunks": store.index.ntotal}, indent=2),
+                         encoding="utf-8")
+    return store
+
+
+def _get_store() -> FAISS:
+    global _vectorstore
+    if _vectorstore is None:
+        _vectorstore = _load_or_build_index()
+    return _vectorstore
+
+
+def _load_chunks(text: str) -> List[Chunk]:
+    """Chunks of `text`, from `chunks.json` when it was split the same way."""
+    wanted = _wanted_manifest(text)
+    wanted.pop("embedding_model")
+    try:
+        saved = json.loads(_CHUNKS_FILE.read_text(encoding="utf-8"))
+        if all(saved.get(k) == v for k, v in wanted.items()):
+            return [Chunk.from_dict(d) for d in saved["chunks"]]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    chunks = _split(text)
+    _INDEX_DIR.mkdir(parents=True, exist_ok=True)
+    _CHUNKS_FILE.write_text(json.dumps({**wanted, "chunks": [c.to_dict() for c in chunks]},
+                                       ensure_ascii=False), encoding="utf-8")
+    return chunks
+
+
+def _get_local():
+    global _local
+    if _local is None:
+        from hybrid_retrieval import BM25Index, LocalEmbedder
+
+        if not _DOC_PATH.exists():
+            raise FileNotFoundError(f"Formulary file not found: {_DOC_PATH}")
+        chunks = _load_chunks(_DOC_PATH.read_text(encoding="utf-8"))
+        texts = [c.text for c in chunks]
+        _local = (chunks, BM25Index(texts), LocalEmbedder(texts))
+    return _local
+
+
+def _faiss_rank(query: str, chunks: List[Chunk]) -> List[int]:
+    """FAISS ranking of every chunk."""
+    docs = _get_store().similarity_search(query, k=len(chunks))
+    pos = {c.text: i for i, c in enumerate(chunks)}
+    return [pos[d.page_content] for d in docs if d.page_content in pos]
+
+
+def _mark_vector_down(exc: Exception) -> None:
+    global _vector_down
+    log.warning("Vector search unavailable (%s) – using local embeddings for %.0f s.",
+                type(exc).__name__, _VECTOR_RETRY_S)
+    _vector_down = time.monotonic()
+
+
+def _vector_rank(query: str, chunks: List[Chunk]) -> Optional[List[int]]:
+    """`_faiss_rank`, or None while the embedding endpoint is unreachable (retried after a cooldown)."""
+    global _vector_down
+    if _vector_down and time.monotonic() - _vector_down < _VECTOR_RETRY_S:
+        return None
+    try:
+        ids = _faiss_rank(query, chunks)
+    except Exception as exc:
+        _mark_vector_down(exc)
+        return None
+    _vector_down = 0.0
+    return ids
+
+
+def warm_up(mode: Optional[str] = None) -> None:
+    """Open (or build) the indexes instead of on the first query.
+
+    In `hybrid` mode an unreachable embedding endpoint is not an error: queries
+    use `local` until it answers again.
+    """
+    mode = mode or _MODE
+    _get_local()
+    if mode == "vector":
+        _get_store()
+    elif mode == "hybrid":
+        try:
+            _get_store()
+        except Exception as exc:
+            _mark_vector_down(exc)
 
 # ---------------------------------------------------------------------------
 # PUBLIC API
 # ---------------------------------------------------------------------------
 
-def get_relevant_context(query: str, k: int = 4) -> List[str]:
+def search(query: str, k: int = 4, mode: Optional[str] = None,
+           process: Optional[Iterable[str] | str] = None, operation: Optional[str] = None,
+           material: Optional[str] = None) -> List[Chunk]:
+    """The `k` best chunks (with metadata) that pass the filters."""
+    mode = mode or _MODE
+    if mode not in MODES:
+        raise ValueError(f"Unknown retrieval mode {mode!r} (one of {', '.join(MODES)})")
+    chunks, bm25, local = _get_local()
+    if mode == "vector":
+        ids = _faiss_rank(query, chunks)
+    elif mode == "bm25":
+        ids = bm25.rank(query)
+    else:
+        from hybrid_retrieval import rrf_fuse
+        vector = _vector_rank(query, chunks) if mode == "hybrid" else None
+        ids = rrf_fuse([bm25.rank(query), vector if vector is not None else local.rank(query)])
+    hits = [chunks[i] for i in ids if chunks[i].matches(process, operation, material)]
+    return [c.for_material(material) for c in hits[:k]]
+
+
+@tracing.traced()
+def get_relevant_context(query: str, k: int = 4, mode: Optional[str] = None, **filters) -> List[str]:
     """Return `k` most relevant chunks from the formulary for a given query."""
-    docs = _vectorstore.similarity_search(query, k=k)
-    return [d.page_content for d in docs]
+    return [c.text for c in search(query, k, mode, **filters)]
 
 if __name__ == "__main__":
     # quick CLI test
@@ -0,0 +1,417 @@
+# service.py
+"""Long-lived planning service: warm state, a bounded LLM job queue, JSON over HTTP.
+
+Started once, it loads the formulary, the retrieval index, every machine in
+`machines/` and the API client, and keeps them for every request:
+    POST /validate         {plan, machine, material}                  → steps, issues, score
+    POST /optimise/params  {plan, machine, material, objective?}      → plan, changes
+    POST /geometry         {drawing | image}                          → geometry, missing fields
+    POST /plan             {drawing | image, machine, material, goal?} → plan, validation
+    POST /optimise         {plan, machine, material, goal?, drawing | image?, candidates?}
+                                                                      → one regeneration round
+    GET  /health           warm-up times, queue depth
+    GET  /metrics          requests, errors, p50 / p95 of the answered ones per route, queue,
+                           LLM usage, transport
+`machine` is a file stem in machines/, a path, a machine name or the spec itself
+(a JSON object); `drawing` a file on the server, `image` a data URL.
+
+The first two are local (no LLM) and run at once on a pool of `--cpu`
+threads.  The LLM routes are jobs in a queue of `--queue` entries served by
+`--workers` tasks, each with its own thread – LLM jobs waiting on the API never
+hold up the local routes.  A full queue answers 503 with Retry-After (the
+recent job time × queue depth / workers), so clients back off instead of piling
+up, and a job that waited longer than its `timeout` (seconds, default
+`--timeout`) is dropped with 504.  Errors are JSON too: 400 for a bad request,
+500 for a failed job.
+
+Usage:
+    python service.py --port 8080 [--workers 8] [--queue 64] [--base-url http://127.0.0.1:8765/v1]
+    curl -s localhost:8080/validate -d '{"plan": "…", "machine": "haas_umc_1000", "material": "aluminium"}'
+    curl -s localhost:8080/metrics
+"""
+from __future__ import annotations
+import argparse, asyncio, json, logging, math, os, statistics, time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import tracing
+
+# ---------------------------------------------------------------------------
+# CONFIG
+# ---------------------------------------------------------------------------
+WORKERS = 8                        # concurrent LLM jobs
+QUEUE_SIZE = 64                    # LLM jobs waiting, beyond that: 503
+CPU_SLOTS = os.cpu_count() or 4    # concurrent local requests
+JOB_TIMEOUT = 300.0                # seconds a job may wait + run
+MAX_CANDIDATES = 8                 # regenerations one /optimise request may ask for
+MAX_BODY = 32 * 2**20              # bytes; drawings come as data URLs
+_LATENCY_WINDOW = 1000             # recent latencies kept per route
+
+log = logging.getLogger(__name__)
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable",
+            504: "Gateway Timeout"}
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.status, self.headers = status, headers or {}
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Handlers (blocking; run in worker threads on the warm modules)
+# ─────────────────────────────────────────────────────────────────────────────
+def _field(p: Dict, name: str, kind: type | Tuple[type, ...] = str) -> Any:
+    if name not in p:
+        raise HttpError(400, f"missing field {name!r}")
+    if not isinstance(p[name], kind):
+        raise HttpError(400, f"field {name!r} has the wrong type ({type(p[name]).__name__})")
+    return p[name]
+
+
+def _text(p: Dict, name: str, default: str = "") -> str:
+    """An optional string field."""
+    return _field(p, name) if p.get(name) is not None else default
+
+
+def _number(p: Dict, name: str, default: float, lo: float, hi: float = math.inf,
+            integer: bool = False) -> float:
+    """An optional numeric field, checked against [lo, hi]."""
+    v = p.get(name, default)
+    if isinstance(v, bool) or not isinstance(v, (int, float)) or not lo <= v <= hi \
+            or (integer and v != int(v)):
+        kind = "an integer" if integer else "a number"
+        raise HttpError(400, f"field {name!r} must be {kind} in [{lo:g}, {hi:g}], not {v!r}")
+    return int(v) if integer else float(v)
+
+
+def _machine(p: Dict):
+    from machine_registry import load_machine, parse_machine
+    ref = _field(p, "machine", (str, dict))
+    try:
+        return parse_machine(ref) if isinstance(ref, dict) else load_machine(ref)
+    except (FileNotFoundError, KeyError, TypeError, ValueError) as exc:
+        raise HttpError(400, f"bad machine: {exc}") from None
+
+
+def _image(p: Dict, required: bool = True):
+    import pipeline
+    if _text(p, "image"):
+        return p["image"]
+    if _text(p, "drawing"):
+        try:
+            return pipeline.load_drawing(p["drawing"])
+        except FileNotFoundError as exc:
+            raise HttpError(400, str(exc)) from None
+    if required:
+        raise HttpError(400, "give a 'drawing' path or an 'image' data URL")
+    return None
+
+
+def _report(steps) -> Dict:
+    return {"steps": len(steps), "failing_steps": sum(not st["ok"] for st in steps),
+            "issues": [{"step": st["step"], "ok": st["ok"], "issues": st["issues"]} for st in steps]}
+
+
+def validate(p: Dict) -> Dict:
+    from cam_optimizer import score_plan
+    score, steps = score_plan(_field(p, "plan"), _machine(p), _field(p, "material"))
+    return {"score": score if math.isfinite(score) else None, **_report(steps)}
+
+
+def optimise_params(p: Dict) -> Dict:
+    from param_optimizer import OBJECTIVES, optimise_parameters
+    objective = _text(p, "objective", "mrr")
+    if objective not in OBJECTIVES:
+        raise HttpError(400, f"objective must be one of {OBJECTIVES}")
+    plan, changes = optimise_parameters(_field(p, "plan"), _machine(p), _field(p, "material"), objective)
+    return {"plan": plan, "changes": changes}
+
+
+def geometry(p: Dict) -> Dict:
+    from dimension_extractor import extract_geometry, missing_fields
+    geo = extract_geometry(_image(p), False, True, _text(p, "drawing") or None)
+    return {"geometry": geo, "missing": missing_fields(geo)}
+
+
+def plan(p: Dict) -> Dict:
+    import affordance_validator as av
+    import pipeline
+    from dimension_extractor import extract_geometry, missing_fields, summary_text
+    machine, material, image = _machine(p), _field(p, "material"), _image(p)
+    geo = extract_geometry(image, False, True, _text(p, "drawing") or None)
+    desc = pipeline.describe_job(_text(p, "goal"), material, summary_text(geo))
+    ctx = pipeline.retrieve_job_context(desc, material)
+    text = pipeline.generate_plan(pipeline.build_plan_prompt(desc, machine, ctx), image)
+    return {"plan": text, "geometry": geo, "missing": missing_fields(geo),
+            "validation": _report(av.validate_plan(text, machine, material))}
+
+
+def optimise(p: Dict) -> Dict:
+    import pipeline
+    from cam_optimizer import optimise_round
+    machine, material, goal = _machine(p), _field(p, "material"), _text(p, "goal")
+    plan_txt, candidates = _field(p, "plan"), _number(p, "candidates", 1, 1, MAX_CANDIDATES, integer=True)
+    ctx = pipeline.retrieve_job_context(goal, material) if goal else []
+    best, changes = optimise_round(plan_txt, goal, machine, material, _image(p, required=False),
+                                   "\n\n".join(ctx), candidates)
+    return {"plan": best.plan, "score": best.score if math.isfinite(best.score) else None,
+            "failing_steps": best.failing, "label": best.label, "changes": changes}
+
+
+ROUTES: Dict[Tuple[str, str], Tuple[str, Callable[[Dict], Dict]]] = {
+    ("POST", "/validate"): ("local", validate),
+    ("POST", "/optimise/params"): ("local", optimise_params),
+    ("POST", "/geometry"): ("llm", geometry),
+    ("POST", "/plan"): ("llm", plan),
+    ("POST", "/optimise"): ("llm", optimise),
+}
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Service
+# ─────────────────────────────────────────────────────────────────────────────
+class Metrics:
+    def __init__(self):
+        self.started = time.time()
+        self.requests: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.latency: Dict[str, deque] = {}
+        self.rejected = self.timed_out = 0
+        self.job_s: deque = deque(maxlen=100)        # recent LLM job run times
+
+    def observe(self, route: str, seconds: float, status: int) -> None:
+        self.requests[route] = self.requests.get(route, 0) + 1
+        if status >= 400:                                # rejected / failed: not a latency sample
+            self.errors[route] = self.errors.get(route, 0) + 1
+            return
+        self.latency.setdefault(route, deque(maxlen=_LATENCY_WINDOW)).append(seconds)
+
+    def routes(self) -> Dict[str, Dict]:
+        out = {}
+        for route, n in sorted(self.requests.items()):
+            lat = sorted(self.latency.get(route, ()))
+            out[route] = {"requests": n, "errors": self.errors.get(route, 0),
+                          "p50_ms": round(statistics.median(lat) * 1000, 2) if lat else None,
+                          "p95_ms": round(lat[int(round(0.95 * (len(lat) - 1)))] * 1000, 2) if lat else None}
+        return out
+
+
+class PlanningService:
+    def __init__(self, workers: int = WORKERS, queue_size: int = QUEUE_SIZE, cpu: int = CPU_SLOTS,
+                 timeout: float = JOB_TIMEOUT):
+        self.workers, self.timeout = workers, timeout
+        self.queue: asyncio.Queue = asyncio.Queue(queue_size)
+        # separate pools: blocked LLM jobs must not take the threads of the local routes
+        self._llm_pool = ThreadPoolExecutor(workers, thread_name_prefix="llm-job")
+        self._cpu_pool = ThreadPoolExecutor(cpu, thread_name_prefix="local")
+        self.running = 0
+        self.metrics = Metrics()
+        self.warm_ms: Dict[str, Any] = {}
+        self._tasks: list = []
+
+    def warm_up(self) -> None:
+        """Formulary, retrieval index, machines and API client – timed, before serving."""
+        import llm_client, parse_cam_formulary, retrieve_context
+        from machine_registry import get_registry
+        for name, fn in (("formulary", parse_cam_formulary.warm_up), ("retrieval", retrieve_context.warm_up),
+                         ("machines", lambda: get_registry().all()), ("llm_client", llm_client.warm_up)):
+            t0 = time.perf_counter()
+            try:
+                fn()
+                self.warm_ms[name] = round((time.perf_counter() - t0) * 1000, 1)
+            except Exception as exc:                     # serve the local routes anyway
+                log.warning("warm-up of %s failed: %s", name, exc)
+                self.warm_ms[name] = f"failed: {type(exc).__name__}: {exc}"
+
+    async def start(self) -> None:
+        await asyncio.get_running_loop().run_in_executor(self._cpu_pool, self.warm_up)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for pool in (self._llm_pool, self._cpu_pool):
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _run(route: str, fn: Callable, payload: Dict) -> Dict:
+        with tracing.span("request", route=route):
+            return fn(payload)
+
+    async def _worker(self) -> None:
+        while True:
+            fut, route, fn, payload, deadline = await self.queue.get()
+            try:
+                if fut.cancelled():
+                    continue
+                if time.monotonic() > deadline:
+                    self.metrics.timed_out += 1
+                    fut.set_exception(HttpError(504, "job timed out in the queue"))
+                    continue
+                self.running += 1
+                t0 = time.perf_counter()
+                try:
+                    result = await asyncio.get_running_loop().run_in_executor(
+                        self._llm_pool, self._run, route, fn, payload)
+                    if not fut.done():
+                        fut.set_result(result)
+                except Exception as exc:
+                    if not fut.done():
+                        fut.set_exception(exc)
+                finally:
+                    self.running -= 1
+                    self.metrics.job_s.append(time.perf_counter() - t0)
+            finally:
+                self.queue.task_done()
+
+    def _retry_after(self) -> int:
+        per_job = statistics.mean(self.metrics.job_s) if self.metrics.job_s else 1.0
+        return max(1, math.ceil(per_job * self.queue.qsize() / self.workers))
+
+    async def _submit(self, route: str, fn: Callable, payload: Dict) -> Dict:
+        timeout = _number(payload, "timeout", self.timeout, 0.001, 24 * 3600)
+        fut = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((fut, route, fn, payload, time.monotonic() + timeout))
+        except asyncio.QueueFull:
+            self.metrics.rejected += 1
+            raise HttpError(503, "job queue is full", {"Retry-After": str(self._retry_after())}) from None
+        try:
+            return await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            self.metrics.timed_out += 1
+            raise HttpError(504, f"no result within {timeout:g}s") from None
+
+    def health(self) -> Dict:
+        return {"status": "ok", "uptime_s": round(time.time() - self.metrics.started, 1),
+                "warm_up_ms": self.warm_ms, "queued": self.queue.qsize(), "running": self.running}
+
+    def metrics_report(self) -> Dict:
+        import llm_client
+        from llm_transport import get_transport
+        m = self.metrics
+        return {"uptime_s": round(time.time() - m.started, 1), "routes": m.routes(),
+                "queue": {"queued": self.queue.qsize(), "capacity": self.queue.maxsize, "running": self.running,
+                          "workers": self.workers, "rejected": m.rejected, "timed_out": m.timed_out},
+                "llm": llm_client.usage_totals(), "transport": dict(getattr(get_transport(), "stats", {}))}
+
+    async def handle(self, method: str, path: str, body: bytes) -> Tuple[int, Dict, Dict[str, str]]:
+        """One request → (status, JSON body, extra headers)."""
+        t0 = time.perf_counter()
+        status, headers = 200, {}
+        try:
+            if method == "GET" and path == "/health":
+                out = self.health()
+            elif method == "GET" and path == "/metrics":
+                out = self.metrics_report()
+            else:
+                kind, fn = ROUTES.get((method, path), (None, None))
+                if fn is None:
+                    known = any(p == path for _, p in ROUTES)
+                    raise HttpError(405 if known else 404, f"{method} {path} is not a route")
+                try:
+                    payload = json.loads(body or b"{}")
+                except ValueError as exc:
+                    raise HttpError(400, f"invalid JSON: {exc}") from None
+                if not isinstance(payload, dict):
+                    raise HttpError(400, "the body must be a JSON object")
+                if kind == "local":
+                    out = await asyncio.get_running_loop().run_in_executor(
+                        self._cpu_pool, self._run, path, fn, payload)
+                else:
+                    out = await self._submit(path, fn, payload)
+        except HttpError as exc:
+            status, headers, out = exc.status, exc.headers, {"error": str(exc)}
+        except Exception as exc:
+            log.exception("%s %s failed", method, path)
+            status, out = 500, {"error": f"{type(exc).__name__}: {exc}"}
+        if (method, path) in ROUTES:
+            self.metrics.observe(path, time.perf_counter() - t0, status)
+        return status, out, headers
+
+# ─────────────────────────────────────────────────────────────────────────────
+# HTTP/1.1 (keep-alive, Content-Length bodies)
+# ─────────────────────────────────────────────────────────────────────────────
+def _respond(writer: asyncio.StreamWriter, status: int, out: Dict, extra: Dict[str, str], keep: bool) -> None:
+    data = json.dumps(out, ensure_ascii=False, default=str).encode()
+    head = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}", "Content-Type: application/json",
+            f"Content-Length: {len(data)}", f"Connection: {'keep-alive' if keep else 'close'}"]
+    head += [f"{k}: {v}" for k, v in extra.items()]
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + data)
+
+
+async def _connection(service: PlanningService, reader: asyncio.StreamReader,
+                      writer: asyncio.StreamWriter) -> None:
+    try:
+        while True:
+            line = await reader.readline()
+            if not line.strip():
+                break
+            headers: Dict[str, str] = {}
+            while (h := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                k, _, v = h.decode("latin-1").partition(":")
+                headers[k.strip().lower()] = v.strip()
+            try:
+                method, target, version = line.decode("latin-1").split()
+                size = int(headers.get("content-length") or 0)
+                if size < 0:
+                    raise ValueError
+            except ValueError:                           # the body cannot be found: answer and close
+                _respond(writer, 400, {"error": "malformed request line or Content-Length"}, {}, False)
+                await writer.drain()
+                break
+            if size > MAX_BODY:
+                status, out, extra = 413, {"error": f"body larger than {MAX_BODY} bytes"}, {}
+                keep = False
+            else:
+                body = await reader.readexactly(size) if size else b""
+                status, out, extra = await service.handle(method, target.split("?")[0], body)
+                keep = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+            _respond(writer, status, out, extra, keep)
+            await writer.drain()
+            if not keep:
+                break
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host: str = "127.0.0.1", port: int = 8080, **kwargs) -> None:
+    service = PlanningService(**kwargs)
+    await service.start()
+    server = await asyncio.start_server(lambda r, w: _connection(service, r, w), host, port)
+    print(f"Planning service on http://{host}:{port}  warm-up: "
+          + ", ".join(f"{k} {v} ms" if isinstance(v, float) else f"{k} {v}" for k, v in service.warm_ms.items()))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
+
+
+if __name__ == "__main__":
+    cli = argparse.ArgumentParser(description="Long-lived CAM planning service")
+    cli.add_argument("--host", default="127.0.0.1")
+    cli.add_argument("--port", type=int, default=8080)
+    cli.add_argument("--workers", type=int, default=WORKERS, help="concurrent LLM jobs")
+    cli.add_argument("--queue", type=int, default=QUEUE_SIZE, help="LLM jobs waiting before 503")
+    cli.add_argument("--cpu", type=int, default=CPU_SLOTS, help="concurrent local (no-LLM) requests")
+    cli.add_argument("--timeout", type=float, default=JOB_TIMEOUT, help="seconds per job, queueing included")
+    cli.add_argument("--base-url", help="OpenAI-compatible endpoint, e.g. a local mock server")
+    a = cli.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    if a.base_url:
+        os.environ["OPENAI_BASE_URL"] = a.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "mock")
+    if os.getenv("OPENAI_BASE_URL"):
+        from batch_runner import _isolate_endpoint_caches
+        _isolate_endpoint_caches(os.environ["OPENAI_BASE_URL"])
+    try:
+        asyncio.run(serve(a.host, a.port, workers=a.workers, queue_size=a.queue, cpu=a.cpu, timeout=a.timeout))
+    except KeyboardInterrupt:
+        pass
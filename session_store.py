@@ -0,0 +1,292 @@
+# session_store.py
+"""Persistent optimisation sessions: every round of `optimise_plan` on disk (SQLite).
+
+A session holds what a refinement needs to go on – part description, machine,
+material, drawing (path + sha256), retrieved context – and one row per round:
+    plan text, label, validator score, failing steps, issues per step,
+    sha256 of the regeneration prompt, calls / tokens the round cost,
+    the round it came from, and the alternatives that were on offer.
+Round 0 is the plan the session started from.  A crash, Ctrl-C or closed
+terminal loses at most the round in flight: `--resume` continues from the
+latest round without asking the model again, and `fork` starts a new session
+from any earlier round (its history is copied, so both go on independently).
+Listing reads no plan text; `diff` compares two rounds step by step
+(n / Vf / ap / ae / tool, issues) and as a unified diff.
+
+Usage:
+    from session_store import get_store
+    sid = get_store().create(description, "machines/haas_umc_1000.json", "aluminium", plan_txt)
+    optimise_plan(description, None, machine, material, session=sid)    # records / resumes
+
+    python session_store.py list                       # sessions, newest first
+    python session_store.py show  <session>            # rounds: score, failing, tokens, label
+    python session_store.py diff  <session> 2 5 [-u]   # what changed between rounds
+    python session_store.py plan  <session> [round]    # print a round's plan
+    python session_store.py fork  <session> <round>    # new session continuing from there
+    python session_store.py delete <session>
+    python cam_optimizer.py --resume <session>
+"""
+from __future__ import annotations
+import difflib, hashlib, json, math, sqlite3, threading, time, uuid
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from cache_paths import cache_dir
+
+# ---------------------------------------------------------------------------
+# CONFIG
+# ---------------------------------------------------------------------------
+_DB_PATH = cache_dir("sessions.sqlite")
+_DIFF_FIELDS = ("tool_id", "n", "vf", "ap", "ae")
+
+_SESSION_COLS = ("id", "name", "created", "updated", "description", "machine", "material",
+                 "image_path", "image_sha", "context", "parent", "parent_round")
+_ROUND_COLS = ("session", "n", "created", "label", "score", "failing", "issues", "prompt_sha",
+               "calls", "prompt_tokens", "completion_tokens", "parent", "alternatives")
+
+
+def prompt_sha(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class SessionStore:
+    """session id -> metadata and numbered rounds."""
+
+    def __init__(self, path: Path | str = _DB_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path.as_posix(), check_same_thread=False)
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " id TEXT PRIMARY KEY, name TEXT, created REAL NOT NULL, updated REAL NOT NULL,"
+            " description TEXT, machine TEXT, material TEXT, image_path TEXT, image_sha TEXT,"
+            " context TEXT, parent TEXT, parent_round INTEGER);"
+            "CREATE TABLE IF NOT EXISTS rounds ("
+            " session TEXT NOT NULL, n INTEGER NOT NULL, created REAL NOT NULL, label TEXT,"
+            " score REAL, failing INTEGER, issues TEXT, prompt_sha TEXT, calls INTEGER,"
+            " prompt_tokens INTEGER, completion_tokens INTEGER, parent INTEGER, alternatives TEXT,"
+            " plan TEXT NOT NULL, PRIMARY KEY (session, n));"
+            "CREATE INDEX IF NOT EXISTS sessions_updated ON sessions(updated);"
+        )
+        self._db.commit()
+
+    # -- sessions -------------------------------------------------------------
+    def create(self, description: str, machine: str, material: str, plan: str, *,
+               image_path: Optional[str] = None, image_sha: Optional[str] = None, context: str = "",
+               name: Optional[str] = None, label: str = "initial plan") -> str:
+        """New session with `plan` as round 0; returns its id."""
+        sid, now = uuid.uuid4().hex[:10], time.time()
+        with self._lock:
+            self._db.execute(f"INSERT INTO sessions ({','.join(_SESSION_COLS)}) VALUES ({','.join('?' * 12)})",
+                             (sid, name, now, now, description, str(machine), material, image_path,
+                              image_sha, context, None, None))
+            self._db.commit()
+        self.add_round(sid, plan, label)
+        return sid
+
+    def resolve(self, ref: str) -> str:
+        """Full id from a unique prefix or a session name."""
+        ref = ref.strip()
+        if not ref:
+            raise KeyError("empty session reference")
+        with self._lock:                         # a literal prefix: '%' / '_' are not wildcards
+            rows = self._db.execute("SELECT DISTINCT id FROM sessions WHERE substr(id, 1, ?)=? OR name=?",
+                                    (len(ref), ref, ref)).fetchall()
+        if len(rows) != 1:
+            raise KeyError(f"{'no' if not rows else 'more than one'} session matches {ref!r}")
+        return rows[0][0]
+
+    def session(self, sid: str) -> Dict:
+        with self._lock:
+            row = self._db.execute(f"SELECT {','.join(_SESSION_COLS)} FROM sessions WHERE id=?",
+                                   (sid,)).fetchone()
+        if row is None:
+            raise KeyError(f"no session {sid!r}")
+        return dict(zip(_SESSION_COLS, row))
+
+    def sessions(self, limit: int = 50) -> List[Dict]:
+        """Newest first, with round count and the latest score – no plan text is read."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT s.id, s.name, s.updated, s.machine, s.material, s.parent, COUNT(r.n),"
+                " (SELECT score FROM rounds WHERE session=s.id ORDER BY n DESC LIMIT 1),"
+                " SUM(r.prompt_tokens), SUM(r.completion_tokens)"
+                " FROM sessions s LEFT JOIN rounds r ON r.session=s.id"
+                " GROUP BY s.id ORDER BY s.updated DESC LIMIT ?", (limit,)).fetchall()
+        keys = ("id", "name", "updated", "machine", "material", "parent", "rounds", "score",
+                "prompt_tokens", "completion_tokens")
+        return [dict(zip(keys, r)) for r in rows]
+
+    def delete(self, sid: str) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM rounds WHERE session=?", (sid,))
+            self._db.execute("DELETE FROM sessions WHERE id=?", (sid,))
+            self._db.commit()
+
+    def fork(self, sid: str, n: int, name: Optional[str] = None) -> str:
+        """New session whose history is `sid`'s rounds 0…n; it continues from round n."""
+        src, new, now = self.session(sid), uuid.uuid4().hex[:10], time.time()
+        with self._lock:
+            if not self._db.execute("SELECT 1 FROM rounds WHERE session=? AND n=?", (sid, n)).fetchone():
+                raise KeyError(f"session {sid} has no round {n}")
+            self._db.execute(f"INSERT INTO sessions ({','.join(_SESSION_COLS)}) VALUES ({','.join('?' * 12)})",
+                             (new, name, now, now, *(src[k] for k in _SESSION_COLS[4:10]), sid, n))
+            self._db.execute(f"INSERT INTO rounds SELECT ?,{','.join(_ROUND_COLS[1:])},plan FROM rounds"
+                             " WHERE session=? AND n<=?", (new, sid, n))
+            self._db.commit()
+        return new
+
+    # -- rounds ---------------------------------------------------------------
+    def add_round(self, sid: str, plan: str, label: str = "", *, score: Optional[float] = None,
+                  failing: Optional[int] = None, issues: Optional[List[Dict]] = None,
+                  prompt: Optional[str] = None, usage: Optional[Dict[str, int]] = None,
+                  alternatives: Optional[List[Dict]] = None, parent: Optional[int] = None) -> int:
+        """Append a round (its number is returned).  `issues` are `[{"step", "issues"}]`,
+        `usage` the calls / tokens the round cost, `parent` the round it came from
+        (default: the latest)."""
+        usage = usage or {}
+        now = time.time()
+        with self._lock:
+            last = self._db.execute("SELECT MAX(n) FROM rounds WHERE session=?", (sid,)).fetchone()[0]
+            n = 0 if last is None else last + 1
+            self._db.execute(
+                f"INSERT INTO rounds ({','.join(_ROUND_COLS)},plan) VALUES ({','.join('?' * 14)})",
+                (sid, n, now, label, score if score is None or math.isfinite(score) else None, failing,
+                 json.dumps(issues or [], ensure_ascii=False), prompt_sha(prompt) if prompt else None,
+                 usage.get("calls", 0), usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0),
+                 last if parent is None else parent, json.dumps(alternatives or [], ensure_ascii=False), plan))
+            self._db.execute("UPDATE sessions SET updated=? WHERE id=?", (now, sid))
+            self._db.commit()
+        return n
+
+    def update_round(self, sid: str, n: int, *, score: Optional[float] = None,
+                     failing: Optional[int] = None, issues: Optional[List[Dict]] = None) -> None:
+        """Fill in the validator result of a round stored without one (round 0)."""
+        with self._lock:
+            self._db.execute("UPDATE rounds SET score=?, failing=?, issues=? WHERE session=? AND n=?",
+                             (score if score is None or math.isfinite(score) else None, failing,
+                              json.dumps(issues or [], ensure_ascii=False), sid, n))
+            self._db.commit()
+
+    def rounds(self, sid: str) -> List[Dict]:
+        """Every round without its plan text or alternatives (fast listing)."""
+        cols = _ROUND_COLS[1:-1]
+        with self._lock:
+            rows = self._db.execute(f"SELECT {','.join(cols)} FROM rounds WHERE session=? ORDER BY n",
+                                    (sid,)).fetchall()
+        out = [dict(zip(cols, r)) for r in rows]
+        for r in out:
+            r["issues"] = json.loads(r["issues"] or "[]")
+        return out
+
+    def round(self, sid: str, n: Optional[int] = None) -> Dict:
+        """One round in full (default: the latest)."""
+        cols = _ROUND_COLS[1:] + ("plan",)
+        with self._lock:
+            if n is None:
+                row = self._db.execute(f"SELECT {','.join(cols)} FROM rounds WHERE session=?"
+                                       " ORDER BY n DESC LIMIT 1", (sid,)).fetchone()
+            else:
+                row = self._db.execute(f"SELECT {','.join(cols)} FROM rounds WHERE session=? AND n=?",
+                                       (sid, n)).fetchone()
+        if row is None:
+            raise KeyError(f"session {sid} has no round {n if n is not None else 0}")
+        rec = dict(zip(cols, row))
+        rec["issues"] = json.loads(rec["issues"] or "[]")
+        rec["alternatives"] = json.loads(rec["alternatives"] or "[]")
+        return rec
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+@lru_cache(maxsize=1)
+def get_store() -> SessionStore:
+    return SessionStore()
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Diff
+# ─────────────────────────────────────────────────────────────────────────────
+def diff_rounds(a: Dict, b: Dict, unified: bool = False) -> List[str]:
+    """Lines describing how round `b` differs from round `a` (as from `SessionStore.round`)."""
+    from plan_parser import parse_txt_plan
+    out = []
+    if a["score"] != b["score"] or a["failing"] != b["failing"]:
+        out.append(f"score {a['score']} → {b['score']}, failing steps {a['failing']} → {b['failing']}")
+    steps_a = {st["step"]: st for st in parse_txt_plan(a["plan"])}
+    steps_b = {st["step"]: st for st in parse_txt_plan(b["plan"])}
+    for name in steps_a.keys() - steps_b.keys():
+        out.append(f"- {name}")
+    for name, st in steps_b.items():
+        old = steps_a.get(name)
+        if old is None:
+            out.append(f"+ {name}")
+            continue
+        changed = [f"{k} {old.get(k)} → {st.get(k)}" for k in _DIFF_FIELDS if old.get(k) != st.get(k)]
+        if changed:
+            out.append(f"~ {name}: " + ", ".join(changed))
+    issues_a = {i["step"]: set(i["issues"]) for i in a["issues"]}
+    issues_b = {i["step"]: set(i["issues"]) for i in b["issues"]}
+    for step in dict.fromkeys([*issues_a, *issues_b]):
+        old, new = issues_a.get(step, set()), issues_b.get(step, set())
+        out += [f"  ✓ {step}: {i}" for i in sorted(old - new)]
+        out += [f"  ⚠️ {step}: {i}" for i in sorted(new - old)]
+    if unified:
+        out += [ln.rstrip("\n") for ln in difflib.unified_diff(
+            a["plan"].splitlines(), b["plan"].splitlines(), f"round {a['n']}", f"round {b['n']}", lineterm="")]
+    return out
+
+
+if __name__ == "__main__":
+    import argparse
+    cli = argparse.ArgumentParser(description="Stored optimisation sessions")
+    sub = cli.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("list").add_argument("-n", "--limit", type=int, default=20)
+    for cmd in ("show", "delete"):
+        sub.add_parser(cmd).add_argument("session")
+    s = sub.add_parser("plan")
+    s.add_argument("session")
+    s.add_argument("round", type=int, nargs="?")
+    s = sub.add_parser("diff")
+    s.add_argument("session")
+    s.add_argument("a", type=int)
+    s.add_argument("b", type=int)
+    s.add_argument("-u", "--unified", action="store_true", help="also the line diff of the plan text")
+    s = sub.add_parser("fork")
+    s.add_argument("session")
+    s.add_argument("round", type=int)
+    s.add_argument("--name")
+    a = cli.parse_args()
+
+    store = get_store()
+    try:
+        sid = store.resolve(a.session) if a.cmd != "list" else None
+        if a.cmd == "list":
+            for s in store.sessions(a.limit):
+                when = time.strftime("%Y-%m-%d %H:%M", time.localtime(s["updated"]))
+                fork = f"  (fork of {s['parent']})" if s["parent"] else ""
+                print(f"{s['id']}  {when}  {s['rounds']:3d} rounds  score {s['score']!s:>5s}  "
+                      f"{(s['prompt_tokens'] or 0) + (s['completion_tokens'] or 0):7d} tok  "
+                      f"{Path(s['machine'] or '').stem} / {s['material']}{'  ' + s['name'] if s['name'] else ''}{fork}")
+        elif a.cmd == "show":
+            meta = store.session(sid)
+            print(f"{sid}: {Path(meta['machine'] or '').stem} / {meta['material']}"
+                  + (f", drawing {meta['image_path']}" if meta["image_path"] else ""))
+            for r in store.rounds(sid):
+                print(f"  {r['n']:3d} ← {r['parent'] if r['parent'] is not None else '–':>3}  score {r['score']!s:>5s}  "
+                      f"failing {r['failing']!s:>3s}  {r['calls']} call(s) {r['prompt_tokens'] + r['completion_tokens']:6d} tok"
+                      f"  {r['label'] or ''}")
+        elif a.cmd == "plan":
+            print(store.round(sid, a.round)["plan"])
+        elif a.cmd == "diff":
+            print("\n".join(diff_rounds(store.round(sid, a.a), store.round(sid, a.b), a.unified)) or "no changes")
+        elif a.cmd == "fork":
+            new = store.fork(sid, a.round, a.name)
+            print(f"{new}  (continue with: python cam_optimizer.py --resume {new})")
+        elif a.cmd == "delete":
+            store.delete(sid)
+    except KeyError as exc:
+        raise SystemExit(exc.args[0])
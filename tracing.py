@@ -0,0 +1,250 @@
+# tracing.py
+"""Stage tracing: wall time, tokens, payload bytes and cache hits per stage.
+
+Off unless `LLM_CNC_TRACE=<file.jsonl>` is set (or `enable(path)` is called);
+then every finished run – a root span and all of its children – is appended
+to that file, one JSON line per span:
+    {"trace", "id", "parent", "name", "ts_us", "dur_ms", "thread", "attrs", "counts"}
+`counts` are summed into the parent when a span ends, so a stage's
+prompt_tokens / completion_tokens / llm_calls / cache_hits / payload_bytes /
+retries include everything below it.  Context is kept in a ContextVar, so spans nest
+across `asyncio` tasks and `asyncio.to_thread`; use `wrap()` for thread pools.
+
+Traced stages: extract_geometry, get_relevant_context, llm.chat (one per API
+call or cache hit), validate_plan, summarize_validation, the initial plan and
+every optimise_plan round.
+
+Usage:
+    with tracing.span("run", drawing=path):          # root span = one run
+        ...
+    @tracing.traced()                                 # span named after the function
+    def stage(...): ...
+    tracing.add(cache_hits=1)                         # counter on the current span
+
+    python tracing.py summary traces.jsonl [more.jsonl …]   # p50 / p95 per stage over runs
+    python tracing.py chrome traces.jsonl -o trace.json     # chrome://tracing, Perfetto
+"""
+from __future__ import annotations
+import contextvars, functools, json, os, threading, time, uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional
+
+# ---------------------------------------------------------------------------
+# CONFIG
+# ---------------------------------------------------------------------------
+_ENV = "LLM_CNC_TRACE"
+COUNTERS = ("llm_calls", "cache_hits", "prompt_tokens", "completion_tokens", "payload_bytes", "retries")
+
+_path: Optional[Path] = Path(os.environ[_ENV]) if os.getenv(_ENV) else None
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("llm_cnc_span", default=None)
+_lock = threading.Lock()
+_finished: Dict[str, List["Span"]] = {}          # trace id -> ended spans, until the root ends
+
+
+class Span:
+    __slots__ = ("name", "root", "trace", "id", "parent", "ts_us", "dur_ms", "thread", "attrs", "counts", "_t0")
+
+    def __init__(self, name: str, parent: Optional["Span"], attrs: Dict):
+        self.name, self.parent = name, parent
+        self.root = parent.root if parent else self
+        self.trace = parent.trace if parent else uuid.uuid4().hex[:16]
+        self.id = uuid.uuid4().hex[:8]
+        self.ts_us = time.time_ns() // 1000
+        self.thread = threading.get_ident()
+        self.attrs, self.counts, self.dur_ms = dict(attrs), {}, None
+        self._t0 = time.perf_counter()
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def add(self, **counts: int) -> None:
+        with _lock:
+            for k, v in counts.items():
+                self.counts[k] = self.counts.get(k, 0) + v
+
+    def end(self) -> None:
+        if self.dur_ms is not None:
+            return
+        self.dur_ms = (time.perf_counter() - self._t0) * 1000
+        with _lock:
+            if self.parent is not None:
+                for k, v in self.counts.items():
+                    self.parent.counts[k] = self.parent.counts.get(k, 0) + v
+            late = self.root.dur_ms is not None and self.root is not self     # run already written
+            spans = [self] if late else _finished.setdefault(self.trace, [])
+            if not late:
+                spans.append(self)
+            if self.parent is None:
+                del _finished[self.trace]
+        if self.parent is None or late:
+            _write(spans)
+
+    def to_dict(self) -> Dict:
+        return {"trace": self.trace, "id": self.id, "parent": self.parent.id if self.parent else None,
+                "name": self.name, "ts_us": self.ts_us, "dur_ms": round(self.dur_ms or 0.0, 3),
+                "thread": self.thread, "attrs": self.attrs, "counts": self.counts}
+
+
+class _NoSpan:
+    """Stand-in while tracing is off: accepts everything, records nothing."""
+    def set(self, **attrs) -> None: ...
+    def add(self, **counts) -> None: ...
+    def end(self) -> None: ...
+
+
+_NO_SPAN = _NoSpan()
+
+
+def enable(path: str | Path) -> None:
+    """Append finished runs to `path` (JSONL) from now on."""
+    global _path
+    _path = Path(path)
+
+
+def disable() -> None:
+    global _path
+    _path = None
+
+
+def enabled() -> bool:
+    return _path is not None
+
+
+def _write(spans: List[Span]) -> None:
+    if _path is None:
+        return
+    lines = "".join(json.dumps(s.to_dict(), ensure_ascii=False) + "\n"
+                    for s in sorted(spans, key=lambda s: s.ts_us))
+    with _lock, open(_path, "a", encoding="utf-8") as out:
+        out.write(lines)
+
+
+def current() -> Span | _NoSpan:
+    return _current.get() or _NO_SPAN
+
+
+def add(**counts: int) -> None:
+    """Add to the counters of the current span (no-op outside a span)."""
+    current().add(**counts)
+
+
+def start_span(name: str, **attrs) -> Span | _NoSpan:
+    """A child of the current span that is *not* made current – for generators,
+    whose body runs in the caller's context between items.  Call `.end()`."""
+    if _path is None:
+        return _NO_SPAN
+    return Span(name, _current.get(), attrs)
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Span | _NoSpan]:
+    """Time the block as a child of the current span (a new run if there is none)."""
+    if _path is None:
+        yield _NO_SPAN
+        return
+    sp = Span(name, _current.get(), attrs)
+    token = _current.set(sp)
+    try:
+        yield sp
+    except BaseException as exc:
+        sp.set(error=type(exc).__name__)
+        raise
+    finally:
+        _current.reset(token)
+        sp.end()
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """Decorator: run the function inside `span(name or function name)`."""
+    def deco(fn: Callable) -> Callable:
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _path is None:
+                return fn(*args, **kwargs)
+            with span(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def wrap(fn: Callable) -> Callable:
+    """`fn` bound to the current context, for `ThreadPoolExecutor.submit / map`."""
+    ctx = contextvars.copy_context()
+    return lambda *a, **kw: ctx.copy().run(fn, *a, **kw)
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Export and summary
+# ─────────────────────────────────────────────────────────────────────────────
+def read_spans(paths: List[str | Path]) -> List[Dict]:
+    return [json.loads(ln) for p in paths for ln in Path(p).read_text(encoding="utf-8").splitlines()
+            if ln.strip()]
+
+
+def to_chrome(spans: List[Dict]) -> Dict:
+    """Chrome trace-event format ("X" complete events); one process per run."""
+    pids = {t: i + 1 for i, t in enumerate(dict.fromkeys(s["trace"] for s in spans))}
+    events = [{"name": s["name"], "ph": "X", "ts": s["ts_us"], "dur": round(s["dur_ms"] * 1000),
+               "pid": pids[s["trace"]], "tid": s["thread"], "args": {**s["attrs"], **s["counts"]}}
+              for s in spans]
+    events += [{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": f"run {t}"}}
+               for t, pid in pids.items()]
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def _pct(values: List[float], q: float) -> float:
+    v = sorted(values)
+    return v[min(len(v) - 1, int(round(q * (len(v) - 1))))]
+
+
+def summarize(spans: List[Dict]) -> List[Dict]:
+    """Per stage name: runs, calls, p50 / p95 / max ms, and counters per run."""
+    runs = len({s["trace"] for s in spans})
+    by_name: Dict[str, List[Dict]] = {}
+    for s in spans:
+        by_name.setdefault(s["name"], []).append(s)
+    out = []
+    for name, ss in by_name.items():
+        dur = [s["dur_ms"] for s in ss]
+        row = {"stage": name, "runs": len({s["trace"] for s in ss}), "calls": len(ss),
+               "p50_ms": _pct(dur, 0.5), "p95_ms": _pct(dur, 0.95), "max_ms": max(dur),
+               "total_ms_per_run": sum(dur) / max(runs, 1)}
+        for k in COUNTERS:
+            row[k] = sum(s["counts"].get(k, 0) for s in ss) / max(runs, 1)
+        out.append(row)
+    return sorted(out, key=lambda r: -r["total_ms_per_run"])
+
+
+def _print_summary(rows: List[Dict], runs: int) -> None:
+    print(f"{runs} run(s); counters are per run and include nested stages\n")
+    print(f"{'stage':22s} {'calls':>6s} {'p50 ms':>9s} {'p95 ms':>9s} {'max ms':>9s} {'ms/run':>9s} "
+          f"{'llm':>5s} {'hits':>5s} {'tok in':>8s} {'tok out':>8s} {'KB out':>8s}")
+    for r in rows:
+        print(f"{r['stage'][:22]:22s} {r['calls']:6d} {r['p50_ms']:9.1f} {r['p95_ms']:9.1f} {r['max_ms']:9.1f} "
+              f"{r['total_ms_per_run']:9.1f} {r['llm_calls']:5.1f} {r['cache_hits']:5.1f} "
+              f"{r['prompt_tokens']:8.0f} {r['completion_tokens']:8.0f} {r['payload_bytes'] / 1024:8.1f}")
+
+
+if __name__ == "__main__":
+    import argparse
+    cli = argparse.ArgumentParser(description="Summarise or convert stage traces")
+    sub = cli.add_subparsers(dest="cmd", required=True)
+    s = sub.add_parser("summary", help="percentiles per stage over all runs")
+    s.add_argument("traces", nargs="+")
+    s.add_argument("--json", action="store_true", help="print the rows as JSON")
+    s = sub.add_parser("chrome", help="convert to Chrome trace-event JSON")
+    s.add_argument("traces", nargs="+")
+    s.add_argument("-o", "--out", default="trace.json")
+    a = cli.parse_args()
+    spans = read_spans(a.traces)
+    if a.cmd == "chrome":
+        Path(a.out).write_text(json.dumps(to_chrome(spans)), encoding="utf-8")
+        print(f"{len(spans)} spans → {a.out} (open in chrome://tracing or ui.perfetto.dev)")
+    else:
+        rows = summarize(spans)
+        if a.json:
+            print(json.dumps(rows, indent=1))
+        else:
+            _print_summary(rows, len({s["trace"] for s in spans}))